@@ -0,0 +1,325 @@
+import time
+import asyncio
+import contextlib
+import contextvars
+import threading
+import httpx
+import Levenshtein
+from openai import AsyncOpenAI
+from structai import LLMAgent, multi_thread, str2dict, str2list, load_file, extract_text_outputs
+from structai.llm_api import _completion_token_limit_kwargs, _encode_image_data_url
+from utils.llm_cache import get_response_cache, hash_file, hash_text
+from utils.scheduler import get_scheduler, estimate_tokens, PRIORITY_NORMAL
+
+try:
+    import h2 # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+_MISS = object()
+
+
+class BaseAgent(LLMAgent):
+    """
+    LLMAgent shared by every Manalyzer agent.
+
+    `safe_api` results are stored in a content-addressed on-disk cache keyed on the model,
+    system prompt, query, image hashes, sampling parameters and validation arguments, so
+    rerunning a stage over unchanged inputs makes no LLM calls.
+
+    Every request that does reach the provider goes through the process-wide LLMScheduler
+    (utils/scheduler.py), which enforces per-model rate limits across agents. Pass
+    `priority=PRIORITY_HIGH` to `safe_api` to move a request ahead of normal traffic.
+
+    With use_async=True, `run_parallel` fans out over an asyncio event loop instead of a thread
+    pool: requests go through `asafe_api` on a pooled (HTTP/2 when `h2` is installed) AsyncOpenAI
+    client, bounded by `async_max_concurrency` and cancelled once `time_limit` is exceeded.
+    """
+    def __init__(self, *args, use_cache=True, use_async=False, async_max_concurrency=512, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.use_cache = use_cache
+        self.cache = get_response_cache() if use_cache else None
+        self.cache_stats = {'hit': 0, 'miss': 0}
+        self._cache_stats_lock = threading.Lock()
+        self.scheduler = get_scheduler()
+
+        self.use_async = use_async
+        self.async_max_concurrency = async_max_concurrency
+        # (AsyncOpenAI client, semaphore) of the running event loop, see async_session
+        self._async_session = contextvars.ContextVar(f'async_session_{id(self)}', default=None)
+
+    def cache_key(self, query, system_prompt=None, return_example=None, **kwargs):
+        image_paths = kwargs.get('image_paths', None) or []
+        image = kwargs.get('image', None)
+        return self.cache.make_key(
+            self.model_version,
+            self.system_prompt if system_prompt is None else system_prompt,
+            query,
+            [hash_file(p) for p in image_paths],
+            hash_text(image) if isinstance(image, str) else None,
+            kwargs.get('temperature', self.temperature),
+            kwargs.get('n', 1),
+            kwargs.get('max_tokens', self.max_tokens),
+            kwargs.get('history', None),
+            return_example,
+            [kwargs.get(k, None) for k in ['list_len', 'list_min', 'list_max', 'check_keys']],
+        )
+
+    def _estimate_request_tokens(self, query, system_prompt=None, **kwargs):
+        prompt = (self.system_prompt if system_prompt is None else system_prompt) or ''
+        return estimate_tokens(prompt) + estimate_tokens(query) + 1000 * len(kwargs.get('image_paths', None) or [])
+
+    def llm_api(self, query, system_prompt=None, **kwargs):
+        return self.scheduler.call(
+            self.model_version,
+            lambda: super(BaseAgent, self).llm_api(query, system_prompt, **kwargs),
+            tokens=self._estimate_request_tokens(query, system_prompt, **kwargs),
+            priority=kwargs.get('priority', PRIORITY_NORMAL),
+            count_output=lambda responses: sum(estimate_tokens(r) for r in responses or []),
+        )
+
+    def log_scheduler_stats(self):
+        for model, metrics in self.scheduler.metrics().items():
+            self.logger.info(f'LLM scheduler [{model}]: {metrics}')
+
+    def _count(self, name):
+        with self._cache_stats_lock:
+            self.cache_stats[name] += 1
+
+    def _cache_lookup(self, query, system_prompt=None, return_example=None, **kwargs):
+        """Return (cache key, cached result or _MISS); the key is None when caching is off."""
+        if not self.use_cache:
+            return None, _MISS
+        key = self.cache_key(query, system_prompt, return_example, **kwargs)
+        result = self.cache.get(key, _MISS)
+        self._count('hit' if result is not _MISS else 'miss')
+        return key, result
+
+    def _collect(self, response_list, responses, return_example=None, **kwargs):
+        """Add validated responses to response_list; returns (response_list, whether n results are collected)."""
+        n = kwargs.get('n', 1)
+        response_list = response_list + self.parse_responses(responses, return_example, **kwargs)
+        if len(response_list) >= n:
+            return response_list[:n], True
+        return response_list, False
+
+    def _finish(self, key, response_list, n=1):
+        if len(response_list) == 0:
+            return None # 失败的请求不缓存，下次重跑时重新请求
+        result = response_list[0] if n == 1 else response_list
+        if key is not None:
+            self.cache.set(key, result, namespace=type(self).__name__)
+        return result
+
+    def safe_api(self, query, system_prompt=None, return_example=None, max_try=None, wait_time=0.0, **kwargs):
+        """structai's safe_api (retry until n valid results), behind the response cache."""
+        key, result = self._cache_lookup(query, system_prompt, return_example, **kwargs)
+        if result is not _MISS:
+            return result
+        max_try = self.max_try if max_try is None else max_try
+        response_list = []
+        for try_idx in range(max_try):
+            try:
+                response_list, done = self._collect(response_list, self.llm_api(query, system_prompt, **kwargs), return_example, **kwargs)
+                if done:
+                    break
+            except Exception as e:
+                print(f'[===ERROR===][safe_api][{type(e).__name__}: {e}]')
+                if try_idx < max_try - 1:
+                    time.sleep(wait_time)
+        return self._finish(key, response_list, kwargs.get('n', 1))
+
+    def run_requests(self, steps):
+        """
+        Drive a generator that yields safe_api keyword arguments and is sent back their results,
+        returning its return value. Agents write multi-request logic once as such a generator;
+        `arun_requests` runs the same generator on the asyncio path.
+        """
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self.safe_api(**request))
+        except StopIteration as e:
+            return e.value
+
+    def log_cache_stats(self):
+        if not self.use_cache:
+            return
+        hit, miss = self.cache_stats['hit'], self.cache_stats['miss']
+        total = hit + miss
+        rate = hit / total if total > 0 else 0.0
+        self.logger.info(f'LLM cache [{type(self).__name__}]: {hit} hits, {miss} misses ({rate:.1%} hit rate)')
+
+    # ---------------- asyncio path ----------------
+
+    @contextlib.asynccontextmanager
+    async def async_session(self):
+        """
+        Pooled AsyncOpenAI client and concurrency semaphore for the requests made inside this block.
+        httpx clients and asyncio semaphores are bound to one event loop, so every `run_parallel`
+        call (possibly from several threads, each with its own loop) opens its own session; tasks
+        started inside the block see it through a context variable.
+        """
+        http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=self.async_max_concurrency, max_keepalive_connections=self.async_max_concurrency),
+            timeout=self.time_limit,
+        )
+        client = AsyncOpenAI(api_key=self.api_key, base_url=self.api_base, http_client=http_client)
+        token = self._async_session.set((client, asyncio.Semaphore(self.async_max_concurrency)))
+        try:
+            yield
+        finally:
+            self._async_session.reset(token)
+            await client.close()
+
+    def _build_messages(self, query, system_prompt=None, **kwargs):
+        if system_prompt is None:
+            system_prompt = self.system_prompt
+        image_paths = kwargs.get('image_paths', None)
+        if image_paths is None:
+            content = query
+        else:
+            content = [{"type": "text", "text": query}]
+            for image_path in image_paths:
+                try:
+                    image_url = _encode_image_data_url(load_file(image_path))
+                except Exception:
+                    continue
+                content.append({"type": "image_url", "image_url": {"url": image_url}})
+        history = kwargs.get('history', None)
+        if isinstance(history, list) and len(history) > 0:
+            return [{"role": "system", "content": system_prompt}] + history + [{"role": "user", "content": content}]
+        return [{"role": "system", "content": system_prompt}, {"role": "user", "content": content}]
+
+    async def _allm_api_impl(self, query, system_prompt=None, **kwargs):
+        if kwargs.get('use_responses_api', self.use_responses_api):
+            # Responses API 没有异步实现，退回线程
+            return await asyncio.to_thread(super(BaseAgent, self).llm_api, query, system_prompt, **kwargs)
+        if self._async_session.get() is None: # 不在 run_parallel 中调用时，为这一次请求单独建立连接
+            async with self.async_session():
+                return await self._allm_api_impl(query, system_prompt, **kwargs)
+        client, semaphore = self._async_session.get()
+        create_kwargs = {
+            "model": self.model_version,
+            "messages": self._build_messages(query, system_prompt, **kwargs),
+            "temperature": kwargs.get('temperature', self.temperature),
+            "n": kwargs.get('n', 1),
+        }
+        create_kwargs.update(_completion_token_limit_kwargs(self.model_version, kwargs.get('max_tokens', self.max_tokens)))
+        async with semaphore:
+            response = await asyncio.wait_for(client.chat.completions.create(**create_kwargs), timeout=self.time_limit)
+        return extract_text_outputs(response)
+
+    async def allm_api(self, query, system_prompt=None, **kwargs):
+        return await self.scheduler.acall(
+            self.model_version,
+            lambda: self._allm_api_impl(query, system_prompt, **kwargs),
+            tokens=self._estimate_request_tokens(query, system_prompt, **kwargs),
+            priority=kwargs.get('priority', PRIORITY_NORMAL),
+            count_output=lambda responses: sum(estimate_tokens(r) for r in responses or []),
+        )
+
+    def parse_responses(self, responses, return_example=None, **kwargs):
+        """Validate raw responses the way structai's safe_api does (used by safe_api and asafe_api); invalid samples are dropped, raises only when none is valid."""
+        if return_example is None or isinstance(return_example, str):
+            return list(responses)
+        if not isinstance(return_example, (list, dict)):
+            return []
+
+        results = []
+        error = None
+        for response in responses:
+            try:
+                results.append(self.parse_response(response, return_example, **kwargs))
+            except Exception as e:
+                error = e
+        if len(results) == 0 and error is not None:
+            raise error
+        if error is not None:
+            print(f'[===WARNING===][BaseAgent][parse_responses] {len(responses) - len(results)}/{len(responses)} samples dropped [{type(error).__name__}: {error}]')
+        return results
+
+    def parse_response(self, response, return_example, **kwargs):
+        """Parse and validate one sample against a list or dict return_example, raises on mismatch."""
+        if isinstance(return_example, list):
+            result_list = str2list(response)
+            list_len = kwargs.get('list_len', None)
+            if list_len is not None:
+                assert len(result_list) == list_len, f"[===ERROR===][BaseAgent][parse_responses] length {len(result_list)} != {list_len}"
+            if len(return_example) > 0:
+                for result_item in result_list:
+                    if isinstance(return_example[0], (float, int)):
+                        assert isinstance(result_item, (float, int)), f"[===ERROR===][BaseAgent][parse_responses] item type {type(result_item)}"
+                    else:
+                        assert type(result_item) == type(return_example[0]), f"[===ERROR===][BaseAgent][parse_responses] item type {type(result_item)}"
+            list_min = kwargs.get('list_min', None)
+            list_max = kwargs.get('list_max', None)
+            for result_item in result_list:
+                if list_min is not None:
+                    assert result_item >= list_min, f"[===ERROR===][BaseAgent][parse_responses] {result_item} < list_min {list_min}"
+                if list_max is not None:
+                    assert result_item <= list_max, f"[===ERROR===][BaseAgent][parse_responses] {result_item} > list_max {list_max}"
+            return result_list
+
+        elif isinstance(return_example, dict):
+            result_dict = str2dict(response)
+            if kwargs.get('check_keys', True):
+                result_dict_correct = {}
+                for k in return_example.keys():
+                    if k in result_dict:
+                        result_dict_correct[k] = result_dict[k]
+                    else:
+                        for out_k in result_dict.keys():
+                            if len(k) > 5 and Levenshtein.distance(out_k.lower(), k.lower()) <= 2:
+                                result_dict_correct[k] = result_dict[out_k]
+                                break
+                    assert k in result_dict_correct, f"[===ERROR===][BaseAgent][parse_responses] missing key {k}"
+                result_dict = result_dict_correct
+            return result_dict
+
+    async def asafe_api(self, query, system_prompt=None, return_example=None, max_try=None, wait_time=0.0, **kwargs):
+        """asyncio version of safe_api, sharing its cache, scheduler and validation."""
+        key, result = self._cache_lookup(query, system_prompt, return_example, **kwargs)
+        if result is not _MISS:
+            return result
+        max_try = self.max_try if max_try is None else max_try
+        response_list = []
+        for try_idx in range(max_try):
+            try:
+                response_list, done = self._collect(response_list, await self.allm_api(query, system_prompt, **kwargs), return_example, **kwargs)
+                if done:
+                    break
+            except Exception as e:
+                print(f'[===ERROR===][asafe_api][{type(e).__name__}: {e}]')
+                if try_idx < max_try - 1:
+                    await asyncio.sleep(wait_time)
+        return self._finish(key, response_list, kwargs.get('n', 1))
+
+    async def arun_requests(self, steps):
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await self.asafe_api(**request))
+        except StopIteration as e:
+            return e.value
+
+    def run_parallel(self, inp_list, function, async_function=None, max_workers=40, use_tqdm=True):
+        """multi_thread(inp_list, function), or asyncio.gather over async_function when use_async is set."""
+        if not self.use_async or async_function is None:
+            return multi_thread(inp_list, function, max_workers=max_workers, use_tqdm=use_tqdm)
+
+        async def run_one(item):
+            try:
+                return await async_function(**item)
+            except Exception as e:
+                self.logger.error(f'Error processing item {str(item)[:200]} [{type(e).__name__}: {e}]')
+                return None
+
+        async def run_all():
+            async with self.async_session():
+                return await asyncio.gather(*(run_one(item) for item in inp_list))
+
+        return list(asyncio.run(run_all()))
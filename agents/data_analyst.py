@@ -1,6 +1,6 @@
 import os
 import re
-from structai import LLMAgent
+from agents.base_agent import BaseAgent
 from utils.logger import create_logger
 
 import numpy as np
@@ -129,7 +129,7 @@ except Exception as e:
 """
 
 
-class DataAnalyst(LLMAgent):
+class DataAnalyst(BaseAgent):
     def __init__(self,
                 save_dir: str,
                 api_key = None,
@@ -143,10 +143,11 @@ class DataAnalyst(LLMAgent):
                 time_limit = 5*60,
                 max_try = 1,
                 use_responses_api = False,
+                use_cache = True,
                 field = 'climate',
                 max_code_try = 3
                 ):
-        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api)
+        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api, use_cache=use_cache)
         self.system_prompt = self.system_prompt.replace('<INPUT1>', field)
         self.field = field
         self.max_code_try = max_code_try
@@ -216,6 +217,7 @@ class DataAnalyst(LLMAgent):
 
                 if try_idx == self.max_code_try-1:
                     self.logger.info(f'[===ERROR===][code][Failed]')
+        self.log_cache_stats()
 
 
 if __name__ == '__main__':
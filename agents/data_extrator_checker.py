@@ -1,8 +1,12 @@
 import os
-from structai import LLMAgent, multi_thread
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from agents.base_agent import BaseAgent
 from utils.logger import create_logger
-from utils.reader import read_markdown
-from utils.clean import clean_dict
+from utils.bm25 import tokenize
+from utils.paper_ir import get_paper_ir, paper_sections
+from utils.scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, estimate_tokens
 from copy import deepcopy
 import json
 
@@ -153,6 +157,9 @@ query_prompt_check = """
 {'Data Accuracy': 9, 'Semantic Consistency': 6, 'Data Completeness': 8, 'Overall Score': 7, 'Suggestion': "You should add the data from **Table 2, Column 3** to the integrated table, as it contains relevant information that is currently missing. Additionally, ensure that the values from **Table 1, Rows 5 to 10** are included, as they have not been transferred. Finally, check **Table 3, Column Revenue** to confirm all its values are present in the integrated table."}
 """
 
+check_example = {'Data Accuracy': 9, 'Semantic Consistency': 6, 'Data Completeness': 8, 'Overall Score': 7, 'Suggestion': ''}
+
+
 def count_consecutive_digits(string):
     count = 0
     for i in range(len(string) - 1):
@@ -161,7 +168,55 @@ def count_consecutive_digits(string):
     return count
 
 
-class DataExtratorWithChecker(LLMAgent):
+NUMBER_PATTERN = re.compile(r'\d+(?:,\d{3})*(?:\.\d+)?')
+
+
+def numeric_values(text):
+    """Distinct numbers in text, normalised (no thousand separators, 40.0 -> 40); single digits are skipped as they are mostly indices."""
+    values = set()
+    for number in NUMBER_PATTERN.findall(text):
+        number = number.replace(',', '')
+        if len(number) < 2:
+            continue
+        values.add(number.rstrip('0').rstrip('.') if '.' in number else number)
+    return values
+
+
+def template_terms(table_template, topic_of_interest=''):
+    return {token for token in tokenize(f'{table_template} {topic_of_interest}') if len(token) >= 2 and not token.isdigit()}
+
+
+def relevant_values(part, terms):
+    """
+    Numbers of a part that could fill the template: every value of a markdown table whose header
+    mentions a template term, otherwise the values of the rows / sentences that mention one.
+    Years, citation numbers and figure indices in unrelated sentences are left out.
+    """
+    lines = [line for line in re.split(r'\n|/n|(?<=[.;])\s+', part) if len(line.strip()) > 0]
+    table_lines = [line for line in lines if line.strip().startswith('|')]
+    if len(table_lines) > 0 and len(set(tokenize(table_lines[0])) & terms) > 0:
+        return set().union(*[numeric_values(line) for line in table_lines[1:]])
+    values = set()
+    for line in lines:
+        if len(set(tokenize(line)) & terms) > 0:
+            values |= numeric_values(line)
+    return values
+
+
+def extraction_coverage(integrated_table, part_list, terms=None):
+    """
+    Share of the source numbers that appear in the integrated table, and its number of data rows.
+    With terms (see template_terms) only the numbers that could fill the template are counted.
+    """
+    rows = [line for line in integrated_table.split('\n') if line.strip().startswith('|') and not set(line.strip()) <= set('|-: ')]
+    part_values = [numeric_values(part) if terms is None else relevant_values(part, terms) for part in part_list]
+    source_values = set().union(*part_values) if len(part_list) > 0 else set()
+    if len(source_values) == 0:
+        return 1.0, max(len(rows) - 1, 0)
+    return len(source_values & numeric_values(integrated_table)) / len(source_values), max(len(rows) - 1, 0)
+
+
+class DataExtratorWithChecker(BaseAgent):
     def __init__(self,
                 save_dir: str,
                 api_key = None,
@@ -175,19 +230,38 @@ class DataExtratorWithChecker(LLMAgent):
                 time_limit = 5*60,
                 max_try = 1,
                 use_responses_api = False,
+                use_cache = True,
                 field = 'science',
                 first_level_threshold = 0.5,
                 extract_n = 5,
                 extract_temperature = 0.9,
                 check_threshold = 6,
                 max_check_num = 2,
+                paper_info_dict = None,
+                use_async = False,
+                adaptive_n = True,
+                adaptive_initial_n = 1,
+                min_coverage = 0.6,
+                adaptive_part_types = ('table',),
+                path_workers = 8,
                 ):
-        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api)
+        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api, use_cache=use_cache, use_async=use_async)
+        # 自适应采样：先取 adaptive_initial_n 个结果，源数据覆盖率低于 min_coverage 时才补足 extract_n 个
+        self.adaptive_n = adaptive_n
+        self.adaptive_initial_n = adaptive_initial_n
+        self.min_coverage = min_coverage
+        # section 的覆盖率尚未在真实论文上校准，默认只对 table 自适应，section 仍一次取 extract_n 个
+        self.adaptive_part_types = adaptive_part_types
+        self.extract_stats = {'extractions': 0, 'samples': 0, 'baseline_samples': 0, 'saved_output_tokens': 0, 'resent_input_tokens': 0}
+        self._extract_stats_lock = threading.Lock()
         self.system_prompt_1_level_filter = system_prompt_1_level_filter.replace('<INPUT1>', field)
         self.system_prompt_2_level_filter = system_prompt_2_level_filter.replace('<INPUT1>', field)
         self.system_prompt_check = system_prompt_check.replace('<INPUT1>', field)
         self.first_level_threshold = first_level_threshold
         self.extract_n = extract_n
+        self.path_workers = path_workers # extract_with_check 中 section 路径共用的线程数
+        self._path_executor = None
+        self._path_executor_lock = threading.Lock()
         self.extract_temperature = extract_temperature
         self.check_threshold = check_threshold
         self.max_check_num = max_check_num
@@ -196,36 +270,42 @@ class DataExtratorWithChecker(LLMAgent):
         self.integrated_table_dir = os.path.join(save_dir, '3_integrated_table')
         os.makedirs(self.integrated_table_dir, exist_ok=True)
 
-        with open(os.path.join(save_dir, '4_converted_paper.json'), 'r', encoding='utf-8') as file:
-            self.paper_info_dict = json.load(file)
+        if paper_info_dict is None:
+            with open(os.path.join(save_dir, '4_converted_paper.json'), 'r', encoding='utf-8') as file:
+                paper_info_dict = json.load(file)
+        self.paper_info_dict = paper_info_dict
         self.integrated_table_info_path = os.path.join(save_dir, '5_integrated_table_info.json')
 
         self.paper_text_dict = {}
         self.paper_table_dict = {}
 
         for paper_idx, paper_info in self.paper_info_dict.items():
-            paper_content = read_markdown(paper_info['md_path'], include_img=False)
-            paper_content = clean_dict(paper_content)
-            self.paper_text_dict[paper_idx] = paper_content
-            self.paper_text_dict[paper_idx]['images'] = []
-
-            with open(paper_info['converted_text_path'], 'r', encoding='utf-8') as file:
-                paper_content_list = json.load(file)
-            self.paper_table_dict[paper_idx] = []
-            for content in paper_content_list:
-                if 'converted_type' in content:
-                    if content['converted_type'] == 'markdown':
-                        self.paper_table_dict[paper_idx].append(content['converted_content'])
-                    elif content['converted_type'] == 'text':
-                        self.paper_text_dict[paper_idx]['images'].append(content['converted_content'])
-
-            self.paper_text_dict[paper_idx] = [f"{k}:/n{'/n'.join(v)}" for k, v in self.paper_text_dict[paper_idx].items()]
-            self.paper_text_dict[paper_idx] = [text for text in self.paper_text_dict[paper_idx] if len(text) >= 20 and count_consecutive_digits(text) >= 2]
+            self.load_paper(paper_idx, paper_info)
 
         self.logger.info(f'Load {len(self.paper_info_dict)} papers')
 
 
-    def first_level_extract(self, part_list, part_type, topic_of_interest):
+    def load_paper(self, paper_idx, paper_info):
+        paper_content = paper_sections(get_paper_ir(paper_info), include_img=False)
+        paper_content['images'] = []
+
+        with open(paper_info['converted_text_path'], 'r', encoding='utf-8') as file:
+            paper_content_list = json.load(file)
+        paper_table_list = []
+        for content in paper_content_list:
+            if 'converted_type' in content:
+                if content['converted_type'] == 'markdown':
+                    paper_table_list.append(content['converted_content'])
+                elif content['converted_type'] == 'text':
+                    paper_content['images'].append(content['converted_content'])
+
+        paper_text_list = [f"{k}:/n{'/n'.join(v)}" for k, v in paper_content.items()]
+        paper_text_list = [text for text in paper_text_list if len(text) >= 20 and count_consecutive_digits(text) >= 2]
+        self.paper_text_dict[paper_idx] = paper_text_list
+        self.paper_table_dict[paper_idx] = paper_table_list
+
+
+    def first_level_query(self, part_list, part_type, topic_of_interest):
         assert part_type in ['table', 'section'], f'part_type {part_type} not in [table, section]'
         all_part_text = ''
         part_num = len(part_list)
@@ -234,12 +314,9 @@ class DataExtratorWithChecker(LLMAgent):
 
         system_prompt = self.system_prompt_1_level_filter.replace('<INPUT_TYPE>', part_type)
         query = query_prompt_1_level_filter.replace('<INPUT_TYPE>', part_type).replace('<INPUT1>', topic_of_interest).replace('<INPUT2>', all_part_text).replace('<INPUT3>', str(part_num))
-        
-        # print(system_prompt)
-        # print(query)
-        include_tag = self.safe_api(query, system_prompt, return_example=[0.1], list_len=part_num, list_min=0.0, list_max=1.0)
-        # print(include_tag)
-        # print()
+        return system_prompt, query
+
+    def first_level_filter(self, part_list, include_tag):
         include_tag = [1 if x >= self.first_level_threshold else 0 for x in include_tag]
 
         part_list_after_filtering = []
@@ -249,6 +326,22 @@ class DataExtratorWithChecker(LLMAgent):
         
         return part_list_after_filtering
 
+    # *_steps 生成器 yield safe_api 的参数并接收结果，同步与异步路径共用（见 BaseAgent.run_requests）
+    def first_level_steps(self, part_list, part_type, topic_of_interest):
+        system_prompt, query = self.first_level_query(part_list, part_type, topic_of_interest)
+        # print(system_prompt)
+        # print(query)
+        include_tag = yield dict(query=query, system_prompt=system_prompt, return_example=[0.1], list_len=len(part_list), list_min=0.0, list_max=1.0)
+        # print(include_tag)
+        # print()
+        return self.first_level_filter(part_list, include_tag)
+
+    def first_level_extract(self, part_list, part_type, topic_of_interest):
+        return self.run_requests(self.first_level_steps(part_list, part_type, topic_of_interest))
+
+    async def afirst_level_extract(self, part_list, part_type, topic_of_interest):
+        return await self.arun_requests(self.first_level_steps(part_list, part_type, topic_of_interest))
+
     
     def separate_table_explanation(self, table_explanation: str):
         if "```markdown" in table_explanation:
@@ -268,7 +361,7 @@ class DataExtratorWithChecker(LLMAgent):
         }
     
 
-    def second_level_extract(self, part_list, part_type, topic_of_interest, table_template, **kwargs):
+    def second_level_query(self, part_list, part_type, topic_of_interest, table_template, **kwargs):
         assert part_type in ['table', 'section'], f'part_type {part_type} not in [table, section]'
 
         reference_answer = kwargs.get('reference_answer', None)
@@ -278,9 +371,6 @@ class DataExtratorWithChecker(LLMAgent):
         else:
             external_prompt = ''
 
-        temperature = kwargs.get('temperature', self.extract_temperature)
-        n = kwargs.get('n', self.extract_n)
-
         all_part_text = ''
         for part_idx, part in enumerate(part_list):
             all_part_text = all_part_text + part_format.replace('<INPUT_TYPE>', part_type).replace('<INPUT1>', str(part_idx+1)).replace('<INPUT2>', part)
@@ -292,11 +382,47 @@ class DataExtratorWithChecker(LLMAgent):
 
         system_prompt = self.system_prompt_2_level_filter.replace('<INPUT_TYPE>', part_type)
         query = query_prompt_2_level_filter.replace('<INPUT_TYPE>', part_type).replace('<INPUT1>', topic_of_interest).replace('<INPUT2>', all_part_text).replace('<INPUT3>', table_template)
-        # print(system_prompt)
-        # print(query+external_prompt)
-        # print(n)
-        responses = self.safe_api(query+external_prompt, system_prompt, n=n, temperature=temperature)
-        # print(responses)
+        return system_prompt, query, external_prompt
+
+    def second_level_kwargs(self, external_prompt, **kwargs):
+        # refinement rounds keep a paper's extraction open, so they go ahead of new extractions
+        return {
+            'n': kwargs.get('n', self.extract_n),
+            'temperature': kwargs.get('temperature', self.extract_temperature),
+            'priority': PRIORITY_HIGH if len(external_prompt) > 0 else PRIORITY_NORMAL,
+        }
+
+    def adaptive_n_round(self, part_list, responses, terms=None):
+        """
+        Score the samples so far by coverage of the source numbers (then data rows); returns the best
+        one, its coverage and whether more samples are needed.
+        """
+        scored = []
+        for response in responses:
+            coverage, num_rows = extraction_coverage(self.separate_table_explanation(response)['integrated_table'], part_list, terms)
+            scored.append((coverage, num_rows, response))
+        best = max(scored, key=lambda x: (x[0], x[1]))
+        return best[2], best[0], best[0] < self.min_coverage and len(responses) < self.extract_n
+
+    def log_adaptive_n(self, part_type, responses, coverage_best, resent_tokens=0):
+        # 与一次请求 n=extract_n 相比：少生成的输出 token 减去补采样时重新发送的输入 token
+        samples = len(responses)
+        saved_tokens = (self.extract_n - samples) * sum(estimate_tokens(r) for r in responses) // samples
+        with self._extract_stats_lock:
+            self.extract_stats['extractions'] += 1
+            self.extract_stats['samples'] += samples
+            self.extract_stats['baseline_samples'] += self.extract_n
+            self.extract_stats['saved_output_tokens'] += saved_tokens
+            self.extract_stats['resent_input_tokens'] += resent_tokens
+        self.logger.info(f'{part_type} extraction used {samples}/{self.extract_n} samples (coverage {coverage_best:.2f}), about {saved_tokens - resent_tokens} net tokens saved ({saved_tokens} output saved, {resent_tokens} input re-sent)')
+
+    def log_extract_stats(self):
+        stats = self.extract_stats
+        if stats['extractions'] > 0:
+            net_tokens = stats['saved_output_tokens'] - stats['resent_input_tokens']
+            self.logger.info(f"Adaptive sampling: {stats['samples']}/{stats['baseline_samples']} samples over {stats['extractions']} extractions, about {net_tokens} net tokens saved against n={self.extract_n} ({stats['saved_output_tokens']} output saved, {stats['resent_input_tokens']} input re-sent)")
+
+    def second_level_output(self, responses, system_prompt, query, external_prompt):
         if isinstance(responses, list):
             the_max_len = -1
             the_max_table_explanation = None
@@ -320,79 +446,163 @@ class DataExtratorWithChecker(LLMAgent):
         output_dict.update(table_explanation_dict)
 
         return output_dict
+
+    def second_level_steps(self, part_list, part_type, topic_of_interest, table_template, **kwargs):
+        system_prompt, query, external_prompt = self.second_level_query(part_list, part_type, topic_of_interest, table_template, **kwargs)
+        # print(system_prompt)
+        # print(query+external_prompt)
+        if self.adaptive_n and part_type in self.adaptive_part_types and 'n' not in kwargs and self.extract_n > self.adaptive_initial_n:
+            terms = template_terms(table_template, topic_of_interest)
+            responses = yield from self.adaptive_sample_steps(part_list, part_type, query+external_prompt, system_prompt, external_prompt, terms, **kwargs)
+        else:
+            responses = yield dict(query=query+external_prompt, system_prompt=system_prompt, **self.second_level_kwargs(external_prompt, **kwargs))
+        # print(responses)
+        return self.second_level_output(responses, system_prompt, query, external_prompt)
+
+    def second_level_extract(self, part_list, part_type, topic_of_interest, table_template, **kwargs):
+        return self.run_requests(self.second_level_steps(part_list, part_type, topic_of_interest, table_template, **kwargs))
+
+    async def asecond_level_extract(self, part_list, part_type, topic_of_interest, table_template, **kwargs):
+        return await self.arun_requests(self.second_level_steps(part_list, part_type, topic_of_interest, table_template, **kwargs))
+
+    def adaptive_sample_steps(self, part_list, part_type, query, system_prompt, external_prompt, terms=None, **kwargs):
+        responses = yield dict(query=query, system_prompt=system_prompt, **self.second_level_kwargs(external_prompt, **kwargs, n=self.adaptive_initial_n))
+        responses = [responses] if isinstance(responses, str) else responses
+        assert responses, "[===ERROR===][TableExtractor][Failed to get integrated table to markdown]"
+        best, coverage, need_more = self.adaptive_n_round(part_list, responses, terms)
+        resent_tokens = 0
+        if need_more:
+            more = yield dict(query=query, system_prompt=system_prompt, **self.second_level_kwargs(external_prompt, **kwargs, n=self.extract_n - len(responses)))
+            resent_tokens = estimate_tokens(system_prompt) + estimate_tokens(query)
+            responses = responses + ([more] if isinstance(more, str) else more or [])
+            best, coverage, _ = self.adaptive_n_round(part_list, responses, terms)
+        self.log_adaptive_n(part_type, responses, coverage, resent_tokens)
+        return best
     
 
-    def check(self, extract_output_dict):
-        query = query_prompt_check.replace('<INPUT1>', extract_output_dict['query']).replace('<INPUT2>', extract_output_dict['integrated_table']).replace('<INPUT3>', extract_output_dict['explanation'])
-        score = self.safe_api(query, self.system_prompt_check, return_example={'Data Accuracy': 9, 'Semantic Consistency': 6, 'Data Completeness': 8, 'Overall Score': 7, 'Suggestion': ''})
+    def check_query(self, extract_output_dict):
+        return query_prompt_check.replace('<INPUT1>', extract_output_dict['query']).replace('<INPUT2>', extract_output_dict['integrated_table']).replace('<INPUT3>', extract_output_dict['explanation'])
+
+    def check_decision(self, score):
         assert score is not None, "[===ERROR===][Checker][Failed to obtain score]"
         if score['Overall Score'] < self.check_threshold:
             score['Decision'] = 'reject'
         else:
             score['Decision'] = 'accept'
         return score
+
+    def check_steps(self, extract_output_dict):
+        score = yield dict(query=self.check_query(extract_output_dict), system_prompt=self.system_prompt_check, return_example=check_example, priority=PRIORITY_HIGH)
+        return self.check_decision(score)
+
+    def check(self, extract_output_dict):
+        return self.run_requests(self.check_steps(extract_output_dict))
+
+    async def acheck(self, extract_output_dict):
+        return await self.arun_requests(self.check_steps(extract_output_dict))
     
 
-    def extract_with_check(self, paper_idx, topic_of_interest, table_template):
-        def extract_with_check_(all_part, part_type, topic_of_interest, table_template):
+    def extract_path_steps(self, paper_idx, part_type, topic_of_interest, table_template):
+        # 单条路径（table 或 section）：一级筛选、二级抽取，再检查并按建议重新抽取
+        all_part = self.paper_table_dict[paper_idx] if part_type == 'table' else self.paper_text_dict[paper_idx]
+        try:
+            selected_part = yield from self.first_level_steps(all_part, part_type, topic_of_interest)
+            if len(selected_part) == 0:
+                return 'None'
+            extract_output_dict = yield from self.second_level_steps(selected_part, part_type, topic_of_interest, table_template)
+        except Exception as e:
+            self.logger.error(f"Error in extracting {part_type} from paper {paper_idx} [{e}]")
+            return 'None'
+        
+        extract_output_dict_original = deepcopy(extract_output_dict)
+
+        # check
+        for check_idx in range(self.max_check_num):
             try:
-                selected_part = self.first_level_extract(all_part, part_type, topic_of_interest)
-                if len(selected_part) == 0:
-                    return 'None'
-                extract_output_dict = self.second_level_extract(selected_part, part_type, topic_of_interest, table_template)
+                check_score = yield from self.check_steps(extract_output_dict)
+                if check_score['Decision'] == 'accept':
+                    break
             except Exception as e:
-                self.logger.error(f"Error in extracting {part_type} from paper {paper_idx} [{e}]")
-                return 'None'
-            
-            extract_output_dict_original = deepcopy(extract_output_dict)
-
-            # check
-            for check_idx in range(self.max_check_num):
-                try:
-                    check_score = self.check(extract_output_dict)
-                    if check_score['Decision'] == 'accept':
-                        break
-                except Exception as e:
-                    self.logger.error(f"Error in checking {part_type} from paper {paper_idx} [{e}]")
-                    continue
-                
-                self.logger.info(f"Check {check_idx+1} for {part_type} from paper {paper_idx} failed with suggestion: {check_score['Suggestion']}")
-                extract_output_dict = self.second_level_extract(selected_part, part_type, topic_of_interest, table_template,
-                                                                reference_answer=extract_output_dict['integrated_table'],
-                                                                suggestion=check_score['Suggestion'],
-                                                                temperature=0.0, n=1)
+                self.logger.error(f"Error in checking {part_type} from paper {paper_idx} [{e}]")
+                continue
             
-            return extract_output_dict if extract_output_dict is not None else extract_output_dict_original
+            self.logger.info(f"Check {check_idx+1} for {part_type} from paper {paper_idx} failed with suggestion: {check_score['Suggestion']}")
+            extract_output_dict = yield from self.second_level_steps(selected_part, part_type, topic_of_interest, table_template,
+                                                                     reference_answer=extract_output_dict['integrated_table'],
+                                                                     suggestion=check_score['Suggestion'],
+                                                                     temperature=0.0, n=1)
+        
+        return extract_output_dict if extract_output_dict is not None else extract_output_dict_original
+
+    def extract_path(self, paper_idx, part_type, topic_of_interest, table_template):
+        return self.run_requests(self.extract_path_steps(paper_idx, part_type, topic_of_interest, table_template))
 
+    async def aextract_path(self, paper_idx, part_type, topic_of_interest, table_template):
+        return await self.arun_requests(self.extract_path_steps(paper_idx, part_type, topic_of_interest, table_template))
 
-        all_table_list = self.paper_table_dict[paper_idx]
-        all_text_list = self.paper_text_dict[paper_idx]
+    def path_executor(self):
+        with self._path_executor_lock:
+            if self._path_executor is None:
+                self._path_executor = ThreadPoolExecutor(max_workers=self.path_workers)
+        return self._path_executor
 
-        # table
-        extract_output_dict_from_table = extract_with_check_(all_table_list, 'table', topic_of_interest, table_template)
-        extract_output_dict_from_text = extract_with_check_(all_text_list, 'section', topic_of_interest, table_template)
+    def extract_with_check(self, paper_idx, topic_of_interest, table_template):
+        # 单篇论文（streaming）的两条路径同时进行：section 提交到所有调用共用的线程池，table 在当前线程中运行；
+        # use_async 时在一个事件循环中 gather
+        if self.use_async:
+            mp_inp_list = [{'paper_idx': paper_idx, 'part_type': part_type, 'topic_of_interest': topic_of_interest, 'table_template': table_template} for part_type in ['table', 'section']]
+            extract_output_list = self.run_parallel(mp_inp_list, self.extract_path, self.aextract_path, use_tqdm=False)
+        else:
+            section_future = self.path_executor().submit(self.extract_path, paper_idx, 'section', topic_of_interest, table_template)
+            extract_output_list = [self.extract_path(paper_idx, 'table', topic_of_interest, table_template), section_future.result()]
         return {
-            'table': extract_output_dict_from_table,
-            'text': extract_output_dict_from_text
+            'table': extract_output_list[0] if extract_output_list[0] is not None else 'None',
+            'text': extract_output_list[1] if extract_output_list[1] is not None else 'None',
         }
 
 
-    def __call__(self, topic_of_interest, table_template):
-        self.logger.info(f'Start data extraction')
+    def save_integrated_table(self, paper_idx, paper_info, extract_output):
+        integrated_table_path = os.path.join(self.integrated_table_dir, f'{paper_idx}.json')
+        with open(integrated_table_path, 'w', encoding='utf-8') as f:
+            json.dump(extract_output, f, ensure_ascii=False, indent=4)
+        paper_info['integrated_table_path'] = integrated_table_path
+        return paper_info
+
+
+    def extract_paper(self, paper_idx, paper_info, topic_of_interest, table_template):
+        # extract a single paper, used by the streaming pipeline
+        self.load_paper(paper_idx, paper_info)
+        extract_output = self.extract_with_check(paper_idx, topic_of_interest, table_template)
+        return self.save_integrated_table(paper_idx, paper_info, extract_output)
+
+
+    def __call__(self, topic_of_interest, table_template, paper_ids: list=None):
+        # paper_ids: only extract these papers, the others reuse the integrated tables already in integrated_table_dir
+        if paper_ids is None:
+            paper_ids = list(self.paper_info_dict.keys())
+        paper_ids = [paper_idx for paper_idx in self.paper_info_dict if paper_idx in paper_ids]
+
+        self.logger.info(f'Start data extraction ({len(paper_ids)} papers)')
+        # table 与 section 两条路径互不依赖，作为独立任务提交到同一个线程池
         mp_inp_list = []
+        for paper_idx in paper_ids:
+            for part_type in ['table', 'section']:
+                mp_inp_list.append({'paper_idx': paper_idx, 'part_type': part_type, 'topic_of_interest': topic_of_interest, 'table_template': table_template})
+        extract_output_list = self.run_parallel(mp_inp_list, self.extract_path, self.aextract_path)
+        extract_output_list = [extract_output if extract_output is not None else 'None' for extract_output in extract_output_list]
+        extract_output_dict = {paper_idx: {'table': extract_output_list[2*num_idx], 'text': extract_output_list[2*num_idx+1]} for num_idx, paper_idx in enumerate(paper_ids)}
+
         for paper_idx, paper_info in self.paper_info_dict.items():
-            mp_inp_list.append({'paper_idx': paper_idx, 'topic_of_interest': topic_of_interest, 'table_template': table_template})
-        extract_output_list = multi_thread(mp_inp_list, self.extract_with_check)
-
-        for num_idx, (paper_idx, paper_info) in enumerate(self.paper_info_dict.items()):
-            integrated_table_path = os.path.join(self.integrated_table_dir, f'{paper_idx}.json')
-            with open(integrated_table_path, 'w', encoding='utf-8') as f:
-                json.dump(extract_output_list[num_idx], f, ensure_ascii=False, indent=4)
-            paper_info['integrated_table_path'] = integrated_table_path
+            if paper_idx in extract_output_dict:
+                self.save_integrated_table(paper_idx, paper_info, extract_output_dict[paper_idx])
+            else:
+                paper_info['integrated_table_path'] = os.path.join(self.integrated_table_dir, f'{paper_idx}.json')
         
         with open(self.integrated_table_info_path, 'w', encoding='utf-8') as f:
             json.dump(self.paper_info_dict, f, ensure_ascii=False, indent=4)
         self.logger.info(f'Finish data extraction')
+        self.log_extract_stats()
+        self.log_cache_stats()
 
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
 import os
-from structai import LLMAgent, multi_thread
+from structai import multi_thread
+from agents.base_agent import BaseAgent
 from utils.logger import create_logger
+from utils.llm_cache import hash_file
 import json
 import pandas as pd
 from io import StringIO
@@ -71,7 +73,7 @@ query_prompt = """
 
 """
 
-class DataMerger(LLMAgent):
+class DataMerger(BaseAgent):
     def __init__(self,
                 save_dir: str,
                 api_key = None,
@@ -85,13 +87,15 @@ class DataMerger(LLMAgent):
                 time_limit = 5*60,
                 max_try = 1,
                 use_responses_api = False,
+                use_cache = True,
                 ):
-        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api)
+        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api, use_cache=use_cache)
         self.logger = create_logger('DataMerger', os.path.join(save_dir, 'log'))
 
         with open(os.path.join(save_dir, '5_integrated_table_info.json'), 'r', encoding='utf-8') as file:
             self.paper_info_dict = json.load(file)
         self.merge_table_path = os.path.join(save_dir, 'meta_analysis.csv')
+        self.merged_papers_path = os.path.join(save_dir, 'meta_analysis_merged.json') # 已合并论文的 integrated table 哈希，增量合并时使用
         
         self.integrated_table_list = []
         for paper_id, paper_info in self.paper_info_dict.items():
@@ -108,7 +112,7 @@ class DataMerger(LLMAgent):
         self.logger.info(f'Loaded {len(self.integrated_table_list)} integrated tables')
     
 
-    def get_merge_integrated_table(self, table_template):
+    def get_merge_integrated_table(self, table_template, paper_ids=None):
         table_template_pd = pd.read_csv(StringIO(table_template), sep='|', skipinitialspace=True)
         table_template_pd = table_template_pd.iloc[1:, 1:-1]
         table_template_column = []
@@ -118,6 +122,8 @@ class DataMerger(LLMAgent):
         merge_df = pd.DataFrame(columns=table_template_column)
 
         for title, integrated_table in self.integrated_table_list:
+            if paper_ids is not None and title not in paper_ids:
+                continue
             integrated_table = integrated_table[integrated_table.find('|'):integrated_table.rfind('|')+1]
             integrated_table_pd = pd.read_csv(StringIO(integrated_table), sep='|', skipinitialspace=True, engine='python', on_bad_lines='skip')
             integrated_table_pd = integrated_table_pd.iloc[1:, 1:-1]
@@ -163,16 +169,54 @@ class DataMerger(LLMAgent):
         return merge_integrated_table
 
 
-    def __call__(self, table_template):
-        merge_integrated_table = self.get_merge_integrated_table(table_template)
+    def integrated_table_hashes(self):
+        return {paper_id: hash_file(paper_info['integrated_table_path']) for paper_id, paper_info in self.paper_info_dict.items() if os.path.exists(paper_info['integrated_table_path'])}
+
+    def align_columns(self, new_table, existing_table):
+        # refine_table 的结果由 LLM 生成，列名可能被改写或重新排序，按已有的列对齐
+        unknown = [column for column in new_table.columns if column not in existing_table.columns]
+        missing = [column for column in existing_table.columns if column not in new_table.columns]
+        if len(new_table) > 0 and (len(unknown) > 0 or len(missing) > 0):
+            self.logger.error(f'Refined table columns do not match {self.merge_table_path}: {unknown} dropped, {missing} left empty')
+        return new_table.reindex(columns=existing_table.columns)
+
+    def __call__(self, table_template, incremental=False, paper_ids=None):
+        # incremental: keep the rows already in merge_table_path and only merge papers that are new or whose
+        # integrated table changed since the last merge; paper_ids (e.g. the papers the extract stage recomputed)
+        # are merged again in any case
+        table_hashes = self.integrated_table_hashes()
+        existing_table = None
+        merge_ids = None
+        if incremental and os.path.exists(self.merge_table_path):
+            existing_table = pd.read_csv(self.merge_table_path, dtype=str, keep_default_na=False) # 原样保留已有的行
+            merged_papers = {}
+            if os.path.exists(self.merged_papers_path):
+                with open(self.merged_papers_path, 'r', encoding='utf-8') as file:
+                    merged_papers = json.load(file)
+            else: # 旧的运行没有记录，表中已有的论文视为已合并
+                merged_papers = {paper_id: table_hashes.get(paper_id) for paper_id in set(existing_table['Reference'])}
+            merge_ids = {paper_id for paper_id in self.paper_info_dict if paper_id not in merged_papers or merged_papers[paper_id] != table_hashes.get(paper_id)}
+            merge_ids |= set(paper_ids or []) & set(self.paper_info_dict)
+            # 不再入选的论文和需要重新合并的论文的旧行都去掉
+            existing_table = existing_table[existing_table['Reference'].isin(set(self.paper_info_dict) - merge_ids)]
+            self.logger.info(f'Incremental merge: {existing_table.shape[0]} existing rows kept, {len(merge_ids)} new or changed papers')
+
+        merge_integrated_table = self.get_merge_integrated_table(table_template, merge_ids)
         self.logger.info(f'Merged integrated table shape: {merge_integrated_table.shape}')
         
         self.logger.info(f'start refining table')
         merge_integrated_table = self.refine_table(merge_integrated_table)
         self.logger.info(f'Refined integrated table shape: {merge_integrated_table.shape}')
 
+        if existing_table is not None:
+            merge_integrated_table = pd.concat([existing_table, self.align_columns(merge_integrated_table, existing_table)], ignore_index=True)
+
         merge_integrated_table.to_csv(self.merge_table_path, index=False)
+        # 没有抽取到数据的论文也记录下来，下次不再当作新论文
+        with open(self.merged_papers_path, 'w', encoding='utf-8') as f:
+            json.dump(table_hashes, f, ensure_ascii=False, indent=4)
         self.logger.info(f'Saved merged integrated table to {self.merge_table_path}')
+        self.log_cache_stats()
 
 
 
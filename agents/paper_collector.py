@@ -1,11 +1,14 @@
 import os
-from structai import LLMAgent
-from tools.academic_search import search_crossref, search_arxiv
+import threading
+from structai import multi_thread
+from agents.base_agent import BaseAgent
+from tools.academic_search import federated_search, PaperIndex, SEARCH_ENGINES
 from tools.pdf_downloader import download_pdf_with_doi, download_pdf
 from utils.logger import create_logger
+from utils.artifact_store import get_artifact_store, link
+from utils.llm_cache import hash_text
 from datetime import datetime
 import time
-from tqdm import tqdm
 import json
 
 
@@ -37,7 +40,7 @@ query_prompt = """
 [The End of Research Areas of Interest to Users]
 """
 
-class PaperCollector(LLMAgent):
+class PaperCollector(BaseAgent):
     def __init__(self,
                 api_key = None,
                 api_base = None,
@@ -50,87 +53,175 @@ class PaperCollector(LLMAgent):
                 time_limit = 5*60,
                 max_try = 1,
                 use_responses_api = False,
+                use_cache = True,
+                use_store = True, # reuse PDFs already in the shared artifact store (utils/artifact_store.py)
                 field = 'science',
                 save_dir = 'data',
-                search_engine = 'arxiv' # 'crossref'
+                resume_dir = None, # reuse an existing run directory instead of creating a new timestamped one
+                incremental = False, # with resume_dir, only add papers published since the last collection
+                search_engine = 'all', # 'arxiv', 'crossref', 'semantic_scholar'
+                download_workers = 16, # per-host limits are applied in tools/pdf_downloader.py
+                save_interval = 5.0, # seconds between saves of the download progress
                 ):
-        assert search_engine in ['crossref', 'arxiv'], "Please select 'crossref' or 'arxiv'"
-        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api)
+        assert search_engine in ['all'] + list(SEARCH_ENGINES.keys()), f"Please select one of {['all'] + list(SEARCH_ENGINES.keys())}"
+        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api, use_cache=use_cache)
         self.system_prompt = self.system_prompt.replace('<INPUT1>', field)
         self.field = field
 
         # path
-        current_time = datetime.now().strftime("%Y_%m%d_%H%M%S")
-        self.save_dir = os.path.join(save_dir, field.replace(' ', '_'), current_time)
+        if resume_dir is not None:
+            self.save_dir = resume_dir
+        else:
+            current_time = datetime.now().strftime("%Y_%m%d_%H%M%S")
+            self.save_dir = os.path.join(save_dir, field.replace(' ', '_'), current_time)
         self.pdf_save_dir = os.path.join(self.save_dir, '0_pdf')
         self.log_save_dir = os.path.join(self.save_dir, 'log')
         self.paper_info_path = os.path.join(self.save_dir, '0_paper_info.json')
+        self.progress_path = os.path.join(self.save_dir, '0_paper_info.partial.json') # 已下载的论文，中断后重跑时不再下载
         os.makedirs(self.pdf_save_dir, exist_ok=True)
         os.makedirs(self.log_save_dir, exist_ok=True)
 
+        self.incremental = incremental
         self.search_engine = search_engine
-        if search_engine == 'crossref':
-            self.search = search_crossref
-            self.download = download_pdf_with_doi
-        elif self.search_engine == 'arxiv':
-            self.search = search_arxiv
-            self.download = download_pdf
+        self.search_engines = tuple(SEARCH_ENGINES.keys()) if search_engine == 'all' else (search_engine,)
+        self.download_workers = download_workers
+        self.save_interval = save_interval
+        self.store = get_artifact_store() if use_store else None
         self.logger = create_logger('PaperCollector', self.log_save_dir)
         self.logger.info(f"PDF directory created at {self.pdf_save_dir}")
     
     def get_save_dir(self):
         return self.save_dir
     
+    def download(self, paper_info, dir, name):
+        # 有链接时直接下载，否则通过 doi 下载
+        if paper_info.get('url'):
+            return download_pdf(paper_info['url'], dir, name)
+        return download_pdf_with_doi(paper_info['doi'], dir, name)
+
+    def download_paper(self, paper_info, max_down_try=3):
+        url = paper_info.get('url') or paper_info['doi']
+        pdf_name = f'tmp_{hash_text(url)[:16]}.pdf' # 由链接决定，重跑时同一论文对应同一文件
+        pdf_path = os.path.join(self.pdf_save_dir, pdf_name)
+        if self.store is not None:
+            sha = self.store.lookup(paper_info)
+            if sha is not None:
+                link(self.store.pdf_path(sha), pdf_path)
+                return pdf_path
+        for down_try in range(max_down_try):
+            if self.download(paper_info, self.pdf_save_dir, pdf_name):
+                if self.store is not None:
+                    self.store.ingest(pdf_path, paper_info)
+                return pdf_path
+            if down_try < max_down_try-1:
+                time.sleep(2**down_try)
+        self.logger.error(f'Failed to download {url}')
+        return None
+    
+    def load_existing(self):
+        # 增量模式下读取已有的 0_paper_info.json，返回已有论文和上次收集的日期
+        if not self.incremental or not os.path.exists(self.paper_info_path):
+            return {}, None
+        with open(self.paper_info_path, 'r', encoding='utf-8') as file:
+            paper_info_dict = json.load(file)
+        collected_at = [paper_info['collected_at'] for paper_info in paper_info_dict.values() if 'collected_at' in paper_info]
+        if len(collected_at) > 0:
+            since = max(collected_at)[:10]
+        else:
+            since = datetime.fromtimestamp(os.path.getmtime(self.paper_info_path)).strftime('%Y-%m-%d')
+        self.logger.info(f'Incremental mode: {len(paper_info_dict)} papers already collected, searching papers published since {since}')
+        return paper_info_dict, since
+
+    def load_progress(self):
+        # 上次中断的收集中已下载的论文，按链接（或 doi）索引
+        if not os.path.exists(self.progress_path):
+            return {}
+        with open(self.progress_path, 'r', encoding='utf-8') as file:
+            progress = json.load(file)
+        self.logger.info(f'{len(progress)} papers downloaded by an interrupted collection are reused')
+        return progress
+
+    def save_json(self, obj, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+
     def __call__(self, topic_of_interest, paper_list: list=None, doi_list:list=None, paper_search_num=2, max_down_try=3):
-        paper_list_all = []
+        paper_info_dict, since = self.load_existing()
+        paper_index = PaperIndex()
+        for paper_info in paper_info_dict.values():
+            paper_index.add(paper_info)
+        existing_num = len(paper_index)
+
         if paper_list is not None:
-            for paper_title in paper_list:
-                self.logger.info(f'Search title: {paper_title}')
-                paper_info = self.search(paper_title, 1)[0]
-                if paper_info not in paper_list_all:
-                    paper_list_all.append(paper_info)
+            self.logger.info(f'Search {len(paper_list)} titles')
+            federated_search(paper_list, 1, self.search_engines, index=paper_index)
         
         if paper_search_num > 0:
             query = query_prompt.replace('<INPUT1>', topic_of_interest)
             keywords_list = self.safe_api(query, return_example=[[]])
-            
-            for keywords in keywords_list:
-                keywords_str = ', '.join(keywords)
+            keywords_str_list = [', '.join(keywords) for keywords in keywords_list]
+            for keywords_str in keywords_str_list:
                 self.logger.info(f'Search using keywords: {keywords_str}')
-                try:
-                    paper_list = self.search(keywords_str, paper_search_num)
-                    for paper_info in paper_list:
-                        if paper_info not in paper_list_all:
-                            paper_list_all.append(paper_info)
-                except:
-                    self.logger.error(f'Search failed')
+            federated_search(keywords_str_list, paper_search_num, self.search_engines, index=paper_index, since=since)
         
         if doi_list is not None:
             for doi in doi_list:
-                paper_list_all.append({'title': doi, 'doi': doi})
+                paper_index.add({'title': doi, 'doi': doi})
 
-        self.logger.info(f'{len(paper_list_all)} papers found')
+        # 没有链接也没有 doi 的结果无法下载
+        paper_list_all = [paper_info for paper_info in paper_index.papers[existing_num:] if paper_info.get('url') or paper_info.get('doi')]
+        self.logger.info(f'{len(paper_list_all)} new papers found')
         self.logger.info(f'Start downloading ...')
-        paper_info_dict = {}
-        for paper_info in tqdm(paper_list_all):
-            paper_idx_str = f'{len(paper_info_dict):05}'
-            if self.search_engine == 'crossref':
-                url = paper_info['doi']
-            elif self.search_engine == 'arxiv':
-                url = paper_info['url']
-            pdf_name = paper_idx_str+'.pdf'
-            for down_try in range(max_down_try):
-                if self.download(url, self.pdf_save_dir, pdf_name):
-                    paper_info['pdf_path'] = os.path.join(self.pdf_save_dir, pdf_name)
-                    paper_info_dict[paper_idx_str] = paper_info
-                    with open(self.paper_info_path, 'w', encoding='utf-8') as f:
-                        json.dump(paper_info_dict, f, ensure_ascii=False, indent=4)
-                    break
-                if down_try < max_down_try-1:
-                    time.sleep(1)
+        progress = self.load_progress()
+        lock = threading.Lock()
+        last_save = [time.time()]
+        def download_and_record(paper_info, max_down_try):
+            url = paper_info.get('url') or paper_info['doi']
+            if url in progress and os.path.exists(progress[url]['pdf_path']):
+                return progress[url]['pdf_path']
+            pdf_path = self.download_paper(paper_info, max_down_try)
+            if pdf_path is not None:
+                with lock:
+                    progress[url] = {**paper_info, 'pdf_path': pdf_path}
+                    if time.time() - last_save[0] >= self.save_interval:
+                        self.save_json(progress, self.progress_path)
+                        last_save[0] = time.time()
+            return pdf_path
+        mp_inp_list = [{'paper_info': paper_info, 'max_down_try': max_down_try} for paper_info in paper_list_all]
+        pdf_path_list = multi_thread(mp_inp_list, download_and_record, max_workers=self.download_workers)
+        self.save_json(progress, self.progress_path)
+
+        # 按搜索顺序连续编号，与下载完成的先后无关；增量模式下接在已有编号之后
+        next_idx = max([int(paper_idx) for paper_idx in paper_info_dict] + [-1]) + 1
+        stored_paths = set(os.path.realpath(paper_info['pdf_path']) for paper_info in paper_info_dict.values())
+        collected_at = datetime.now().isoformat(timespec='seconds')
+        new_num = 0
+        for paper_info, pdf_path in zip(paper_list_all, pdf_path_list):
+            if pdf_path is None:
+                continue
+            if self.store is not None:
+                # 不同检索结果指向同一个 pdf 时只保留一份
+                stored_path = os.path.realpath(pdf_path)
+                if stored_path in stored_paths:
+                    os.remove(pdf_path)
+                    continue
+                stored_paths.add(stored_path)
+            paper_idx_str = f'{next_idx + new_num:05}'
+            paper_info['pdf_path'] = os.path.join(self.pdf_save_dir, paper_idx_str+'.pdf')
+            paper_info['collected_at'] = collected_at
+            os.replace(pdf_path, paper_info['pdf_path'])
+            paper_info_dict[paper_idx_str] = paper_info
+            new_num += 1
+        self.save_json(paper_info_dict, self.paper_info_path)
+        os.remove(self.progress_path)
         
-        self.logger.info(f'{len(paper_info_dict)} papers downloaded in {self.pdf_save_dir}')
+        self.logger.info(f'{new_num} papers downloaded in {self.pdf_save_dir}, {len(paper_info_dict)} in total')
+        if self.store is not None:
+            self.logger.info(f'PDFs are stored in {self.store.root}, {self.pdf_save_dir} only holds symlinks')
         self.logger.info(f'Saved paper information in {self.paper_info_path}')
+        self.log_cache_stats()
 
 
 if __name__ == '__main__':
@@ -1,35 +1,140 @@
 import os
 import json
+import shutil
+import threading
+import time
 from utils.logger import create_logger
-from structai import read_pdf, save_file, get_all_file_paths
+from utils.artifact_store import get_artifact_store
+from tools.mineru import MinerUClient, parsed_artifacts
+from tools.local_parser import LocalPDFParser
+from utils.paper_ir import get_paper_ir, ir_path
+
+# 解析后端都实现 parse(pdf_paths, on_result=None) -> {pdf_path: artifacts or None}
+PARSER_BACKENDS = {
+    'mineru': MinerUClient,
+    'local': LocalPDFParser,
+}
 
 
 class PaperParser:
-    def __init__(self, save_dir: str):
-        with open(os.path.join(save_dir, '0_paper_info.json'), 'r', encoding='utf-8') as file:
-            self.paper_info_dict = json.load(file)
+    def __init__(self, save_dir: str, paper_info_dict: dict=None, use_store: bool=True, batch_size: int=20, max_workers: int=4, save_interval: float=5.0, backend: str=None):
+        if paper_info_dict is None:
+            with open(os.path.join(save_dir, '0_paper_info.json'), 'r', encoding='utf-8') as file:
+                paper_info_dict = json.load(file)
+        self.paper_info_dict = paper_info_dict
         self.content_list_info_path = os.path.join(save_dir, f'1_content_list_info.json')
+        self.store = get_artifact_store() if use_store else None
+        backend = backend or os.environ.get('MANALYZER_PARSER_BACKEND', 'mineru')
+        assert backend in PARSER_BACKENDS, f"[===ERROR===][PaperParser][Unknown parser backend {backend}, choose from {list(PARSER_BACKENDS)}]"
+        self.backend = backend
+        self.client = PARSER_BACKENDS[backend](batch_size=batch_size, max_workers=max_workers if backend == 'mineru' else None)
+        self.save_interval = save_interval
 
         self.logger = create_logger('PaperParser', os.path.join(save_dir, 'log'))
         self.logger.info(f'{len(self.paper_info_dict)} PDFs to be processed')
     
 
+    def set_parsed_paths(self, paper_info, artifacts=None):
+        # artifacts 由解析结果直接给出，已解析过的论文从 artifacts.json 读取
+        if artifacts is None:
+            artifacts = parsed_artifacts(paper_info['pdf_path'].replace(".pdf", ""))
+        assert artifacts is not None, f"[===ERROR===][PaperParser][No parse result for {paper_info['pdf_path']}]"
+        parsed_dir = paper_info['pdf_path'].replace(".pdf", "")
+        paper_info['content_list_path'] = os.path.join(parsed_dir, os.path.basename(artifacts['content_list_path']))
+        paper_info['md_path'] = os.path.join(parsed_dir, os.path.basename(artifacts['md_path']))
+        get_paper_ir(paper_info) # 解析后立即建好 IR，之后各阶段直接读取
+        paper_info['ir_path'] = ir_path(paper_info)
+        return paper_info
+
+
+    def clear_parsed_dir(self, parsed_dir):
+        # 其他后端的解析结果不能复用，删掉后重新解析，避免新旧文件混在一起
+        if os.path.islink(parsed_dir):
+            os.remove(parsed_dir)
+        elif os.path.isdir(parsed_dir):
+            self.logger.info(f'Parse result in {parsed_dir} is not from the {self.backend} backend, parsing again')
+            shutil.rmtree(parsed_dir)
+
+
+    def pdf_to_parse(self, paper_info):
+        # 使用仓库时在仓库中解析，结果可被之后的运行复用；已解析过的（同一后端）返回 None
+        if self.store is None:
+            pdf_path = paper_info['pdf_path']
+            if parsed_artifacts(pdf_path.replace(".pdf", ""), self.backend) is not None:
+                return None
+            self.clear_parsed_dir(pdf_path.replace(".pdf", ""))
+            return pdf_path
+        sha = self.store.ingest(paper_info['pdf_path'], paper_info)
+        run_parsed_dir = paper_info['pdf_path'].replace(".pdf", "")
+        if not self.store.is_parsed(sha) and os.path.exists(os.path.join(run_parsed_dir, 'full.md')) and not os.path.islink(run_parsed_dir):
+            shutil.move(run_parsed_dir, self.store.parsed_dir(sha)) # 旧的运行目录中已有解析结果
+        if self.store.is_parsed(sha, self.backend):
+            return None
+        self.clear_parsed_dir(self.store.parsed_dir(sha))
+        return self.store.pdf_path(sha)
+
+
+    def finish_paper(self, paper_info, artifacts=None):
+        if self.store is not None:
+            sha = self.store.ingest(paper_info['pdf_path'])
+            self.store.link_parsed(sha, paper_info['pdf_path'])
+        return self.set_parsed_paths(paper_info, artifacts)
+
+
+    def parse_paper(self, paper_info):
+        pdf_path = self.pdf_to_parse(paper_info)
+        artifacts = None
+        if pdf_path is not None:
+            artifacts = self.client.parse([pdf_path])[pdf_path]
+            assert artifacts is not None, f"[===ERROR===][PaperParser][Parsing failed on {paper_info['pdf_path']}]"
+        return self.finish_paper(paper_info, artifacts)
+
+
+    def save(self, parsed_info_dict):
+        # 只保存解析成功的论文，按原编号排序
+        content_list_info = {paper_idx: parsed_info_dict[paper_idx] for paper_idx in self.paper_info_dict if paper_idx in parsed_info_dict}
+        tmp_path = self.content_list_info_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(content_list_info, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.content_list_info_path)
+
+
     def __call__(self):
-        pdf_paths = []
+        parsed_info_dict = {}
+        path2paper_idx = {}
         for paper_idx, paper_info in self.paper_info_dict.items():
-            pdf_paths.append(paper_info['pdf_path'])
-        read_pdf(pdf_paths)
+            if not os.path.exists(paper_info['pdf_path']):
+                self.logger.error(f'PDF of paper {paper_idx} not found ({paper_info["pdf_path"]})')
+                continue
+            pdf_path = self.pdf_to_parse(paper_info)
+            if pdf_path is None:
+                parsed_info_dict[paper_idx] = self.finish_paper(paper_info)
+            else:
+                path2paper_idx.setdefault(pdf_path, []).append(paper_idx)
+        self.logger.info(f'{len(parsed_info_dict)} PDFs already parsed, {len(path2paper_idx)} to be parsed')
 
-        for paper_idx, paper_info in self.paper_info_dict.items():
-            content_list_file_name = os.path.basename(get_all_file_paths(paper_info['pdf_path'].replace(".pdf", ""), "_content_list.json")[0])
-            paper_info['content_list_path'] = paper_info['pdf_path'].replace(".pdf", f"/{content_list_file_name}")
-            paper_info['md_path'] = paper_info['pdf_path'].replace(".pdf", "/full.md")
+        lock = threading.Lock()
+        last_save = [0.0]
+        def on_result(pdf_path, artifacts):
+            with lock:
+                for paper_idx in path2paper_idx[pdf_path]:
+                    if artifacts is None:
+                        self.logger.error(f'Failed to parse paper {paper_idx} ({self.paper_info_dict[paper_idx]["pdf_path"]})')
+                        continue
+                    parsed_info_dict[paper_idx] = self.finish_paper(self.paper_info_dict[paper_idx], artifacts)
+                self.logger.info(f'{len(parsed_info_dict)}/{len(self.paper_info_dict)} PDFs parsed')
+                if time.time() - last_save[0] >= self.save_interval:
+                    self.save(parsed_info_dict)
+                    last_save[0] = time.time()
+
+        if len(path2paper_idx) > 0:
+            self.client.parse(list(path2paper_idx.keys()), on_result=on_result)
         
-        save_file(self.paper_info_dict, self.content_list_info_path)
-        self.logger.info(f'{len(self.paper_info_dict)} PDFs processed')
+        self.save(parsed_info_dict)
+        self.logger.info(f'{len(parsed_info_dict)} PDFs processed, {len(self.paper_info_dict) - len(parsed_info_dict)} failed')
         self.logger.info(f'Saved content list info in {self.content_list_info_path}')
 
 
 if __name__ == "__main__":
     paper_parser = PaperParser('data/environment/2025_0402_170228')
-    paper_parser()
\ No newline at end of file
+    paper_parser()
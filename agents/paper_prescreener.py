@@ -0,0 +1,101 @@
+import os
+import json
+from utils.logger import create_logger
+from utils.bm25 import BM25, tokenize
+from utils.paper_ir import get_paper_ir, paper_sections
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+
+def template_columns(table_template):
+    # markdown 表格模板的表头，例如 | River | Location | Heavy metals | Content (µg/L) |
+    for line in (table_template or '').split('\n'):
+        if '|' in line:
+            return [cell.strip() for cell in line.strip().strip('|').split('|') if len(cell.strip()) > 0]
+    return []
+
+
+def paper_document(paper_info, abstract_max_len=3000):
+    """Title, abstract and section headers of a paper; only the collected fields before it is parsed."""
+    parts = [paper_info.get('title', '')] * 2 # 标题权重加倍
+    if paper_info.get('abstract'):
+        parts.append(paper_info['abstract'])
+    if 'md_path' in paper_info and os.path.exists(paper_info['md_path']):
+        sections = paper_sections(get_paper_ir(paper_info), include_img=False)
+        parts.extend(sections.keys())
+        abstract = [header for header in sections if 'abstract' in header.lower()]
+        header = abstract[0] if len(abstract) > 0 else next(iter(sections), None)
+        if header is not None:
+            parts.append(' '.join(sections[header])[:abstract_max_len])
+    return '\n'.join(part for part in parts if part)
+
+
+class PaperPrescreener:
+    """
+    Local pre-screening of papers before the LLM review.
+
+    Ranks papers by BM25 between the topic of interest plus the table template columns and
+    each paper's title, abstract and section headers. With `embedding_model` (a
+    sentence-transformers model name, e.g. 'all-MiniLM-L6-v2') the normalised BM25 score is
+    mixed with the embedding cosine similarity. Papers ranked within `top_k`, or scoring at
+    least `min_score` (0~1), are kept. Scores are saved in 1_prescreen_score.json.
+    """
+    def __init__(self, save_dir, top_k=-1, min_score=None, embedding_model=None, embedding_weight=0.5):
+        self.save_dir = save_dir
+        self.top_k = top_k
+        self.min_score = min_score
+        self.embedding_weight = embedding_weight
+        self.embedding_model = None
+        if embedding_model is not None:
+            assert SentenceTransformer is not None, "[===ERROR===][PaperPrescreener][sentence-transformers is not installed, run `pip install sentence-transformers`]"
+            self.embedding_model = SentenceTransformer(embedding_model, device='cpu')
+        self.score_json_path = os.path.join(save_dir, '1_prescreen_score.json')
+        self.logger = create_logger('PaperPrescreener', os.path.join(save_dir, 'log'))
+
+    def enabled(self):
+        return self.top_k != -1 or self.min_score is not None
+
+    def score(self, paper_info_dict, topic_of_interest, table_template=None):
+        query = topic_of_interest + '\n' + ' '.join(template_columns(table_template))
+        documents = [paper_document(paper_info) for paper_info in paper_info_dict.values()]
+        scores = BM25([tokenize(document) for document in documents]).scores(tokenize(query))
+        max_score = max(scores, default=0)
+        scores = [score / max_score if max_score > 0 else 0.0 for score in scores]
+        if self.embedding_model is not None and len(documents) > 0:
+            embeddings = self.embedding_model.encode([query] + documents, normalize_embeddings=True)
+            similarity = (embeddings[1:] @ embeddings[0]).tolist()
+            scores = [(1 - self.embedding_weight) * score + self.embedding_weight * max(sim, 0.0) for score, sim in zip(scores, similarity)]
+        return dict(zip(paper_info_dict.keys(), scores))
+
+    def __call__(self, paper_info_dict, topic_of_interest, table_template=None):
+        if not self.enabled() or len(paper_info_dict) == 0:
+            return paper_info_dict
+        score_dict = self.score(paper_info_dict, topic_of_interest, table_template)
+        # 分数相同时按论文编号顺序
+        ranking = sorted(score_dict, key=lambda paper_idx: -score_dict[paper_idx])
+        kept = set()
+        if self.top_k != -1:
+            kept.update(ranking[:self.top_k])
+        if self.min_score is not None:
+            kept.update(paper_idx for paper_idx in ranking if score_dict[paper_idx] >= self.min_score)
+
+        with open(self.score_json_path, 'w', encoding='utf-8') as f:
+            json.dump({paper_idx: {'Prescreen Score': score_dict[paper_idx], 'Kept': paper_idx in kept, 'title': paper_info_dict[paper_idx].get('title')} for paper_idx in ranking}, f, ensure_ascii=False, indent=4)
+        self.logger.info(f'Prescreened {len(paper_info_dict)} papers, {len(kept)} kept for review')
+        return {paper_idx: paper_info for paper_idx, paper_info in paper_info_dict.items() if paper_idx in kept}
+
+
+if __name__ == '__main__':
+    save_dir = 'data/environment/2025_0402_170228'
+    with open(os.path.join(save_dir, '1_content_list_info.json'), 'r', encoding='utf-8') as file:
+        content_list_info_dict = json.load(file)
+    table_template = """
+| River        | Location | Heavy metals | Content (µg/L) |
+|--------------|----------|--------------|----------------|
+| Tigris River | Turkey   | Cu           | 40             |
+"""
+    kept = PaperPrescreener(save_dir, top_k=10)(content_list_info_dict, 'River pollutants', table_template)
+    print(list(kept))
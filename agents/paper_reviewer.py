@@ -1,11 +1,17 @@
 import os
 import json
-from structai import LLMAgent, multi_thread
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from agents.base_agent import BaseAgent
+from agents.paper_prescreener import PaperPrescreener
 from utils.logger import create_logger
-from utils.reader import read_markdown
-from utils.clean import clean_dict
+from utils.paper_ir import get_paper_ir, paper_sections
 from utils.knapsack import knapsack
-from tqdm import tqdm
+from utils.llm_cache import hash_text
+from utils.selection import TopKSelector, estimate_extraction_tokens
+from utils.prompt_packer import pack_sections
 
 paragraph_score_system_prompt = """
 Please give the following paragraph a score to indicate the value of academic analysis. 
@@ -23,6 +29,20 @@ paragraph_score_query = """
 Please rate the academic value of this paragraph and give a single number (0~10)
 """
 
+paragraph_batch_score_system_prompt = """
+Please give each of the following paragraphs a score to indicate the value of academic analysis. 
+If the content of a paragraph is all general descriptive text, it is considered low value. 
+Otherwise, it is given a high score. Each score must be an integer from 0 to 10. 
+Please express the scores in the form of a list, one score per paragraph in the given order, and **do not use other words to respond**, for example:
+[8, 3, 10]
+"""
+
+paragraph_batch_score_query = """
+<INPUT1>
+Please rate the academic value of the above <INPUT2> paragraphs.
+The list should only contain <INPUT2> integers (0~10), no other text should be included in the answer.
+"""
+
 
 example_score = {'Topic Relevance': 9, 'Feasibility': 8}
 
@@ -93,7 +113,7 @@ Text content: <INPUT2>
 
 """
 
-class PaperReviewer(LLMAgent):
+class PaperReviewer(BaseAgent):
     def __init__(self,
                 save_dir: str,
                 api_key = None,
@@ -107,42 +127,109 @@ class PaperReviewer(LLMAgent):
                 time_limit = 5*60,
                 max_try = 1,
                 use_responses_api = False,
+                use_cache = True,
                 field = 'science',
                 batch_size = 20,
+                comparative_workers = 4,
+                comparative_rounds = 1,
+                comparative_seed = 0,
                 use_paragraph_score = False,
                 max_paragraph_length = 10_000,
+                paragraph_weight_bucket = 50,
+                paragraph_score_batch_size = 20,
+                paragraph_score_batch_chars = 40_000,
+                content_list_info_dict = None,
+                prescreen_top_k = -1,
+                prescreen_min_score = None,
+                prescreen_embedding_model = None,
+                use_async = False,
                 ):
-        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api)
+        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api, use_cache=use_cache, use_async=use_async)
         self.comparative_review_system_prompt = comparative_review_system_prompt.replace('<INPUT1>', field)
         self.independent_review_system_prompt = independent_review_system_prompt.replace('<INPUT1>', field)
         self.batch_size = batch_size
+        self.comparative_workers = comparative_workers # 同时进行的对比评审批次数
+        self.comparative_rounds = comparative_rounds # 每篇论文参与的对比评审轮数，大于 1 时后续轮次随机分批，分数取平均
+        self.comparative_seed = comparative_seed
         self.use_paragraph_score = use_paragraph_score
         self.max_paragraph_length = max_paragraph_length
+        self.paragraph_weight_bucket = paragraph_weight_bucket # 段落长度按该字符数分桶后再做背包选择
+        self.paragraph_score_batch_size = paragraph_score_batch_size # 一次请求最多打分的段落数
+        self.paragraph_score_batch_chars = paragraph_score_batch_chars # 一次请求中段落的总字符数上限
 
-        with open(os.path.join(save_dir, '1_content_list_info.json'), 'r', encoding='utf-8') as file:
-            self.content_list_info_dict = json.load(file)
+        if content_list_info_dict is None:
+            with open(os.path.join(save_dir, '1_content_list_info.json'), 'r', encoding='utf-8') as file:
+                content_list_info_dict = json.load(file)
+        self.content_list_info_dict = content_list_info_dict
+        # 在 LLM 评审前用 BM25（可选向量模型）排除明显无关的论文，默认不启用
+        self.prescreener = PaperPrescreener(save_dir, top_k=prescreen_top_k, min_score=prescreen_min_score, embedding_model=prescreen_embedding_model)
 
         self.score_json_path = os.path.join(save_dir, '2_paper_score.json')
+        self.pack_stats = {'packed_tokens': 0, 'dropped_tokens': 0, 'sections': 0, 'dropped_sections': 0}
+        self._pack_stats_lock = threading.Lock()
         self.logger = create_logger('PaperReviewer', os.path.join(save_dir, 'log'))
     
 
-    def paragraph_score(self, paragraph):
+    def paragraph_score(self, paragraph, default=10):
         query = paragraph_score_query.replace('<INPUT1>', paragraph)
         score = self.safe_api(query, paragraph_score_system_prompt)
         try:
             score = int(score)
         except:
-            score = 10
+            score = default
         return score
+
+    def paragraph_score_key(self, paragraph):
+        return self.cache.make_key('paragraph_score', self.model_version, hash_text(paragraph))
+
+    def paragraph_score_batch(self, paragraph_list):
+        # 返回每段的分数，无法得到分数的段落为 None
+        if len(paragraph_list) == 1:
+            return [self.paragraph_score(paragraph_list[0], default=None)]
+        paragraph_list_text = ''
+        for paragraph_idx, paragraph in enumerate(paragraph_list):
+            paragraph_list_text += f'[The Start of the Paragraph {paragraph_idx+1}]\n{paragraph}\n[The End of the Paragraph {paragraph_idx+1}]\n\n'
+        query = paragraph_batch_score_query.replace('<INPUT1>', paragraph_list_text).replace('<INPUT2>', str(len(paragraph_list)))
+        scores = self.safe_api(query, paragraph_batch_score_system_prompt, return_example=[8], list_len=len(paragraph_list), list_min=0, list_max=10)
+        if scores is None:
+            # 批量结果无法解析时逐段打分
+            self.logger.error(f'Failed to score {len(paragraph_list)} paragraphs in one batch, scoring them one by one')
+            return [self.paragraph_score(paragraph, default=None) for paragraph in paragraph_list]
+        return [int(round(score)) for score in scores]
+
+    def paragraph_scores(self, paragraph_list):
+        """Score paragraphs in batches of numbered paragraphs, reusing per-paragraph scores cached by content hash."""
+        score_dict = {}
+        if self.use_cache:
+            for paragraph in paragraph_list:
+                score = self.cache.get(self.paragraph_score_key(paragraph))
+                if score is not None:
+                    score_dict[paragraph] = score
+        todo = [paragraph for paragraph in dict.fromkeys(paragraph_list) if paragraph not in score_dict]
+
+        batches = []
+        for paragraph in todo:
+            if len(batches) == 0 or len(batches[-1]) >= self.paragraph_score_batch_size or sum(len(p) for p in batches[-1]) + len(paragraph) > self.paragraph_score_batch_chars:
+                batches.append([])
+            batches[-1].append(paragraph)
+        for batch in batches:
+            for paragraph, score in zip(batch, self.paragraph_score_batch(batch)):
+                if score is None:
+                    score_dict[paragraph] = 10 # 与 paragraph_score 相同，打分失败时保留该段
+                    continue
+                score_dict[paragraph] = score
+                if self.use_cache:
+                    self.cache.set(self.paragraph_score_key(paragraph), score, namespace='paragraph_score')
+        self.logger.info(f'Scored {len(paragraph_list)} paragraphs with {len(batches)} requests ({len(paragraph_list) - len(todo)} cached)')
+        return [score_dict[paragraph] for paragraph in paragraph_list]
     
     def paragraph_score_filter(self, paper_dict):
         self.logger.info(f'Filter paragraphs by score, before: {len(paper_dict)}')
+        paragraph_list = ['\n'.join(paragraph_list) for paragraph_list in paper_dict.values()]
         items = []
-        for part, paragraph_list in paper_dict.items():
-            paragraph = '\n'.join(paragraph_list)
-            score = self.paragraph_score(paragraph)
+        for paragraph, score in zip(paragraph_list, self.paragraph_scores(paragraph_list)):
             items.append({'weight': len(paragraph), 'value': score})
-        max_value, selected_items = knapsack(items, self.max_paragraph_length)
+        max_value, selected_items = knapsack(items, self.max_paragraph_length, bucket=self.paragraph_weight_bucket)
         paper_dict_selected = {}
         for paer_idx, (part, paragraph_list) in enumerate(paper_dict.items()):
             if selected_items[paer_idx] == 1:
@@ -150,14 +237,18 @@ class PaperReviewer(LLMAgent):
         self.logger.info(f'Filter paragraphs by score, after: {len(paper_dict_selected)}')
         return paper_dict_selected
 
-    def paper2text(self, paper_dict: dict, abstract_max_len=10000, intro_max_len=10000, max_len=50000, max_part=-1, use_paragraph_score=False):
+    def paper2text(self, paper_dict: dict, abstract_max_tokens=2500, intro_max_tokens=2500, max_tokens=17500, max_part=-1, use_paragraph_score=False, return_stats=False):
+        """
+        Pack the first max_part sections into at most max_tokens tokens: the abstract first (up to
+        abstract_max_tokens), then the introduction (up to intro_max_tokens), and what is left is
+        shared evenly by the other sections.
+        """
         if self.use_paragraph_score and use_paragraph_score:
             paper_dict = self.paragraph_score_filter(paper_dict)
 
         if max_part == -1:
             max_part = len(paper_dict)
-        part_max_len = max_len // max_part
-        paper_text = ''
+        sections = []
         for part_idx, (part, paragraph_list) in enumerate(paper_dict.items()):
             if (part_idx+1) > max_part:
                 break
@@ -169,80 +260,140 @@ class PaperReviewer(LLMAgent):
             for p in paragraph_list:
                 if '.jpg' not in p:
                     paragraph_list_wo_img.append(p)
-            paragraph = '\n'.join(paragraph_list_wo_img)
+            section = {'header': part, 'text': '\n'.join(paragraph_list_wo_img), 'priority': 0}
             if 'abstract' in part.replace(" ", "").lower():
-                paragraph_select = paragraph[:abstract_max_len]
+                section.update(priority=2, max_tokens=abstract_max_tokens)
             elif 'intro' in part.replace(" ", "").lower():
-                paragraph_select = paragraph[:intro_max_len]
-            else:
-                paragraph_select = paragraph[:part_max_len]
-
-            paper_text = paper_text + text_format.replace('<INPUT1>', part).replace('<INPUT2>', paragraph_select)
+                section.update(priority=1, max_tokens=intro_max_tokens)
+            sections.append(section)
+
+        paper_text, stats = pack_sections(sections, max_tokens, section_format=text_format.replace('<INPUT1>', '{header}').replace('<INPUT2>', '{text}'))
+        with self._pack_stats_lock:
+            for k in self.pack_stats:
+                self.pack_stats[k] += stats[k]
+        if return_stats:
+            return paper_text, stats
         return paper_text
     
 
-    def comparative_review(self, paper_list, topic_of_interest):
-        paper_list_text = ''
+    def comparative_review_query(self, paper_list, topic_of_interest):
+        paper_text_list = []
         for paper_idx, paper_dict in enumerate(paper_list):
-            paper_text = self.paper2text(paper_dict, abstract_max_len=5000, intro_max_len=1000, max_len=3000, max_part=3)
-            paper_text = f'[The Start of the Paper {paper_idx+1}]\n' + paper_text + f'\n[The End of the Paper {paper_idx+1}]\n\n'
-            paper_list_text = paper_list_text + paper_text
-        query = comparative_review_query_prompt.replace('<INPUT1>', topic_of_interest).replace('<INPUT2>', paper_list_text).replace('<INPUT3>', str(len(paper_list)))
+            paper_text = self.paper2text(paper_dict, abstract_max_tokens=1250, intro_max_tokens=250, max_tokens=1750, max_part=3)
+            paper_text_list.append(f'[The Start of the Paper {paper_idx+1}]\n{paper_text}\n[The End of the Paper {paper_idx+1}]\n\n')
+        return comparative_review_query_prompt.replace('<INPUT1>', topic_of_interest).replace('<INPUT2>', ''.join(paper_text_list)).replace('<INPUT3>', str(len(paper_list)))
+
+    def comparative_batches(self, paper_ids, first_round=True):
+        """
+        Batches of at most batch_size papers: the papers in order for the first round, then one
+        random partition per extra round, so each paper is compared against different papers.
+        first_round=False returns only the random rounds (the streaming pipeline batches the
+        first round itself as papers arrive).
+        """
+        batches = []
+        rng = random.Random(self.comparative_seed)
+        for round_idx in range(self.comparative_rounds):
+            order = list(paper_ids)
+            if round_idx == 0:
+                if not first_round:
+                    continue
+                batches.extend(order[i:i+self.batch_size] for i in range(0, len(order), self.batch_size))
+                continue
+            rng.shuffle(order)
+            num_batches = -(-len(order) // self.batch_size)
+            batches.extend(order[i::num_batches] for i in range(num_batches)) # 随机轮次各批大小接近
+        return batches
+
+    def log_pack_stats(self, stats, name='Paper'):
+        self.logger.info(f"{name} packed into {stats['packed_tokens']} tokens, {stats['dropped_tokens']} tokens dropped ({stats['dropped_sections']}/{stats['sections']} sections dropped)")
+
+    def check_score(self, score, name):
+        if score is None:
+            self.logger.error(f'Failed to obtain {name} score')
+            raise Exception(f'Failed to obtain {name} score')
+        return score
+
+
+    def comparative_review(self, paper_list, topic_of_interest):
+        query = self.comparative_review_query(paper_list, topic_of_interest)
         # print(query)
         scores = self.safe_api(query, self.comparative_review_system_prompt, return_example=[0.8], list_len=len(paper_list), list_min=0.0, list_max=1.0)
-        if scores is None:
-            self.logger.error('Failed to obtain comparative score')
-            raise Exception('Failed to obtain comparative score')
-        return scores
+        return self.check_score(scores, 'comparative')
+
+    async def acomparative_review(self, paper_list, topic_of_interest):
+        query = self.comparative_review_query(paper_list, topic_of_interest)
+        scores = await self.asafe_api(query, self.comparative_review_system_prompt, return_example=[0.8], list_len=len(paper_list), list_min=0.0, list_max=1.0)
+        return self.check_score(scores, 'comparative')
 
 
     def independent_review(self, paper_dict, topic_of_interest):
-        paper_text = self.paper2text(paper_dict, use_paragraph_score=True)
+        paper_text, stats = self.paper2text(paper_dict, use_paragraph_score=True, return_stats=True)
+        self.log_pack_stats(stats)
         query = independent_review_query_prompt.replace('<INPUT1>', topic_of_interest).replace('<INPUT2>', paper_text)
         # print(query)
         score = self.safe_api(query, self.independent_review_system_prompt, return_example=example_score)
-        if score is None:
-            self.logger.error('Failed to obtain independent score')
-            raise Exception('Failed to obtain independent score')
-        return score
+        return self.check_score(score, 'independent')
+
+    async def aindependent_review(self, paper_dict, topic_of_interest):
+        if self.use_paragraph_score:
+            # 段落打分仍走同步接口，放到线程里避免阻塞事件循环
+            paper_text, stats = await asyncio.to_thread(self.paper2text, paper_dict, use_paragraph_score=True, return_stats=True)
+        else:
+            paper_text, stats = self.paper2text(paper_dict, return_stats=True)
+        self.log_pack_stats(stats)
+        query = independent_review_query_prompt.replace('<INPUT1>', topic_of_interest).replace('<INPUT2>', paper_text)
+        score = await self.asafe_api(query, self.independent_review_system_prompt, return_example=example_score)
+        return self.check_score(score, 'independent')
     
 
-    def __call__(self, topic_of_interest):
+    def load_paper(self, paper_info):
+        return paper_sections(get_paper_ir(paper_info), include_img=True)
+
+
+    def __call__(self, topic_of_interest, table_template=None):
+        content_list_info_dict = self.prescreener(self.content_list_info_dict, topic_of_interest, table_template)
         paper_content_dict = {}
-        for paper_idx, paper_info in self.content_list_info_dict.items():
-            paper_content = read_markdown(paper_info['md_path'], include_img=True)
-            paper_content = clean_dict(paper_content)
-            paper_content_dict[paper_idx] = paper_content
+        for paper_idx, paper_info in content_list_info_dict.items():
+            paper_content_dict[paper_idx] = self.load_paper(paper_info)
         self.logger.info(f'Read {len(paper_content_dict)} papers')
         
         paper_score_dict = {}
         
+        # comparative review 只依赖论文内容，与 independent review 同时进行
+        batches = self.comparative_batches(list(paper_content_dict.keys()))
+        self.logger.info(f'Start comparative review ({len(batches)} batches, {self.comparative_rounds} rounds)')
+        # 对比评审在后台线程中并行（use_async 时在该线程自己的事件循环中走 acomparative_review）
+        executor = ThreadPoolExecutor(max_workers=1)
+        mp_inp_list = [{'paper_list': [paper_content_dict[paper_idx] for paper_idx in batch], 'topic_of_interest': topic_of_interest} for batch in batches]
+        comparative_future = executor.submit(self.run_parallel, mp_inp_list, self.comparative_review, self.acomparative_review, self.comparative_workers, False)
+
         # independent review
         self.logger.info(f'Start independent review')
         mp_inp_list = []
         for paper_idx, paper_content in paper_content_dict.items():
             mp_inp_list.append({'paper_dict': paper_content, 'topic_of_interest': topic_of_interest})
-        scores = multi_thread(mp_inp_list, self.independent_review)
+        scores = self.run_parallel(mp_inp_list, self.independent_review, self.aindependent_review)
         for num_idx, (paper_idx, paper_content) in enumerate(paper_content_dict.items()):
             paper_score_dict[paper_idx] = scores[num_idx] 
-        
-        # comparative review
-        self.logger.info(f'Start comparative review')
-        batch_paper_idx = []
-        batch_paper_content = []
-        for num_idx, (paper_idx, paper_content) in enumerate(tqdm(paper_content_dict.items())):
-            batch_paper_idx.append(paper_idx)
-            batch_paper_content.append(paper_content)
-            if len(batch_paper_idx) >= self.batch_size or num_idx == len(paper_content_dict) - 1:
-                scores = self.comparative_review(batch_paper_content, topic_of_interest)
-                for i in range(len(batch_paper_idx)):
-                    paper_idx = batch_paper_idx[i]
-                    paper_score_dict[paper_idx]['Relative Score'] = scores[i]
-                batch_paper_idx = []
-                batch_paper_content = []
+
+        relative_scores = {}
+        for batch, scores in zip(batches, comparative_future.result()):
+            if scores is None:
+                self.logger.error(f'Comparative review of papers {batch} failed')
+                continue
+            for paper_idx, score in zip(batch, scores):
+                relative_scores.setdefault(paper_idx, []).append(score)
+        executor.shutdown()
+
+        for paper_idx in list(paper_score_dict):
+            if paper_score_dict[paper_idx] is None or paper_idx not in relative_scores:
+                self.logger.error(f'Paper {paper_idx} has no {"independent" if paper_score_dict[paper_idx] is None else "comparative"} score, skipped')
+                del paper_score_dict[paper_idx]
+                continue
+            paper_score_dict[paper_idx]['Relative Score'] = sum(relative_scores[paper_idx]) / len(relative_scores[paper_idx])
         
         for paper_idx, paper_score in paper_score_dict.items():
-            paper_score_dict[paper_idx]['Final Score'] = (sum(paper_score.values()) - paper_score['Relative Score'])*paper_score['Relative Score']
+            paper_score_dict[paper_idx]['Final Score'] = final_score(paper_score)
         
         for paper_idx, paper_score in paper_score_dict.items():
             paper_score_dict[paper_idx].update(self.content_list_info_dict[paper_idx])
@@ -250,24 +401,32 @@ class PaperReviewer(LLMAgent):
         with open(self.score_json_path, 'w', encoding='utf-8') as f:
             json.dump(paper_score_dict, f, ensure_ascii=False, indent=4)
         self.logger.info(f'Reviewed {len(paper_score_dict)} papers')
+        self.log_pack_stats(self.pack_stats, name='All review prompts')
+        self.log_cache_stats()
+
+
+def final_score(paper_score):
+    return (sum(paper_score.values()) - paper_score['Relative Score'])*paper_score['Relative Score']
 
 
-def select_paper(save_dir, paper_num=-1):
+def select_paper(save_dir, paper_num=-1, token_budget=None, selector=None):
+    """
+    Select the paper_num best papers of 2_paper_score.json by Final Score (all with -1), ties broken
+    by paper number. With token_budget, stop before the estimated extraction tokens exceed it.
+    A TopKSelector already fed while reviewing can be passed instead of ranking the file again.
+    """
     paper_score_path = os.path.join(save_dir, '2_paper_score.json')
     selected_paper_save_path = os.path.join(save_dir, '3_selected_paper.json')
 
     with open(paper_score_path, 'r', encoding='utf-8') as file:
         paper_score = json.load(file)
 
-    if paper_num == -1:
-        selected_paper = paper_score
-    else:
-        final_score = sorted([v['Final Score'] for k, v in paper_score.items()], reverse=True)
-        final_score_th = final_score[paper_num-1] if paper_num <= len(final_score) else final_score[-1]
-        selected_paper = {}
+    if selector is None:
+        selector = TopKSelector(paper_num)
         for k, v in paper_score.items():
-            if v['Final Score'] >= final_score_th:
-                selected_paper[k] = v
+            selector.push(k, v['Final Score'], estimate_extraction_tokens(v) if token_budget is not None else 0)
+    selected_ids = set(selector.select(token_budget))
+    selected_paper = {k: v for k, v in paper_score.items() if k in selected_ids}
 
     with open(selected_paper_save_path, 'w', encoding='utf-8') as f:
         json.dump(selected_paper, f, ensure_ascii=False, indent=4)
@@ -1,5 +1,5 @@
 import os
-from structai import LLMAgent
+from agents.base_agent import BaseAgent
 from utils.logger import create_logger
 from PIL import Image
 import pandas as pd
@@ -82,7 +82,7 @@ Please output the report:
 """
 
 
-class Reporter(LLMAgent):
+class Reporter(BaseAgent):
     def __init__(self,
                 save_dir: str,
                 api_key = None,
@@ -96,9 +96,10 @@ class Reporter(LLMAgent):
                 time_limit = 5*60,
                 max_try = 1,
                 use_responses_api = False,
+                use_cache = True,
                 field = 'science',
                 ):
-        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api)
+        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api, use_cache=use_cache)
         self.logger = create_logger('Reporter', os.path.join(save_dir, 'log'))
         self.system_prompt = system_prompt.replace('<INPUT>', field)
 
@@ -157,6 +158,7 @@ class Reporter(LLMAgent):
         report = self.safe_api(self.query_prompt, image=self.base64_string if self.base64_string else None)
         with open(self.markdown_path, 'w') as f:
             f.write(report)
+        self.log_cache_stats()
         return 
         
 
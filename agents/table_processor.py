@@ -1,8 +1,15 @@
 import os
-from structai import LLMAgent, multi_thread
+from agents.base_agent import BaseAgent
 from utils.logger import create_logger
+from utils.paper_ir import get_paper_ir, paper_content_list
+from utils.prompt_packer import truncate_tokens
+from utils.llm_cache import hash_file
+from utils.image_prep import dhash, hamming, non_data_reason, prepare_image
+from utils.table_html import html_table_to_markdown
+import re
 import json
 import base64
+from PIL import Image
 
 
 def get_image_info(x, image_path_prefix):
@@ -26,43 +33,85 @@ def get_image_info(x, image_path_prefix):
         }
 
     if x['type'] == 'table':
-        return {
+        table_info = {
             'path': os.path.join(image_path_prefix, x['img_path']),
             'caption': ' '.join(x['table_caption']),
             'footnote': ' '.join(x['table_footnote']),
             'in_type': 'table',
         }
+        if x.get('table_body'):
+            table_info['table_body'] = x['table_body'] # MinerU 给出的 HTML 表格，可在本地直接转换
+        return table_info
+
+
+def significant_text_index(content_list, min_len=10):
+    """One pass each way: prev_idx[i] / next_idx[i] is the nearest text block longer than min_len before / after i, or -1."""
+    prev_idx = [-1] * len(content_list)
+    next_idx = [-1] * len(content_list)
+    last = -1
+    for i, part in enumerate(content_list):
+        prev_idx[i] = last
+        if part['type'] == 'text' and len(part['text']) > min_len:
+            last = i
+    last = -1
+    for i in range(len(content_list) - 1, -1, -1):
+        next_idx[i] = last
+        if content_list[i]['type'] == 'text' and len(content_list[i]['text']) > min_len:
+            last = i
+    return prev_idx, next_idx
+
+
+def context_window(content_list, start, step_idx, max_tokens, from_end):
+    # 沿 step_idx 向外收集文本块，直到用完 max_tokens
+    texts = []
+    i = start
+    while i != -1 and max_tokens > 0:
+        text, tokens = truncate_tokens(content_list[i]['text'], max_tokens, from_end=from_end)
+        texts.append(text)
+        max_tokens -= tokens
+        i = step_idx[i]
+    return texts
+
+
+def iter_table_images(content_list, image_path_prefix, context_before_tokens=None, context_after_tokens=None):
+    """
+    Yield the convert_to_markdown arguments of each table or image in content_list.
 
-
-def get_table_image_list(content_list, image_path_prefix):
-    clean_list = []
+    The context is the nearest text block longer than 10 characters on each side. With
+    context_before_tokens / context_after_tokens, as many neighbouring text blocks as fit in
+    that many tokens are used on that side instead.
+    """
+    prev_idx, next_idx = significant_text_index(content_list)
     for part_idx, part in enumerate(content_list):
         if part['type'] == 'text' or part['type'] == 'equation' or 'img_path' not in part or len(part['img_path']) == 0:
             continue
         image_info = get_image_info(part, image_path_prefix)
         # context
-        image_info['context'] = ''
-        i = part_idx - 1
-        j = part_idx + 1
-        while i >= 0:
-            if content_list[i]['type'] == 'text' and len(content_list[i]['text']) > 10:
-                image_info['context'] = content_list[i]['text'] + image_info['context'] + '\n'
-                break
-            i -= 1
-        
-        while j < len(content_list):
-            if content_list[j]['type'] == 'text' and len(content_list[j]['text']) > 10:
-                image_info['context'] = image_info['context'] + '\n' + content_list[j]['text']
-                break
-            j += 1
-        
+        i, j = prev_idx[part_idx], next_idx[part_idx]
+        if context_before_tokens is None:
+            before = [content_list[i]['text']] if i != -1 else []
+        else:
+            before = context_window(content_list, i, prev_idx, context_before_tokens, from_end=True)
+        if context_after_tokens is None:
+            after = [content_list[j]['text']] if j != -1 else []
+        else:
+            after = context_window(content_list, j, next_idx, context_after_tokens, from_end=False)
+        context = []
+        if len(before) > 0:
+            context.append('\n'.join(reversed(before)) + '\n')
+        if len(after) > 0:
+            context.append('\n' + '\n'.join(after))
+        image_info['context'] = ''.join(context)
+
         for k, v in image_info.items():
             if len(v.strip()) == 0:
                 image_info[k] = None
 
-        clean_list.append(image_info)
-    
-    return clean_list
+        yield image_info
+
+
+def get_table_image_list(content_list, image_path_prefix, context_before_tokens=None, context_after_tokens=None):
+    return list(iter_table_images(content_list, image_path_prefix, context_before_tokens, context_after_tokens))
 
 
 system_prompt_table = """
@@ -166,7 +215,42 @@ Example 2:
 """
 
 
-class TableProcessor(LLMAgent):
+query_prompt_batch = """
+Below are <INPUT1> <INPUT2>s from the same paper, attached as images in this order, each with its relevant information. Please convert each of them to text.
+
+<INPUT3>
+Convert every image separately, following the rules and the example below, and put the reply for image i between [The Start of Image i] and [The End of Image i], for example:
+[The Start of Image 1]
+(reply for image 1)
+[The End of Image 1]
+[The Start of Image 2]
+(reply for image 2)
+[The End of Image 2]
+
+Reply for all <INPUT1> images in order, without any other text.
+Example reply for one image:
+<INPUT4>
+"""
+
+BATCH_OUTPUT_PATTERN = re.compile(r'\[The Start of Image (\d+)\](.*?)\[The End of Image \1\]', re.DOTALL)
+
+
+def parse_batch_output(response, num_images):
+    """Split a batched reply into per-image replies; None unless images 1..num_images each appear exactly once."""
+    if not isinstance(response, str):
+        return None
+    outputs = {}
+    for m in BATCH_OUTPUT_PATTERN.finditer(response):
+        image_idx = int(m.group(1))
+        if image_idx in outputs or len(m.group(2).strip()) == 0:
+            return None
+        outputs[image_idx] = m.group(2).strip()
+    if sorted(outputs) != list(range(1, num_images + 1)):
+        return None
+    return [outputs[i] for i in range(1, num_images + 1)]
+
+
+class TableProcessor(BaseAgent):
     def __init__(self,
                 save_dir: str,
                 api_key = None,
@@ -180,9 +264,32 @@ class TableProcessor(LLMAgent):
                 time_limit = 5*60,
                 max_try = 1,
                 use_responses_api = False,
+                use_cache = True,
                 field = 'science',
+                paper_info_dict = None,
+                use_async = False,
+                context_before_tokens = None,
+                context_after_tokens = None,
+                skip_non_data_images = True,
+                dedup_threshold = 3,
+                image_max_side = 1568,
+                image_batch_size = 4,
+                batch_max_side = 1000,
+                batch_max_tokens = 16384,
+                local_table_min_confidence = 0.8,
                 ):
-        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api)
+        super().__init__(api_key, api_base, model_version, system_prompt, max_tokens, temperature, http_client, headers, time_limit, max_try, use_responses_api, use_cache=use_cache, use_async=use_async)
+        # 表格/图片前后上下文的 token 数，None 时前后各取最近的一段文本
+        self.context_before_tokens = context_before_tokens
+        self.context_after_tokens = context_after_tokens
+        self.skip_non_data_images = skip_non_data_images # 跳过 logo、照片、地图等不含数据的图片
+        self.dedup_threshold = dedup_threshold # dHash 汉明距离不超过该值的图片只转换一次，-1 不去重
+        self.image_max_side = image_max_side # 上传前把图片缩小到模型的有效分辨率
+        self.image_batch_size = image_batch_size # 同一论文中同类型的小图合并到一次请求，1 为逐张请求
+        self.batch_max_side = batch_max_side # 长宽都不超过该值的图片才参与合并
+        self.batch_max_tokens = batch_max_tokens # 合并请求按图片数放大 max_tokens，但不超过模型的输出上限
+        self.local_table_min_confidence = local_table_min_confidence # 本地转换置信度低于该值的表格仍交给视觉模型，大于 1 时不做本地转换
+        self.image_cache_dir = os.path.join(os.environ.get('MANALYZER_CACHE_DIR', os.path.join('data', 'cache')), 'images')
         self.system_prompt_table = system_prompt_table.replace('<INPUT1>', field)
         self.system_prompt_chart = system_prompt_chart.replace('<INPUT1>', field)
 
@@ -190,27 +297,32 @@ class TableProcessor(LLMAgent):
         self.converted_text_save_dir = os.path.join(save_dir, '2_text')
         os.makedirs(self.converted_text_save_dir, exist_ok=True)
 
-        with open(os.path.join(save_dir, '3_selected_paper.json'), 'r', encoding='utf-8') as file:
-            self.paper_info_dict = json.load(file)
+        if paper_info_dict is None:
+            with open(os.path.join(save_dir, '3_selected_paper.json'), 'r', encoding='utf-8') as file:
+                paper_info_dict = json.load(file)
+        self.paper_info_dict = paper_info_dict
         
         self.converted_paper_info_path = os.path.join(save_dir, '4_converted_paper.json')
         
-        self.table_image_list = []
+        self.table_image_dict = {}
         for paper_idx, paper_info in self.paper_info_dict.items():
-            image_path_prefix = os.path.dirname(paper_info['content_list_path'])
-            with open(paper_info['content_list_path'], 'r', encoding='utf-8') as file:
-                paper_content_list = json.load(file)
-            self.table_image_list = self.table_image_list + get_table_image_list(paper_content_list, image_path_prefix)
+            self.load_paper(paper_idx, paper_info)
+        self.table_image_list = [table_image for table_image_list in self.table_image_dict.values() for table_image in table_image_list]
         self.logger.info(f'{len(self.table_image_list)} tables (or images) from {len(self.paper_info_dict)} papers need to be processed')
     
-    def convert_to_markdown(self, path, caption:str=None, footnote:str=None, in_type:str=None, context:str=None):
+    def load_paper(self, paper_idx, paper_info):
+        image_path_prefix = os.path.dirname(paper_info['content_list_path'])
+        self.table_image_dict[paper_idx] = get_table_image_list(get_paper_ir(paper_info)['content_list'], image_path_prefix, self.context_before_tokens, self.context_after_tokens)
+        return self.table_image_dict[paper_idx]
+
+    def convert_query(self, caption:str=None, footnote:str=None, in_type:str=None, context:str=None, query:str=None):
         if in_type == 'table':
             system_prompt = self.system_prompt_table
-            query = query_prompt_table
+            query = query_prompt_table if query is None else query
 
         elif in_type == 'chart':
             system_prompt = self.system_prompt_chart
-            query = query_prompt_chart
+            query = query_prompt_chart if query is None else query
 
         if caption is not None:
             caption_text = f'[The Start of Caption]\n' + caption + f'\n[The End of Caption]'
@@ -229,12 +341,9 @@ class TableProcessor(LLMAgent):
             query = query.replace('<INPUT3>', context_text)
         else:
             query = query.replace('<INPUT3>', '')
-        
-        # print(path)
-        # print(system_prompt)
-        # print(query)
-        # print()
-        table_md = self.safe_api(query, system_prompt=system_prompt, return_dict=False, image_paths=[path])
+        return system_prompt, query
+
+    def converted_output(self, table_md, path, in_type):
         assert table_md is not None, f"[===ERROR===][TableManager][Failed to convert images to markdown][{path}]"
         if 'markdown' in table_md:
             return {
@@ -248,46 +357,272 @@ class TableProcessor(LLMAgent):
                 'out_type': 'text',
                 'output': table_md
             }
+
+    def image_cache_key(self, path, in_type):
+        # 转换结果只按图片内容缓存，同一张图在不同论文、不同上下文中只转换一次
+        return self.cache.make_key('convert_to_markdown', self.model_version, in_type, hash_file(path))
+
+    def local_convert(self, caption:str=None, footnote:str=None, in_type:str=None, table_body:str=None, **kwargs):
+        """Convert a table from its HTML body without the LLM; None when there is none or it is not confident enough."""
+        if in_type != 'table' or table_body is None:
+            return None
+        table_md, confidence = html_table_to_markdown(table_body)
+        if confidence < self.local_table_min_confidence:
+            return None
+        reply = f'```markdown\n{table_md}\n```\n'
+        if caption is not None:
+            reply += f'\n[The Start of Title]\n{caption}\n[The End of Title]\n'
+        if footnote is not None:
+            reply += f'\n[The Start of Footnote]\n{footnote}\n[The End of Footnote]\n'
+        return {
+            'in_type': in_type,
+            'out_type': 'markdown',
+            'output': reply,
+        }
+
+    def convert_to_markdown(self, path, caption:str=None, footnote:str=None, in_type:str=None, context:str=None, table_body:str=None):
+        output = self.local_convert(caption, footnote, in_type, table_body)
+        if output is not None:
+            return output
+        if self.use_cache:
+            output = self.cache.get(self.image_cache_key(path, in_type))
+            if output is not None:
+                return output
+        system_prompt, query = self.convert_query(caption, footnote, in_type, context)
+        # print(path)
+        # print(system_prompt)
+        # print(query)
+        # print()
+        table_md = self.safe_api(query, system_prompt=system_prompt, return_dict=False, image_paths=[prepare_image(path, self.image_cache_dir, self.image_max_side)])
+        output = self.converted_output(table_md, path, in_type)
+        if self.use_cache:
+            self.cache.set(self.image_cache_key(path, in_type), output, namespace='convert_to_markdown')
+        return output
+
+    async def aconvert_to_markdown(self, path, caption:str=None, footnote:str=None, in_type:str=None, context:str=None, table_body:str=None):
+        output = self.local_convert(caption, footnote, in_type, table_body)
+        if output is not None:
+            return output
+        if self.use_cache:
+            output = self.cache.get(self.image_cache_key(path, in_type))
+            if output is not None:
+                return output
+        system_prompt, query = self.convert_query(caption, footnote, in_type, context)
+        table_md = await self.asafe_api(query, system_prompt=system_prompt, image_paths=[prepare_image(path, self.image_cache_dir, self.image_max_side)])
+        output = self.converted_output(table_md, path, in_type)
+        if self.use_cache:
+            self.cache.set(self.image_cache_key(path, in_type), output, namespace='convert_to_markdown')
+        return output
+
+    def batch_query(self, table_image_list):
+        in_type = table_image_list[0]['in_type']
+        info_text_list = []
+        for image_idx, table_image_info in enumerate(table_image_list):
+            _, info_text = self.convert_query(table_image_info['caption'], table_image_info['footnote'], in_type, table_image_info['context'], query='<INPUT1>\n<INPUT2>\n<INPUT3>')
+            info_text_list.append(f'[Image {image_idx+1}]\n{info_text.strip()}\n\n')
+        single_query = query_prompt_table if in_type == 'table' else query_prompt_chart
+        example = single_query[single_query.index('Note that your reply'):].strip()
+        query = query_prompt_batch.replace('<INPUT1>', str(len(table_image_list))).replace('<INPUT2>', in_type).replace('<INPUT3>', ''.join(info_text_list)).replace('<INPUT4>', example)
+        system_prompt, _ = self.convert_query(in_type=in_type)
+        return system_prompt, query
+
+    def cached_outputs(self, table_image_list):
+        if not self.use_cache:
+            return [None] * len(table_image_list)
+        return [self.cache.get(self.image_cache_key(x['path'], x['in_type'])) for x in table_image_list]
+
+    def batch_request(self, table_image_list):
+        # 每张图片的回复都需要 max_tokens 的空间，否则多表格的回复会被截断
+        system_prompt, query = self.batch_query(table_image_list)
+        return dict(
+            query=query,
+            system_prompt=system_prompt,
+            image_paths=[prepare_image(x['path'], self.image_cache_dir, self.image_max_side) for x in table_image_list],
+            max_tokens=min(self.max_tokens * len(table_image_list), self.batch_max_tokens),
+        )
+
+    def batch_outputs(self, table_image_list, response, request):
+        # 解析失败时返回 None，由调用方逐张重新请求；无法解析的回复不留在缓存中，重跑时不会重复同样的失败
+        response_list = parse_batch_output(response, len(table_image_list))
+        if response_list is None:
+            self.logger.error(f'Failed to parse the batched reply for {len(table_image_list)} images, converting them one by one')
+            if self.use_cache:
+                self.cache.delete(self.cache_key(**request))
+            return None
+        outputs = []
+        for table_image_info, table_md in zip(table_image_list, response_list):
+            output = self.converted_output(table_md, table_image_info['path'], table_image_info['in_type'])
+            if self.use_cache:
+                self.cache.set(self.image_cache_key(table_image_info['path'], table_image_info['in_type']), output, namespace='convert_to_markdown')
+            outputs.append(output)
+        return outputs
+
+    def convert_batch(self, table_image_list):
+        """Convert several images of the same paper and type in one request, falling back to one request per image."""
+        outputs = self.cached_outputs(table_image_list)
+        todo = [i for i, output in enumerate(outputs) if output is None]
+        if len(todo) > 1:
+            request = self.batch_request([table_image_list[i] for i in todo])
+            batch_outputs = self.batch_outputs([table_image_list[i] for i in todo], self.safe_api(**request), request)
+            if batch_outputs is not None:
+                for i, output in zip(todo, batch_outputs):
+                    outputs[i] = output
+                todo = []
+        for i in todo:
+            try:
+                outputs[i] = self.convert_to_markdown(**table_image_list[i])
+            except Exception as e:
+                self.logger.error(f'Failed to convert {table_image_list[i]["path"]} [{e}]')
+        return outputs
+
+    async def aconvert_batch(self, table_image_list):
+        outputs = self.cached_outputs(table_image_list)
+        todo = [i for i, output in enumerate(outputs) if output is None]
+        if len(todo) > 1:
+            request = self.batch_request([table_image_list[i] for i in todo])
+            batch_outputs = self.batch_outputs([table_image_list[i] for i in todo], await self.asafe_api(**request), request)
+            if batch_outputs is not None:
+                for i, output in zip(todo, batch_outputs):
+                    outputs[i] = output
+                todo = []
+        for i in todo:
+            try:
+                outputs[i] = await self.aconvert_to_markdown(**table_image_list[i])
+            except Exception as e:
+                self.logger.error(f'Failed to convert {table_image_list[i]["path"]} [{e}]')
+        return outputs
+
+    def image_batches(self, table_image_list):
+        # 同一论文（同一解析目录）、同类型的小图按顺序分批，大图单独请求
+        batches = []
+        open_batches = {}
+        for table_image_info in table_image_list:
+            try:
+                with Image.open(table_image_info['path']) as image:
+                    small = max(image.size) <= self.batch_max_side
+            except OSError:
+                small = False
+            if self.image_batch_size <= 1 or not small:
+                batches.append([table_image_info])
+                continue
+            group = (os.path.dirname(os.path.dirname(table_image_info['path'])), table_image_info['in_type'])
+            if group not in open_batches or len(open_batches[group]) >= self.image_batch_size:
+                open_batches[group] = []
+                batches.append(open_batches[group])
+            open_batches[group].append(table_image_info)
+        return batches
+
+    def preprocess(self, table_image_list):
+        """
+        Drop charts that look like non-data images and near-duplicate images (same type, dHash within
+        dedup_threshold, and for tables the same caption). Returns the images to convert and
+        {path: path of the image whose conversion it reuses, or None if skipped}.
+        """
+        to_convert = []
+        reuse = {}
+        representatives = {}
+        seen = set()
+        for table_image_info in table_image_list:
+            path = table_image_info['path']
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                if self.skip_non_data_images and table_image_info['in_type'] == 'chart':
+                    reason = non_data_reason(path)
+                    if reason is not None:
+                        self.logger.info(f'Skip {path} ({reason})')
+                        reuse[path] = None
+                        continue
+                image_hash = dhash(path) if self.dedup_threshold >= 0 else None
+            except OSError:
+                to_convert.append(table_image_info) # 无法读取的图片照常请求，由请求处理失败
+                continue
+            if image_hash is not None:
+                group = (table_image_info['in_type'], table_image_info['caption'] if table_image_info['in_type'] == 'table' else None)
+                same = [rep_path for rep_hash, rep_path in representatives.get(group, []) if hamming(image_hash, rep_hash) <= self.dedup_threshold]
+                if len(same) > 0:
+                    reuse[path] = same[0]
+                    continue
+                representatives.setdefault(group, []).append((image_hash, path))
+            to_convert.append(table_image_info)
+        self.logger.info(f'{len(to_convert)}/{len(table_image_list)} tables (or images) to convert, {sum(1 for v in reuse.values() if v is not None)} duplicates, {sum(1 for v in reuse.values() if v is None)} non-data images skipped')
+        return to_convert, reuse
+
+    def convert_table_images(self, table_image_list, use_tqdm=True):
+        to_convert, reuse = self.preprocess(table_image_list)
+        path2markdown_dict = {}
+        to_convert_llm = []
+        for table_image_info in to_convert:
+            output = self.local_convert(**table_image_info)
+            if output is None:
+                to_convert_llm.append(table_image_info)
+            else:
+                path2markdown_dict[table_image_info['path']] = output
+        batches = self.image_batches(to_convert_llm)
+        self.logger.info(f'{len(to_convert) - len(to_convert_llm)} tables converted locally, {len(to_convert_llm)} tables (or images) in {len(batches)} requests')
+        output_list = self.run_parallel([{'table_image_list': batch} for batch in batches], self.convert_batch, self.aconvert_batch, use_tqdm=use_tqdm)
+        for batch, outputs in zip(batches, output_list):
+            for table_image_info, output in zip(batch, outputs or [None] * len(batch)):
+                path2markdown_dict[table_image_info['path']] = output
+        for path, rep_path in reuse.items():
+            path2markdown_dict[path] = path2markdown_dict.get(rep_path) if rep_path is not None else None
+        return path2markdown_dict
     
 
-    def __call__(self):
-        self.logger.info('Start converting tables or images to markdown')
-        self.markdown_list = multi_thread(self.table_image_list, self.convert_to_markdown)
+    def save_converted_paper(self, paper_idx, paper_info, path2markdown_dict):
+        image_path_prefix = os.path.dirname(paper_info['content_list_path'])
+        paper_content_list_converted = []
+        for content in paper_content_list(get_paper_ir(paper_info)):
+            include_tag = True
+            if 'img_path' in content and len(content['img_path']) > 0:
+                image_path = os.path.join(image_path_prefix, content['img_path'])
+                if image_path not in path2markdown_dict:
+                    include_tag = False # image_path为""的情况是不会处理的，因此也不在 path2markdown_dict 中
+                else:
+                    convert_to_markdown_output = path2markdown_dict[image_path]
+                    if isinstance(convert_to_markdown_output, dict) and 'out_type' in convert_to_markdown_output and 'output' in convert_to_markdown_output:
+                        content['converted_type'] = convert_to_markdown_output['out_type']
+                        content['converted_content'] = convert_to_markdown_output['output']
+                    else:
+                        include_tag = False # 一些情况下，图片无法转换成markdown，或者image_path为""（可能是MinerU的问题），此时path2markdown_dict[image_path]为None，不要放入
+            if include_tag:
+                paper_content_list_converted.append(content)
         
-        self.path2markdown_dict = {}
-        for table_image_idx, table_image_info in enumerate(self.table_image_list):
-            self.path2markdown_dict[table_image_info['path']] = self.markdown_list[table_image_idx]
+        converted_text_path = os.path.join(self.converted_text_save_dir, f'{paper_idx}.json')
+        with open(converted_text_path, 'w', encoding='utf-8') as f:
+            json.dump(paper_content_list_converted, f, ensure_ascii=False, indent=4)
+        paper_info['converted_text_path'] = converted_text_path
+        return paper_info
+    
+
+    def convert_paper(self, paper_idx, paper_info):
+        # convert a single paper, used by the streaming pipeline
+        table_image_list = self.load_paper(paper_idx, paper_info)
+        path2markdown_dict = self.convert_table_images(table_image_list, use_tqdm=False)
+        return self.save_converted_paper(paper_idx, paper_info, path2markdown_dict)
+    
+
+    def __call__(self, paper_ids: list=None):
+        # paper_ids: only convert these papers, the others reuse the converted text already in converted_text_save_dir
+        if paper_ids is None:
+            paper_ids = list(self.paper_info_dict.keys())
+        table_image_list = [table_image for paper_idx in paper_ids for table_image in self.table_image_dict.get(paper_idx, [])]
+
+        self.logger.info(f'Start converting tables or images to markdown ({len(table_image_list)} from {len(paper_ids)} papers)')
+        self.path2markdown_dict = self.convert_table_images(table_image_list)
         
         for paper_idx, paper_info in self.paper_info_dict.items():
-            image_path_prefix = os.path.dirname(paper_info['content_list_path'])
-            with open(paper_info['content_list_path'], 'r', encoding='utf-8') as file:
-                paper_content_list = json.load(file)
-            paper_content_list_converted = []
-            for content in paper_content_list:
-                include_tag = True
-                if 'img_path' in content and len(content['img_path']) > 0:
-                    image_path = os.path.join(image_path_prefix, content['img_path'])
-                    if image_path not in self.path2markdown_dict:
-                        include_tag = False # image_path为""的情况是不会处理的，因此也不在 path2markdown_dict 中
-                    else:
-                        convert_to_markdown_output = self.path2markdown_dict[image_path]
-                        if isinstance(convert_to_markdown_output, dict) and 'out_type' in convert_to_markdown_output and 'output' in convert_to_markdown_output:
-                            content['converted_type'] = convert_to_markdown_output['out_type']
-                            content['converted_content'] = convert_to_markdown_output['output']
-                        else:
-                            include_tag = False # 一些情况下，图片无法转换成markdown，或者image_path为""（可能是MinerU的问题），此时self.path2markdown_dict[image_path]为None，不要放入
-                if include_tag:
-                    paper_content_list_converted.append(content)
-            
-            converted_text_path = os.path.join(self.converted_text_save_dir, f'{paper_idx}.json')
-            self.paper_info_dict[paper_idx]['converted_text_path'] = converted_text_path
-            with open(self.converted_paper_info_path, 'w', encoding='utf-8') as f:
-                json.dump(self.paper_info_dict, f, ensure_ascii=False, indent=4)
-            with open(converted_text_path, 'w', encoding='utf-8') as f:
-                json.dump(paper_content_list_converted, f, ensure_ascii=False, indent=4)
+            if paper_idx not in paper_ids:
+                paper_info['converted_text_path'] = os.path.join(self.converted_text_save_dir, f'{paper_idx}.json')
+                continue
+            self.save_converted_paper(paper_idx, paper_info, self.path2markdown_dict)
         
+        with open(self.converted_paper_info_path, 'w', encoding='utf-8') as f:
+            json.dump(self.paper_info_dict, f, ensure_ascii=False, indent=4)
         self.logger.info(f'Saved converted paper info in {self.converted_paper_info_path}')
         self.logger.info(f'Saved converted text in {self.converted_text_save_dir}')
+        self.log_cache_stats()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+from utils.file_name import get_all_file_paths
+from utils.reader import read_markdown, read_markdown_html
+
+# python benchmark/reader_speed.py [dir with MinerU outputs, default MANALYZER_STORE_DIR]
+md_dir = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('MANALYZER_STORE_DIR', 'data/store')
+md_paths = get_all_file_paths(md_dir, suffix='full.md')
+print(f'{len(md_paths)} MinerU markdown files in {md_dir}')
+
+total_time = {'read_markdown': 0.0, 'read_markdown_html': 0.0}
+same = 0
+diff_examples = []
+for md_path in md_paths:
+    for include_img in [True, False]: # PaperReviewer 与 DataExtratorWithChecker 各读一次
+        start = time.perf_counter()
+        new = read_markdown(md_path, include_img=include_img)
+        total_time['read_markdown'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        old = read_markdown_html(md_path, include_img=include_img)
+        total_time['read_markdown_html'] += time.perf_counter() - start
+
+        if new == old:
+            same += 1
+        elif len(diff_examples) < 5:
+            header = next(header for header in list(new) + list(old) if new.get(header) != old.get(header))
+            diff_examples.append((md_path, include_img, header, new.get(header), old.get(header)))
+
+print('|reader                |total (s)   |per paper (ms)|')
+print('|----------------------|------------|--------------|')
+for name, seconds in total_time.items():
+    print(f'|{name:<22}|{seconds:<12.3f}|{1000 * seconds / max(len(md_paths), 1):<14.2f}|')
+print(f"speedup: {total_time['read_markdown_html'] / max(total_time['read_markdown'], 1e-9):.1f}x")
+print(f'identical output: {same}/{2 * len(md_paths)}')
+for md_path, include_img, header, new, old in diff_examples:
+    print(f'\n[{md_path}][include_img={include_img}][{header!r}]\n  read_markdown:      {new}\n  read_markdown_html: {old}')
@@ -1,6 +1,12 @@
+import os
+import re
+import hashlib
+import threading
 import requests
 import arxiv
+from structai import multi_thread
 from tools.scihub import SciHub
+from utils.llm_cache import ResponseCache
 
 sh = SciHub()
 arxiv_client = arxiv.Client()
@@ -16,13 +22,15 @@ def search_scihub(query, rows=5):
         })
     return results
 
-def search_crossref(query, rows=5):
+def search_crossref(query, rows=5, since=None):
     url = 'https://api.crossref.org/works'
     params = {
         'query': query,
         'rows': rows,
         'mailto': email
     }
+    if since is not None:
+        params['filter'] = f'from-pub-date:{since}'
     
     response = requests.get(url, params=params)
     if response.status_code == 200:
@@ -31,11 +39,15 @@ def search_crossref(query, rows=5):
         for item in data['message']['items']:
             title = item.get('title', ['No title'])[0]
             # authors = ', '.join([f"{author['given']} {author['family']}" for author in item.get('author', [])])
-            doi = item.get('DOI', 'No DOI')
+            doi = item.get('DOI', None)
+            if doi is None:
+                continue # 没有 doi 的结果无法下载
+            date_parts = (item.get('issued') or {}).get('date-parts') or [[]]
             result.append({
                 'title': title,
                 # 'authors': authors,
-                'doi': doi
+                'doi': doi,
+                'published': '-'.join(f'{x:02}' for x in date_parts[0] if x is not None) or None,
             })
         return result
     else:
@@ -43,9 +55,17 @@ def search_crossref(query, rows=5):
         return None
 
 
-def search_semantic_scholar(query, rows=5):
-    url = f'https://api.semanticscholar.org/graph/v1/paper/search?query={query}&limit={rows}'
-    response = requests.get(url)
+def search_semantic_scholar(query, rows=5, since=None):
+    url = 'https://api.semanticscholar.org/graph/v1/paper/search'
+    params = {
+        'query': query,
+        'limit': rows,
+        'fields': 'title,authors,url,externalIds,publicationDate',
+    }
+    if since is not None:
+        params['publicationDateOrYear'] = f'{since}:'
+    headers = {'x-api-key': os.environ['SEMANTIC_SCHOLAR_API_KEY']} if 'SEMANTIC_SCHOLAR_API_KEY' in os.environ else None
+    response = requests.get(url, params=params, headers=headers)
     
     if response.status_code == 200:
         papers = response.json().get('data', [])
@@ -53,21 +73,28 @@ def search_semantic_scholar(query, rows=5):
         for paper in papers:
             title = paper.get('title')
             authors = ', '.join([author['name'] for author in paper.get('authors', [])])
-            paper_url = paper.get('url')
-            pdf_url = paper.get('paperId')
-            result.append({
+            external_ids = paper.get('externalIds') or {}
+            paper_info = {
                 'title': title,
                 'authors': authors,
-                'url': paper_url,
-                'pdf': f'https://www.semanticscholar.org/paper/{pdf_url}'
-            })
+                'pdf': f'https://www.semanticscholar.org/paper/{paper.get("paperId")}',
+                'published': paper.get('publicationDate'),
+            }
+            # 只保留可以直接下载的链接，其余情况通过 doi 下载
+            if 'ArXiv' in external_ids:
+                paper_info['url'] = f'http://arxiv.org/pdf/{external_ids["ArXiv"]}'
+            if 'DOI' in external_ids:
+                paper_info['doi'] = external_ids['DOI']
+            result.append(paper_info)
         return result
     else:
         # print(f'Error: {response.status_code}')
         return None
 
 
-def search_arxiv(query, rows=5):
+def search_arxiv(query, rows=5, since=None):
+    if since is not None:
+        query = f'({query}) AND submittedDate:[{since.replace("-", "")}0000 TO 999912312359]'
     search = arxiv.Search(
         query=query,
         max_results=rows
@@ -76,13 +103,138 @@ def search_arxiv(query, rows=5):
     results = arxiv_client.results(search)
     result_list = []
     for x in results:
-        result_list.append({
+        paper_info = {
             'title': x.title,
             'url': x.pdf_url,
-        })
+            'published': x.published.date().isoformat(),
+        }
+        if x.doi:
+            paper_info['doi'] = x.doi
+        result_list.append(paper_info)
     return result_list
 
 
+SEARCH_ENGINES = {
+    'arxiv': search_arxiv,
+    'crossref': search_crossref,
+    'semantic_scholar': search_semantic_scholar,
+}
+# 每个检索引擎的最大并发请求数，arXiv 要求串行访问
+ENGINE_CONCURRENCY = {'arxiv': 1, 'crossref': 4, 'semantic_scholar': 1}
+_engine_semaphores = {engine: threading.Semaphore(n) for engine, n in ENGINE_CONCURRENCY.items()}
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache(ttl=7 * 24 * 3600):
+    """Search responses cached at $MANALYZER_CACHE_DIR/search_cache.sqlite, kept for `ttl` seconds."""
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            cache_dir = os.environ.get('MANALYZER_CACHE_DIR', os.path.join('data', 'cache'))
+            _search_cache = ResponseCache(os.path.join(cache_dir, 'search_cache.sqlite'), max_age=ttl)
+    return _search_cache
+
+
+def cached_search(engine, query, rows=5, since=None, use_cache=True):
+    cache = get_search_cache() if use_cache else None
+    if cache is not None:
+        key = cache.make_key(engine, query, rows, since)
+        result = cache.get(key)
+        if result is not None:
+            return result
+    with _engine_semaphores[engine]:
+        result = SEARCH_ENGINES[engine](query, rows, since=since)
+    if result is None: # 请求失败（例如被限流）时不缓存
+        return []
+    if cache is not None:
+        cache.set(key, result, namespace=engine)
+    return result
+
+
+def normalize_title(title):
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', (title or '').lower()).split())
+
+
+def normalize_doi(doi):
+    doi = (doi or '').strip().lower()
+    return re.sub(r'^(https?://)?(dx\.)?doi\.org/', '', doi)
+
+
+class PaperIndex:
+    """
+    Deduplicates search results across engines and queries.
+
+    Every paper is indexed under the hash of its normalised DOI and of its normalised title,
+    so a duplicate is found in O(1) whichever of the two it shares. Fields missing from the
+    first record of a paper are filled in from later duplicates, and `sources` lists the
+    engines that returned it.
+    """
+    def __init__(self):
+        self.papers = []
+        self._index = {}
+
+    @staticmethod
+    def keys(paper_info):
+        keys = []
+        doi = normalize_doi(paper_info.get('doi'))
+        if doi:
+            keys.append(hashlib.sha1(('doi:' + doi).encode('utf-8')).hexdigest())
+        title = normalize_title(paper_info.get('title'))
+        if title:
+            keys.append(hashlib.sha1(('title:' + title).encode('utf-8')).hexdigest())
+        return keys
+
+    def add(self, paper_info, source=None):
+        """Add a search result, returns True if it is a new paper."""
+        keys = self.keys(paper_info)
+        existing = next((self._index[k] for k in keys if k in self._index), None)
+        if existing is None:
+            existing = dict(paper_info)
+            existing['sources'] = []
+            self.papers.append(existing)
+            is_new = True
+        else:
+            for k, v in paper_info.items():
+                if v and not existing.get(k):
+                    existing[k] = v
+            is_new = False
+        if source is not None and source not in existing['sources']:
+            existing['sources'].append(source)
+        for k in self.keys(existing):
+            self._index[k] = existing
+        return is_new
+
+    def __contains__(self, paper_info):
+        return any(k in self._index for k in self.keys(paper_info))
+
+    def __len__(self):
+        return len(self.papers)
+
+
+def federated_search(queries, rows=5, engines=('arxiv', 'crossref', 'semantic_scholar'), index=None, since=None, use_cache=True, max_workers=8):
+    """
+    Run every query against every engine concurrently and return the deduplicated papers.
+
+    Results are merged in query order, then engine order, so the output does not depend on
+    which request finishes first. Pass an existing PaperIndex to dedup against earlier results,
+    and `since` ('YYYY-MM-DD') to only keep papers published on or after that date.
+    """
+    if index is None:
+        index = PaperIndex()
+    mp_inp_list = [{'engine': engine, 'query': query, 'rows': rows, 'since': since, 'use_cache': use_cache} for query in queries for engine in engines]
+    results = multi_thread(mp_inp_list, cached_search, max_workers=max_workers, use_tqdm=False)
+    new_papers = []
+    for inp, result in zip(mp_inp_list, results):
+        for paper_info in result or []:
+            published = paper_info.get('published')
+            if since is not None and published and published < since[:len(published)]: # Crossref 的日期可能只有年或年月
+                continue
+            if index.add(paper_info, source=inp['engine']):
+                new_papers.append(index.papers[-1])
+    return new_papers
+
+
 if __name__ == '__main__':
     # result = search_scihub('machine learning')
     # print(result)
@@ -95,3 +247,6 @@ if __name__ == '__main__':
     
     result = search_arxiv('machine learning')
     # print(result)
+
+    result = federated_search(['machine learning', 'deep learning'], rows=3)
+    # print(result)
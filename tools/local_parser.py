@@ -0,0 +1,222 @@
+import os
+import re
+import html
+import json
+import hashlib
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tools.mineru import write_artifacts
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+
+MIN_IMAGE_SIZE = 50 # 更小的图片多为图标或公式符号
+CAPTION_PATTERN = {
+    'image': re.compile(r'^\s*(fig\.?|figure)\s*\S+', re.IGNORECASE),
+    'table': re.compile(r'^\s*table\s*\S+', re.IGNORECASE),
+}
+HEADING_PATTERN = re.compile(r'^(\d+(\.\d+)*\.?|[IVX]+\.)\s+\S')
+
+
+def block_text(block):
+    lines = []
+    for line in block['lines']:
+        lines.append(''.join(span['text'] for span in line['spans']))
+    return ' '.join(' '.join(lines).split())
+
+
+def block_font(block):
+    sizes = Counter()
+    bold = 0
+    for line in block['lines']:
+        for span in line['spans']:
+            sizes[round(span['size'], 1)] += len(span['text'])
+            if span['flags'] & 16:
+                bold += len(span['text'])
+    total = sum(sizes.values())
+    size = sizes.most_common(1)[0][0] if total > 0 else 0
+    return size, total > 0 and bold >= total / 2
+
+
+def save_clip(page, rect, images_dir, dpi):
+    pix = page.get_pixmap(clip=rect, dpi=dpi)
+    data = pix.tobytes('jpg')
+    name = hashlib.sha256(data).hexdigest() + '.jpg'
+    with open(os.path.join(images_dir, name), 'wb') as f:
+        f.write(data)
+    return 'images/' + name
+
+
+def table_html(rows):
+    # 单元格文字需要转义，例如 `<5`、`a<b`、`&`
+    body = '<table>'
+    for row in rows:
+        body += '<tr>' + ''.join(f'<td>{"" if cell is None else html.escape(str(cell))}</td>' for cell in row) + '</tr>'
+    return body + '</table>'
+
+
+def reading_order(page_width, rect):
+    # 两栏排版：完全位于右半栏的块排在左半栏之后
+    column = 1 if rect.x0 >= page_width / 2 - 10 and rect.width < page_width * 0.6 else 0
+    return (column, round(rect.y0, 1), rect.x0)
+
+
+def attach_captions(items):
+    """Move the caption next to each image (below) or table (above) out of the text items."""
+    for i, item in enumerate(items):
+        if item['type'] not in CAPTION_PATTERN:
+            continue
+        candidates = [i + 1, i - 1] if item['type'] == 'image' else [i - 1, i + 1]
+        for j in candidates:
+            if 0 <= j < len(items) and items[j]['type'] == 'text' and not items[j].get('_caption') and CAPTION_PATTERN[item['type']].match(items[j]['text']):
+                item[f'{item["type"]}_caption'] = [items[j]['text']]
+                items[j]['_caption'] = True
+                break
+    return [item for item in items if not item.get('_caption')]
+
+
+def parse_pdf_local(pdf_path, dpi=150):
+    """
+    Parse one PDF with PyMuPDF into `<pdf_path without .pdf>/`, in the same shape as MinerU:
+    `full.md`, `<name>_content_list.json` and `images/`. Returns the artifact paths.
+    """
+    assert pymupdf is not None, "[===ERROR===][local_parser][PyMuPDF is not installed, run `pip install pymupdf`]"
+    parsed_dir = pdf_path[:-4]
+    images_dir = os.path.join(parsed_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+
+    doc = pymupdf.open(pdf_path)
+    pages = []
+    font_sizes = Counter()
+    for page_idx, page in enumerate(doc):
+        try:
+            tables = list(page.find_tables().tables)
+        except Exception:
+            tables = []
+        table_rects = [pymupdf.Rect(table.bbox) for table in tables]
+
+        items = []
+        for table, rect in zip(tables, table_rects):
+            items.append((reading_order(page.rect.width, rect), {
+                'type': 'table',
+                'img_path': save_clip(page, rect, images_dir, dpi),
+                'table_caption': [],
+                'table_footnote': [],
+                'table_body': table_html(table.extract()),
+                'page_idx': page_idx,
+            }))
+
+        for block in page.get_text('dict')['blocks']:
+            rect = pymupdf.Rect(block['bbox'])
+            if any(rect.intersects(table_rect) and (rect & table_rect).get_area() > 0.5 * rect.get_area() for table_rect in table_rects):
+                continue # 表格内的文字已在 table_body 中
+            if block['type'] == 0:
+                text = block_text(block)
+                if len(text) == 0:
+                    continue
+                size, bold = block_font(block)
+                font_sizes[size] += len(text)
+                items.append((reading_order(page.rect.width, rect), {'type': 'text', 'text': text, 'page_idx': page_idx, '_size': size, '_bold': bold}))
+            elif block['type'] == 1 and rect.width >= MIN_IMAGE_SIZE and rect.height >= MIN_IMAGE_SIZE:
+                items.append((reading_order(page.rect.width, rect), {
+                    'type': 'image',
+                    'img_path': save_clip(page, rect, images_dir, dpi),
+                    'image_caption': [],
+                    'image_footnote': [],
+                    'page_idx': page_idx,
+                }))
+        pages.append(attach_captions([item for _, item in sorted(items, key=lambda x: x[0])]))
+    doc.close()
+
+    # 正文字号取出现最多的字号，明显更大或加粗编号的短文本视为标题
+    body_size = font_sizes.most_common(1)[0][0] if len(font_sizes) > 0 else 0
+    content_list = []
+    md_lines = []
+    for items in pages:
+        for item in items:
+            if item['type'] == 'text':
+                size, bold = item.pop('_size'), item.pop('_bold')
+                if len(item['text']) < 200 and (size >= body_size + 1.5 or (bold and HEADING_PATTERN.match(item['text']))):
+                    item['text_level'] = 1
+                    md_lines.append('# ' + item['text'])
+                else:
+                    md_lines.append(item['text'])
+            elif item['type'] == 'image':
+                md_lines.append(f'![]({item["img_path"]})')
+                md_lines.extend(item['image_caption'])
+            elif item['type'] == 'table':
+                md_lines.extend(item['table_caption'])
+                md_lines.append(f'![]({item["img_path"]})')
+                md_lines.append(item['table_body'])
+            content_list.append(item)
+
+    name = os.path.basename(parsed_dir)
+    with open(os.path.join(parsed_dir, f'{name}_content_list.json'), 'w', encoding='utf-8') as f:
+        json.dump(content_list, f, ensure_ascii=False, indent=4)
+    with open(os.path.join(parsed_dir, 'full.md'), 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(md_lines) + '\n')
+    return write_artifacts(parsed_dir, backend='local')
+
+
+class LocalPDFParser:
+    """
+    Offline parser backend: PyMuPDF text, table and image extraction in a process pool.
+
+    Same interface as MinerUClient, so throughput scales with the number of cores instead of
+    the MinerU queue. Layout analysis is heuristic (font size for headings, two-column reading
+    order, `Figure`/`Table` captions next to the element), so MinerU remains more accurate.
+
+    One process pool is created on first use and shared by every `parse` call, so the streaming
+    pipeline, which parses one PDF per call from several threads, stays at max_workers processes.
+    Workers are spawned rather than forked from this multithreaded process.
+    """
+    def __init__(self, max_workers=None, dpi=150, **kwargs):
+        self.max_workers = max_workers or os.cpu_count()
+        self.dpi = dpi
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = None
+
+    def parse(self, pdf_paths, on_result=None):
+        results = {}
+        executor = self.executor()
+        futures = {executor.submit(parse_pdf_local, pdf_path, self.dpi): pdf_path for pdf_path in pdf_paths}
+        for future in as_completed(futures):
+            pdf_path = futures[future]
+            try:
+                artifacts = future.result()
+            except Exception as e:
+                print(f"[ERROR] Local parsing failed for {pdf_path}: {e}")
+                artifacts = None
+            results[pdf_path] = artifacts
+            if on_result is not None:
+                try:
+                    on_result(pdf_path, artifacts)
+                except Exception as e:
+                    print(f"[ERROR] on_result failed for {pdf_path}: {e}")
+        return results
+
+
+if __name__ == '__main__':
+    # python -m tools.local_parser test/1909.03550v1.pdf
+    import sys
+    print(LocalPDFParser().parse(sys.argv[1:]))
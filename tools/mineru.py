@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from structai import multi_thread
+from structai.pdf import get_headers, download_and_unzip
+
+BATCH_URL = 'https://mineru.net/api/v4/file-urls/batch'
+RESULT_URL = 'https://mineru.net/api/v4/extract-results/batch/{}'
+ARTIFACT_FILE = 'artifacts.json'
+
+
+def parsed_artifacts(parsed_dir, backend=None):
+    """
+    Paths of full.md and the content list in a parser output directory, None if it is incomplete
+    or, when backend is given, was written by another parser backend.
+    """
+    manifest_path = os.path.join(parsed_dir, ARTIFACT_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            artifacts = json.load(file)
+    elif os.path.isdir(parsed_dir):
+        # 旧的解析结果没有 artifacts.json，只看顶层目录
+        content_list_names = sorted(name for name in os.listdir(parsed_dir) if name.endswith('_content_list.json'))
+        artifacts = {'md': 'full.md', 'content_list': content_list_names[0] if len(content_list_names) > 0 else None}
+    else:
+        return None
+    if artifacts['content_list'] is None or not os.path.exists(os.path.join(parsed_dir, artifacts['md'])):
+        return None
+    if backend is not None and artifacts.get('backend', 'mineru') != backend: # 旧的解析结果都来自 MinerU
+        return None
+    return {
+        'md_path': os.path.join(parsed_dir, artifacts['md']),
+        'content_list_path': os.path.join(parsed_dir, artifacts['content_list']),
+    }
+
+
+def write_artifacts(parsed_dir, backend='mineru'):
+    content_list_names = sorted(name for name in os.listdir(parsed_dir) if name.endswith('_content_list.json'))
+    artifacts = {'md': 'full.md', 'content_list': content_list_names[0] if len(content_list_names) > 0 else None, 'backend': backend}
+    with open(os.path.join(parsed_dir, ARTIFACT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(artifacts, f, ensure_ascii=False, indent=4)
+    return parsed_artifacts(parsed_dir)
+
+
+class MinerUClient:
+    """
+    Batched, concurrent client for the MinerU cloud parser.
+
+    PDFs are split into batches of `batch_size`, and up to `max_workers` batches are uploaded
+    and polled at the same time. Each file is downloaded by a worker pool as soon as MinerU reports
+    it done and `on_result(pdf_path, artifacts)` is called right away; a failed upload, a failed
+    parse or a batch that exceeds `timeout` only loses its own files (artifacts is None).
+    """
+    def __init__(self, batch_size=20, max_workers=4, poll_interval=5, timeout=30*60, upload_workers=8):
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.upload_workers = upload_workers
+
+    def upload(self, pdf_paths):
+        files = [{"name": os.path.basename(pdf_path), "is_ocr": True, "data_id": f'{i:03}'} for i, pdf_path in enumerate(pdf_paths)]
+        data = {
+            "enable_formula": True,
+            "language": "en",
+            "enable_table": True,
+            "files": files
+        }
+        response = requests.post(BATCH_URL, headers=get_headers(), json=data, timeout=60)
+        response.raise_for_status()
+        result = response.json()
+        if result["code"] != 0:
+            raise Exception(f"Apply upload url failed: {result.get('msg')}")
+
+        def put(pdf_path, url):
+            with open(pdf_path, 'rb') as f:
+                requests.put(url, data=f, timeout=300).raise_for_status()
+            return True
+        uploaded = multi_thread([{'pdf_path': pdf_path, 'url': url} for pdf_path, url in zip(pdf_paths, result['data']['file_urls'])], put, max_workers=self.upload_workers, use_tqdm=False)
+        return result['data']['batch_id'], [uploaded_tag is True for uploaded_tag in uploaded]
+
+    def fetch(self, url, pdf_path, on_result):
+        parsed_dir = pdf_path[:-4]
+        try:
+            download_and_unzip(url, parsed_dir)
+            artifacts = write_artifacts(parsed_dir)
+        except Exception as e:
+            print(f"[ERROR] MinerU download failed for {pdf_path}: {e}")
+            artifacts = None
+        on_result(pdf_path, artifacts)
+
+    def parse_batch(self, pdf_paths, on_result, download_executor):
+        try:
+            batch_id, uploaded = self.upload(pdf_paths)
+        except Exception as e:
+            print(f"[ERROR] MinerU upload failed: {e}")
+            for pdf_path in pdf_paths:
+                on_result(pdf_path, None)
+            return
+
+        pending = {}
+        for i, pdf_path in enumerate(pdf_paths):
+            if uploaded[i]:
+                pending[f'{i:03}'] = pdf_path
+            else:
+                on_result(pdf_path, None)
+
+        downloads = []
+        start = time.time()
+        while len(pending) > 0 and time.time() - start < self.timeout:
+            time.sleep(self.poll_interval)
+            try:
+                res = requests.get(RESULT_URL.format(batch_id), headers=get_headers(), timeout=60)
+                if res.status_code != 200:
+                    continue
+                extract_result = res.json().get("data", {}).get("extract_result", [])
+            except Exception as e:
+                print(f"[WARNING] MinerU polling error: {e}")
+                continue
+
+            for result in extract_result:
+                pdf_path = pending.get(result.get('data_id'))
+                if pdf_path is None:
+                    continue
+                if result['state'] == 'done':
+                    del pending[result['data_id']]
+                    downloads.append(download_executor.submit(self.fetch, result['full_zip_url'], pdf_path, on_result))
+                elif result['state'] == 'failed':
+                    del pending[result['data_id']]
+                    on_result(pdf_path, None)
+
+        for pdf_path in pending.values():
+            print(f"[ERROR] MinerU timed out on {pdf_path}")
+            on_result(pdf_path, None)
+        for future in downloads:
+            future.result()
+
+    def parse(self, pdf_paths, on_result=None):
+        """Parse pdf_paths into `<pdf_path without .pdf>/`, returns {pdf_path: artifacts or None}."""
+        results = {}
+        lock = threading.Lock()
+        def record(pdf_path, artifacts):
+            with lock:
+                results[pdf_path] = artifacts
+            if on_result is not None:
+                try:
+                    on_result(pdf_path, artifacts)
+                except Exception as e:
+                    print(f"[ERROR] on_result failed for {pdf_path}: {e}")
+
+        batches = [pdf_paths[i:i + self.batch_size] for i in range(0, len(pdf_paths), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, ThreadPoolExecutor(max_workers=self.upload_workers) as download_executor:
+            for future in [executor.submit(self.parse_batch, batch, record, download_executor) for batch in batches]:
+                future.result()
+        return results
+
+
+if __name__ == '__main__':
+    client = MinerUClient(batch_size=2)
+    print(client.parse(['test/1909.03550v1.pdf'], on_result=lambda pdf_path, artifacts: print(pdf_path, artifacts)))
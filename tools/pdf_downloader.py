@@ -1,11 +1,82 @@
 import os
-import requests
 import re
-import urllib.request
+import time
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 from tools.scihub import SciHub
 
 sh = SciHub()
 
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.108 Safari/537.36',
+}
+# 每个 host 的最大并发下载数，未列出的 host 使用 DEFAULT_HOST_CONCURRENCY
+HOST_CONCURRENCY = {'arxiv.org': 4, 'export.arxiv.org': 4, 'sci-hub': 2}
+DEFAULT_HOST_CONCURRENCY = 8
+CHUNK_SIZE = 1 << 16
+
+_sessions = {}
+_semaphores = {}
+_retry_after = {}
+_pool_lock = threading.Lock()
+
+
+def _host_key(url):
+    host = urlparse(url).netloc.lower() if '://' in url else url
+    return 'sci-hub' if 'sci-hub' in host else host
+
+
+def get_session(url):
+    """Pooled requests.Session shared by every download from the same host."""
+    host = _host_key(url)
+    with _pool_lock:
+        if host not in _sessions:
+            pool_size = HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY)
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def host_slot(url):
+    """Semaphore capping concurrent downloads from the host of `url`."""
+    host = _host_key(url)
+    with _pool_lock:
+        if host not in _semaphores:
+            _semaphores[host] = threading.BoundedSemaphore(HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+        return _semaphores[host]
+
+
+def _wait_host(url):
+    # 被 429 限流的 host 在 Retry-After 之前不再发请求
+    wait = _retry_after.get(_host_key(url), 0) - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _rate_limited(url, response):
+    try:
+        wait = float(response.headers.get('Retry-After', 10))
+    except ValueError:
+        wait = 10.0
+    _retry_after[_host_key(url)] = time.monotonic() + wait
+
+
+def stream_to_file(response, save_path):
+    # 先写入 .part 文件，完成后再改名，中断的下载不会留下不完整的 pdf
+    part_path = save_path + '.part'
+    with open(part_path, 'wb') as file:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if chunk:
+                file.write(chunk)
+    os.replace(part_path, save_path)
+
+
 def download_pdf(url, dir='./', name=None):
     if name is None:
         name = url.split('/')[-1]+'.pdf'
@@ -14,16 +85,20 @@ def download_pdf(url, dir='./', name=None):
     
     try:
         if 'arxiv' in url:
-            response = requests.get(url)
-            response.raise_for_status()
-
-            with open(save_path, 'wb') as file:
-                file.write(response.content)
+            with host_slot(url):
+                _wait_host(url)
+                with get_session(url).get(url, stream=True, timeout=60) as response:
+                    if response.status_code == 429:
+                        _rate_limited(url, response)
+                        return None
+                    response.raise_for_status()
+                    stream_to_file(response, save_path)
 
             # print(f"download to {save_path}")
             return True
         else:
-            result = sh.download(url, path=save_path)
+            with host_slot('sci-hub'):
+                result = sh.download(url, path=save_path)
             if 'err' in result:
                 # print(f"download wrong {result['err']}")
                 return False
@@ -38,9 +113,6 @@ def download_pdf(url, dir='./', name=None):
 def download_pdf_with_doi(doi:str, dir='./', name=None):
     # https://blog.51cto.com/u_12877374/4935132
     sci_Hub_Url = "https://sci-hub.ren/"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.108 Safari/537.36',
-    }
 
     paper_url = sci_Hub_Url + doi
 
@@ -52,24 +124,25 @@ def download_pdf_with_doi(doi:str, dir='./', name=None):
     os.makedirs(dir, exist_ok=True)
     save_path = os.path.join(dir, name)
 
-    content = requests.get(paper_url, headers=headers)
+    with host_slot(paper_url):
+        _wait_host(paper_url)
+        content = get_session(paper_url).get(paper_url, timeout=30)
+    if content.status_code == 429:
+        _rate_limited(paper_url, content)
+        return None
     # print(content)
     download_url = re.findall(pattern, content.text)
     # print(download_url)
     for url in download_url:
         try:
-            req = urllib.request.Request(url, headers=headers)
-            u = urllib.request.urlopen(req, timeout=5)
-
-            f = open(save_path, 'wb')
-
-            block_sz = 8192
-            while True:
-                buffer = u.read(block_sz)
-                if not buffer:
-                    break
-                f.write(buffer)
-            f.close()
+            with host_slot(url):
+                _wait_host(url)
+                with get_session(url).get(url, stream=True, timeout=5) as response:
+                    if response.status_code == 429:
+                        _rate_limited(url, response)
+                        return None
+                    response.raise_for_status()
+                    stream_to_file(response, save_path)
             # print(f"download to {save_path}")
             return True
         except Exception as e:
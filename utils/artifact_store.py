@@ -0,0 +1,125 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import threading
+from utils.llm_cache import hash_file
+from tools.mineru import parsed_artifacts
+
+
+def paper_ids(paper_info):
+    """Stable identifiers of a paper: its DOI and/or arXiv id."""
+    ids = []
+    doi = paper_info.get('doi', None)
+    if doi:
+        ids.append('doi:' + doi.strip().lower())
+    url = paper_info.get('url', None) or ''
+    match = re.search(r'arxiv\.org/(?:abs|pdf)/([^/?#]+?)(?:\.pdf)?$', url)
+    if match:
+        ids.append('arxiv:' + match.group(1))
+    return ids
+
+
+def link(target, link_path):
+    # 运行目录里只保留指向仓库的软链接，不支持软链接的文件系统退回复制
+    if os.path.lexists(link_path):
+        if os.path.isdir(link_path) and not os.path.islink(link_path):
+            shutil.rmtree(link_path)
+        else:
+            os.remove(link_path)
+    try:
+        os.symlink(os.path.abspath(target), link_path)
+    except OSError:
+        if os.path.isdir(target):
+            shutil.copytree(target, link_path)
+        else:
+            shutil.copyfile(target, link_path)
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for PDFs and their MinerU outputs, shared by all runs.
+
+    A PDF lives at `<root>/<sha[:2]>/<sha>.pdf` and MinerU writes its `full.md`,
+    `*_content_list.json` and `images/` next to it in `<root>/<sha[:2]>/<sha>/`. An index maps
+    DOIs and arXiv ids to hashes, so a paper found again by a later run is neither downloaded
+    nor parsed again. Run directories only hold symlinks into the store.
+    """
+    def __init__(self, root):
+        os.makedirs(root, exist_ok=True)
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, 'index.sqlite'), timeout=60, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY, sha TEXT, created REAL)')
+            self._conn.commit()
+
+    def pdf_path(self, sha):
+        return os.path.join(self.root, sha[:2], sha + '.pdf')
+
+    def parsed_dir(self, sha):
+        return self.pdf_path(sha)[:-4]
+
+    def is_parsed(self, sha, backend=None):
+        """Whether the PDF has a parse result, from the given parser backend if one is given."""
+        if backend is None:
+            return os.path.exists(os.path.join(self.parsed_dir(sha), 'full.md'))
+        return parsed_artifacts(self.parsed_dir(sha), backend) is not None
+
+    def contains(self, path):
+        return os.path.realpath(path).startswith(self.root + os.sep)
+
+    def lookup(self, paper_info):
+        """sha256 of a stored PDF matching the paper's DOI or arXiv id, else None."""
+        for paper_id in paper_ids(paper_info):
+            with self._lock:
+                row = self._conn.execute('SELECT sha FROM ids WHERE id=?', (paper_id,)).fetchone()
+            if row is not None and os.path.exists(self.pdf_path(row[0])):
+                return row[0]
+        return None
+
+    def register(self, sha, paper_info):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO ids (id, sha, created) VALUES (?, ?, ?)', [(paper_id, sha, now) for paper_id in paper_ids(paper_info)])
+            self._conn.commit()
+
+    def ingest(self, path, paper_info=None):
+        """Move the PDF at `path` into the store, leave a symlink in its place and return its sha256."""
+        if self.contains(path):
+            sha = os.path.basename(os.path.realpath(path))[:-4]
+        else:
+            sha = hash_file(path)
+            store_path = self.pdf_path(sha)
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            if os.path.exists(store_path):
+                os.remove(path) # 内容相同的 pdf 已在仓库中
+            else:
+                shutil.move(path, store_path)
+            link(store_path, path)
+        if paper_info is not None:
+            self.register(sha, paper_info)
+        return sha
+
+    def link_parsed(self, sha, pdf_path):
+        """Point `<pdf_path without .pdf>/` of a run at the stored MinerU output."""
+        link(self.parsed_dir(sha), pdf_path[:-4])
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_artifact_store():
+    """Process-wide store at $MANALYZER_STORE_DIR (default data/store)."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ArtifactStore(os.environ.get('MANALYZER_STORE_DIR', os.path.join('data', 'store')))
+    return _default_store
+
+
+if __name__ == '__main__':
+    print(paper_ids({'title': 'x', 'url': 'http://arxiv.org/pdf/1909.03550v1'}))
+    print(paper_ids({'title': '10.1007/s10661-008-0688-5', 'doi': '10.1007/S10661-008-0688-5'}))
@@ -0,0 +1,56 @@
+import re
+import math
+from collections import Counter
+
+
+STOP_WORDS = set("""
+a an and are as at be by for from has have in into is it its of on or that the their this to was were which with
+we our using based study studies analysis data paper results result effect effects between among during via
+""".split())
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[一-鿿]')
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1] # 简单去掉复数
+        tokens.append(token)
+    return tokens
+
+
+class BM25:
+    """Okapi BM25 over pre-tokenised documents."""
+    def __init__(self, corpus, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_freqs = [Counter(doc) for doc in corpus]
+        self.doc_lens = [len(doc) for doc in corpus]
+        self.avg_len = sum(self.doc_lens) / len(corpus) if len(corpus) > 0 else 0
+        df = Counter(token for doc in self.doc_freqs for token in doc)
+        self.idf = {token: math.log(1 + (len(corpus) - n + 0.5) / (n + 0.5)) for token, n in df.items()}
+
+    def scores(self, query):
+        scores = []
+        query = set(query)
+        for freqs, doc_len in zip(self.doc_freqs, self.doc_lens):
+            norm = self.k1 * (1 - self.b + self.b * doc_len / self.avg_len) if self.avg_len > 0 else self.k1
+            score = 0.0
+            for token in query:
+                tf = freqs.get(token, 0)
+                if tf > 0:
+                    score += self.idf[token] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+if __name__ == '__main__':
+    corpus = [
+        'Heavy metals in river water of the Tigris River, Turkey',
+        'Deep learning for image classification',
+        'Occurrence of polar organic pollutants in European rivers',
+    ]
+    bm25 = BM25([tokenize(doc) for doc in corpus])
+    print(bm25.scores(tokenize('River pollutants heavy metal content')))
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+from PIL import Image
+from utils.llm_cache import hash_file
+
+
+def dhash(path, hash_size=16):
+    """Difference hash: brighter-than-right-neighbour bits of a (hash_size+1) x hash_size grey thumbnail."""
+    with Image.open(path) as image:
+        pixels = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    bits = 0
+    for bit in (pixels[:, :-1] > pixels[:, 1:]).flatten():
+        bits = (bits << 1) | int(bit)
+    return bits
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def non_data_reason(path, min_side=80, max_aspect=8.0, min_white=0.15, max_colors=3000):
+    """
+    Cheap check for figures that hold no data: tiny images and banners (logos, icons) and
+    photo-like images (photos, satellite maps) with little white background and many colours.
+    Returns the reason, or None for images that look like charts.
+    """
+    with Image.open(path) as image:
+        width, height = image.size
+        if min(width, height) < min_side:
+            return 'too small'
+        if max(width, height) / max(min(width, height), 1) > max_aspect:
+            return 'banner'
+        pixels = np.asarray(image.convert('RGB').resize((128, 128), Image.NEAREST)).reshape(-1, 3)
+    white = float((pixels > 235).all(axis=1).mean())
+    quantized = pixels.astype(np.int32) >> 3
+    colors = len(np.unique((quantized[:, 0] << 10) | (quantized[:, 1] << 5) | quantized[:, 2]))
+    if white < min_white and colors > max_colors:
+        return 'photo-like'
+    return None
+
+
+def prepare_image(path, cache_dir, max_side=1568, max_bytes=1_500_000, quality=85):
+    """
+    Downscale images larger than max_side (the models' effective resolution) and recompress large
+    files to JPEG under cache_dir, named by content hash. Returns the path to upload.
+    """
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if max(width, height) <= max_side and os.path.getsize(path) <= max_bytes:
+                return path
+            prepared_path = os.path.join(cache_dir, f'{hash_file(path)}_{max_side}.jpg')
+            if os.path.exists(prepared_path):
+                return prepared_path
+            image = image.convert('RGBA') if image.mode in ['P', 'LA'] else image
+            if image.mode == 'RGBA': # 透明背景按白色处理
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                image = background
+            image = image.convert('RGB')
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = prepared_path + f'.{os.getpid()}.part'
+            image.save(tmp_path, 'JPEG', quality=quality)
+            os.replace(tmp_path, prepared_path)
+            return prepared_path
+    except OSError:
+        return path # 无法读取的图片交给后续的请求处理
+
+
+if __name__ == '__main__':
+    import sys
+    # python -m utils.image_prep a.jpg b.jpg ...
+    hashes = {path: dhash(path) for path in sys.argv[1:]}
+    for path in sys.argv[1:]:
+        print(path, f'{hashes[path]:064x}', non_data_reason(path), prepare_image(path, 'data/cache/images'))
+        for other in sys.argv[1:]:
+            if other < path and hamming(hashes[path], hashes[other]) <= 3:
+                print(f'  near-duplicate of {other}')
@@ -1,4 +1,8 @@
-def knapsack(items, max_weight):
+import numpy as np
+
+
+def knapsack_table(items, max_weight):
+    # 原始的二维 DP 实现，O(n·W) 的 Python 列表，仅作为对照
     n = len(items)
     dp = [[0] * (max_weight + 1) for _ in range(n + 1)]
 
@@ -26,9 +30,122 @@ def knapsack(items, max_weight):
 
     return max_value, selected_items
 
+
+def knapsack_dp(weights, values, max_weight):
+    """
+    Exact 0/1 knapsack with a 1-D rolling DP over capacities (NumPy, one vector op per item).
+    Only the "item taken" decisions are kept, packed as bits (n × (W+1) / 8 bytes), for backtracking.
+    Ties are broken like knapsack_table, so the selection is identical to it.
+    """
+    values = np.asarray(values)
+    dp = np.zeros(max_weight + 1, dtype=np.float64 if values.dtype.kind == 'f' else np.int64)
+    taken = np.zeros((len(weights), (max_weight + 8) // 8), dtype=np.uint8)
+    for i, (weight, value) in enumerate(zip(weights, values)):
+        if weight > max_weight:
+            continue
+        take = dp[:max_weight + 1 - weight] + value
+        better = take > dp[weight:]
+        if not better.any():
+            continue
+        dp[weight:] = np.where(better, take, dp[weight:])
+        row = np.zeros(max_weight + 1, dtype=bool)
+        row[weight:] = better
+        taken[i] = np.packbits(row)
+
+    selected_items = [0] * len(weights)
+    w = max_weight
+    for i in range(len(weights) - 1, -1, -1):
+        if (taken[i, w >> 3] >> (7 - (w & 7))) & 1:
+            selected_items[i] = 1
+            w -= weights[i]
+    return dp[max_weight].item(), selected_items
+
+
+def knapsack_greedy(weights, values, max_weight):
+    # 按价值/长度从高到低放入，再与单个最有价值的物品比较（至少为最优解的一半）
+    order = sorted(range(len(weights)), key=lambda i: (-values[i] / weights[i] if weights[i] > 0 else -float('inf'), i))
+    selected_items = [0] * len(weights)
+    total_weight, total_value = 0, 0
+    for i in order:
+        if values[i] > 0 and total_weight + weights[i] <= max_weight:
+            selected_items[i] = 1
+            total_weight += weights[i]
+            total_value += values[i]
+    fit = [i for i in range(len(weights)) if weights[i] <= max_weight]
+    if len(fit) > 0:
+        best = max(fit, key=lambda i: (values[i], -i))
+        if values[best] > total_value:
+            selected_items = [int(i == best) for i in range(len(weights))]
+            total_value = values[best]
+    return total_value, selected_items
+
+
+def knapsack(items, max_weight, bucket=1, max_exact_items=5000):
+    """
+    Select items ({'weight', 'value'}) with total weight <= max_weight maximising the total value.
+    Returns (max_value, selected_items) with selected_items[i] in {0, 1}.
+
+    bucket > 1 rounds weights up to multiples of bucket (e.g. 50 characters), shrinking the DP by
+    that factor; the selection stays feasible but may be slightly below the exact optimum.
+    More than max_exact_items items falls back to the greedy value/weight selection.
+    """
+    weights = [item['weight'] for item in items]
+    values = [item['value'] for item in items]
+    if len(items) > max_exact_items:
+        return knapsack_greedy(weights, values, max_weight)
+    if bucket > 1:
+        _, selected_items = knapsack_dp([-(-weight // bucket) for weight in weights], values, max_weight // bucket)
+        return sum(value for value, selected in zip(values, selected_items) if selected), selected_items
+    return knapsack_dp(weights, values, max_weight)
+
+
 if __name__ == '__main__':
-    items = [{'weight': 10, 'value': 2}, {'weight': 8, 'value': 7}, {'weight': 8, 'value': 8}]
-    max_weight = 20
-    max_value, selected_items = knapsack(items, max_weight)
-    print(f"最大价值: {max_value}")
-    print(f"每个物品的选择情况: {selected_items}")  # 1 表示选择，0 表示不选择
\ No newline at end of file
+    import random
+    import itertools
+    import time
+
+    def brute_force(weights, values, max_weight):
+        best = 0
+        for selected in itertools.product([0, 1], repeat=len(weights)):
+            if sum(w for w, s in zip(weights, selected) if s) <= max_weight:
+                best = max(best, sum(v for v, s in zip(values, selected) if s))
+        return best
+
+    def check(weights, values, max_weight, max_value, selected_items):
+        assert sum(w for w, s in zip(weights, selected_items) if s) <= max_weight
+        assert sum(v for v, s in zip(values, selected_items) if s) == max_value
+
+    rng = random.Random(0)
+    for _ in range(500):
+        n = rng.randint(0, 10)
+        weights = [rng.randint(0, 60) for _ in range(n)]
+        values = [rng.randint(0, 10) for _ in range(n)]
+        max_weight = rng.randint(0, 150)
+        items = [{'weight': w, 'value': v} for w, v in zip(weights, values)]
+        optimum = brute_force(weights, values, max_weight)
+
+        # 精确 DP：最优值与原实现一致，选择结果也完全相同
+        max_value, selected_items = knapsack(items, max_weight)
+        check(weights, values, max_weight, max_value, selected_items)
+        assert max_value == optimum and (max_value, selected_items) == knapsack_table(items, max_weight)
+
+        # 分桶：可行；重量为桶宽整数倍时与精确解相同
+        max_value, selected_items = knapsack(items, max_weight, bucket=7)
+        check(weights, values, max_weight, max_value, selected_items)
+        bucket_items = [{'weight': 7 * w, 'value': v} for w, v in zip(weights, values)]
+        assert knapsack(bucket_items, 7 * max_weight, bucket=7)[0] == optimum
+
+        # 贪心：可行且不低于最优解的一半；全部放得下或重量相同时即为最优
+        max_value, selected_items = knapsack(items, max_weight, max_exact_items=0)
+        check(weights, values, max_weight, max_value, selected_items)
+        assert 2 * max_value >= optimum
+        assert knapsack(items, sum(weights), max_exact_items=0)[0] == sum(values)
+        same_items = [{'weight': 5, 'value': v} for v in values]
+        assert knapsack(same_items, max_weight, max_exact_items=0)[0] == brute_force([5] * n, values, max_weight)
+    print('exact, bucketed and greedy selections checked against brute force')
+
+    items = [{'weight': rng.randint(50, 3000), 'value': rng.randint(0, 10)} for _ in range(40)]
+    for name, fn in [('knapsack_table', lambda: knapsack_table(items, 10_000)), ('knapsack', lambda: knapsack(items, 10_000)), ('knapsack bucket=50', lambda: knapsack(items, 10_000, bucket=50))]:
+        start = time.perf_counter()
+        max_value, _ = fn()
+        print(f'{name:<20}value={max_value:<4} {1000 * (time.perf_counter() - start):.1f}ms')
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+    except OSError:
+        # 文件不存在时仍然给出稳定的 key，与 structai 跳过无法读取的图片的行为一致
+        h.update(f'missing:{path}'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk, content-addressed cache backed by SQLite.
+
+    Values are JSON-serialisable objects keyed by a SHA-256 digest. Entries older than
+    `max_age` seconds are dropped, and once the total payload exceeds `max_size` bytes the
+    least recently used entries are evicted. Safe to share between threads.
+    """
+    def __init__(self, path, max_size=2 * 1024**3, max_age=90 * 24 * 3600, evict_every=200):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, namespace TEXT, value TEXT, size INTEGER, created REAL, accessed REAL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed)')
+            self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(*parts):
+        return hash_text(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str))
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, created FROM cache WHERE key=?', (key,)).fetchone()
+            if row is None:
+                return default
+            if self.max_age is not None and now - row[1] > self.max_age:
+                self._conn.execute('DELETE FROM cache WHERE key=?', (key,))
+                self._conn.commit()
+                return default
+            self._conn.execute('UPDATE cache SET accessed=? WHERE key=?', (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value, namespace=''):
+        value = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, namespace, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, namespace, value, len(value), now, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE key=?', (key,))
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            if self.max_age is not None:
+                self._conn.execute('DELETE FROM cache WHERE created < ?', (time.time() - self.max_age,))
+            if self.max_size is not None:
+                total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+                if total > self.max_size:
+                    # 按最近访问时间淘汰，直到回到上限的 90%
+                    excess = total - int(self.max_size * 0.9)
+                    rows = self._conn.execute('SELECT key, size FROM cache ORDER BY accessed ASC').fetchall()
+                    stale_keys = []
+                    for key, size in rows:
+                        if excess <= 0:
+                            break
+                        stale_keys.append((key,))
+                        excess -= size
+                    self._conn.executemany('DELETE FROM cache WHERE key=?', stale_keys)
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Process-wide cache, stored at $MANALYZER_CACHE_DIR/llm_cache.sqlite (default data/cache)."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            cache_dir = os.environ.get('MANALYZER_CACHE_DIR', os.path.join('data', 'cache'))
+            _default_cache = ResponseCache(os.path.join(cache_dir, 'llm_cache.sqlite'))
+    return _default_cache
+
+
+if __name__ == '__main__':
+    cache = ResponseCache('data/cache/try.sqlite', max_size=100)
+    key = cache.make_key('gpt-4.1', 'system', 'query', 0, 1)
+    cache.set(key, {'Topic Relevance': 9, 'Feasibility': 8})
+    print(cache.get(key))
+    for i in range(20):
+        cache.set(cache.make_key(i), 'x' * 20)
+    cache.evict()
+    print(len(cache))
@@ -0,0 +1,111 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from utils.reader import read_markdown
+from utils.clean import clean_dict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+IR_VERSION = 1
+IR_FILE = 'paper_ir.msgpack' if msgpack is not None else 'paper_ir.json'
+
+
+def ir_path(paper_info):
+    return os.path.join(os.path.dirname(paper_info['md_path']), IR_FILE)
+
+
+def build_paper_ir(md_path, content_list_path):
+    """
+    Parsed-paper IR built once from the MinerU outputs:
+        sections: clean_dict(read_markdown(md_path, include_img=True)), header -> paragraphs and image paths
+        images: image paths appearing in sections, so the text-only view can be derived without reparsing
+        content_list: the MinerU content list (text, tables and figures with their page_idx)
+    """
+    sections = read_markdown(md_path, include_img=True)
+    text_sections = read_markdown(md_path, include_img=False)
+    images = sorted({x for paragraphs in sections.values() for x in paragraphs} - {x for paragraphs in text_sections.values() for x in paragraphs})
+    with open(content_list_path, 'r', encoding='utf-8') as file:
+        content_list = json.load(file)
+    return {
+        'version': IR_VERSION,
+        'sections': clean_dict(sections),
+        'images': images,
+        'content_list': content_list,
+    }
+
+
+def save_paper_ir(ir, path):
+    tmp_path = path + '.tmp'
+    if msgpack is not None:
+        with open(tmp_path, 'wb') as f:
+            f.write(msgpack.packb(ir, use_bin_type=True))
+    else:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(ir, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_paper_ir(path):
+    if msgpack is not None:
+        with open(path, 'rb') as f:
+            return msgpack.unpackb(f.read(), raw=False)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+_ir_cache = OrderedDict() # 同一进程内各阶段共用，按路径缓存最近使用的 IR
+_ir_lock = threading.Lock()
+IR_CACHE_SIZE = 256
+
+
+def get_paper_ir(paper_info):
+    """Load the IR of a parsed paper, building and saving it first if it is missing or older than full.md."""
+    path = ir_path(paper_info)
+    with _ir_lock:
+        if path in _ir_cache:
+            _ir_cache.move_to_end(path)
+            return _ir_cache[path]
+
+    ir = None
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(paper_info['md_path']):
+        try:
+            ir = load_paper_ir(path)
+        except Exception:
+            ir = None
+    if ir is None or ir.get('version') != IR_VERSION:
+        ir = build_paper_ir(paper_info['md_path'], paper_info['content_list_path'])
+        save_paper_ir(ir, path)
+
+    with _ir_lock:
+        _ir_cache[path] = ir
+        while len(_ir_cache) > IR_CACHE_SIZE:
+            _ir_cache.popitem(last=False)
+    return ir
+
+
+def paper_sections(ir, include_img=True):
+    """Same as clean_dict(read_markdown(md_path, include_img))."""
+    if include_img:
+        return {header: list(paragraphs) for header, paragraphs in ir['sections'].items()}
+    images = set(ir['images'])
+    return {header: [x for x in paragraphs if x not in images] for header, paragraphs in ir['sections'].items()}
+
+
+def paper_content_list(ir):
+    # 每个元素复制一份，调用方可以直接在上面写入转换结果
+    return [dict(content) for content in ir['content_list']]
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    # python utils/paper_ir.py data/.../00000/full.md data/.../00000/xxx_content_list.json
+    paper_info = {'md_path': sys.argv[1], 'content_list_path': sys.argv[2]}
+    start = time.time()
+    ir = get_paper_ir(paper_info)
+    print(f'{ir_path(paper_info)}: {len(ir["sections"])} sections, {len(ir["content_list"])} content items, {time.time() - start:.3f}s')
@@ -0,0 +1,110 @@
+import os
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+CHARS_PER_TOKEN = 4 # 没有 tiktoken 时按约 4 个字符 1 个 token 估计
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """tiktoken encoding named by $MANALYZER_TOKENIZER (default o200k_base), or None when unavailable."""
+    global _encoding
+    if tiktoken is None:
+        return None
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.get_encoding(os.environ.get('MANALYZER_TOKENIZER', 'o200k_base'))
+            except Exception: # 离线时编码文件无法下载
+                _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, from_end=False):
+    """Return (text cut to at most max_tokens tokens, its token count); from_end keeps the last tokens."""
+    if max_tokens <= 0:
+        return '', 0
+    encoding = get_encoding()
+    if encoding is None:
+        text = text[-max_tokens * CHARS_PER_TOKEN:] if from_end else text[:max_tokens * CHARS_PER_TOKEN]
+        return text, count_tokens(text)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return encoding.decode(tokens[-max_tokens:] if from_end else tokens[:max_tokens]), max_tokens
+
+
+def allocate_budget(sizes, priorities, caps, token_budget):
+    """
+    Split token_budget between sections: higher priority first, and within one priority evenly,
+    handing the share a short section does not use over to the longer ones. Each section gets at
+    most min(size, cap) tokens.
+    """
+    allocation = [0] * len(sizes)
+    remaining = token_budget
+    for priority in sorted(set(priorities), reverse=True):
+        group = [i for i in range(len(sizes)) if priorities[i] == priority]
+        group.sort(key=lambda i: min(sizes[i], caps[i]))
+        for n, i in enumerate(group):
+            share = remaining // (len(group) - n)
+            allocation[i] = min(sizes[i], caps[i], share)
+            remaining -= allocation[i]
+    return allocation
+
+
+def pack_sections(sections, token_budget, section_format='{header}\n{text}\n\n'):
+    """
+    Pack sections, a list of dicts with header, text, priority (higher kept first) and an optional
+    max_tokens cap, into at most token_budget tokens of text (section headers not counted), in
+    their original order. Returns (text, stats) with the packed and dropped token counts.
+    """
+    sizes = [count_tokens(section['text']) for section in sections]
+    caps = [section.get('max_tokens', token_budget) for section in sections]
+    allocation = allocate_budget(sizes, [section.get('priority', 0) for section in sections], caps, token_budget)
+
+    parts = []
+    packed_tokens = 0
+    dropped_sections = 0
+    for section, size, tokens in zip(sections, sizes, allocation):
+        if tokens <= 0 and size > 0:
+            dropped_sections += 1
+            continue
+        text, tokens = truncate_tokens(section['text'], tokens) if tokens < size else (section['text'], size)
+        packed_tokens += tokens
+        parts.append(section_format.format(header=section['header'], text=text))
+    stats = {
+        'packed_tokens': packed_tokens,
+        'dropped_tokens': sum(sizes) - packed_tokens,
+        'sections': len(sections),
+        'dropped_sections': dropped_sections,
+    }
+    return ''.join(parts), stats
+
+
+if __name__ == '__main__':
+    sections = [
+        {'header': 'Abstract', 'text': 'a ' * 300, 'priority': 2, 'max_tokens': 100},
+        {'header': 'Introduction', 'text': 'b ' * 3000, 'priority': 1, 'max_tokens': 200},
+        {'header': 'Methods', 'text': 'c ' * 40, 'priority': 0},
+        {'header': 'Results', 'text': 'd ' * 3000, 'priority': 0},
+        {'header': 'Discussion', 'text': 'e ' * 3000, 'priority': 0},
+    ]
+    sizes = [count_tokens(section['text']) for section in sections]
+    allocation = allocate_budget(sizes, [2, 1, 0, 0, 0], [100, 200, 1000, 1000, 1000], 1000)
+    assert sum(allocation) == 1000 and allocation[:2] == [100, 200] and allocation[3] == allocation[4]
+    text, stats = pack_sections(sections, 1000)
+    assert stats['packed_tokens'] <= 1000 and stats['packed_tokens'] + stats['dropped_tokens'] == sum(sizes)
+    print(f'tokenizer: {"tiktoken" if get_encoding() is not None else "chars/4"}, allocation {allocation}, {stats}')
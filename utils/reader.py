@@ -1,7 +1,424 @@
+import re
+import html
 import markdown
 from bs4 import BeautifulSoup
 
+# 与 Python-Markdown 的块级规则保持一致，直接在文本行上切分章节，不经过 HTML
+TAB = ' ' * 4
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'details', 'div', 'dl', 'fieldset', 'figcaption', 'figure', 'footer', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hgroup', 'hr', 'main', 'menu', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'ul',
+    'canvas', 'colgroup', 'dd', 'body', 'dt', 'group', 'html', 'iframe', 'li', 'legend', 'math', 'map', 'noscript', 'output', 'object',
+    'option', 'progress', 'script', 'style', 'summary', 'tbody', 'td', 'textarea', 'tfoot', 'th', 'thead', 'tr', 'video', 'center',
+}
+RAW_START_RE = re.compile(r'^[ ]{0,3}(?=<(!--|[a-zA-Z][^\s/>]*)[^>]*>)', re.MULTILINE)
+TAG_RE = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][^\s/>]*)[^>]*?(/?)>', re.DOTALL)
+RAW = '\x02raw\x03'
+
+HASH_HEADER_RE = re.compile(r'(?:^|\n)(?P<level>#{1,6})(?P<header>(?:\\.|[^\\])*?)#*(?:\n|$)')
+SETEXT_HEADER_RE = re.compile(r'^.*?\n(?:=+|-+)[ ]*(\n|$)', re.MULTILINE)
+HR_RE = re.compile(r'^[ ]{0,3}(?=(?P<atomicgroup>(-+[ ]{0,2}){3,}|(_+[ ]{0,2}){3,}|(\*+[ ]{0,2}){3,}))(?P=atomicgroup)[ ]*$', re.MULTILINE)
+OLIST_RE = re.compile(r'^[ ]{0,3}\d+\.[ ]+(.*)')
+ULIST_RE = re.compile(r'^[ ]{0,3}[*+-][ ]+(.*)')
+LIST_CHILD_RE = re.compile(r'^[ ]{0,3}((\d+\.)|[*+-])[ ]+(.*)')
+LIST_INDENT_RE = re.compile(r'^[ ]{4,7}((\d+\.)|[*+-])[ ]+.*')
+INDENT_RE = re.compile(r'^(([ ]{4})+)')
+QUOTE_RE = re.compile(r'(^|\n)[ ]{0,3}>[ ]?(.*)')
+REFERENCE_RE = re.compile(r'^[ ]{0,3}\[([^\[\]]*)\]:[ ]*(?:\n[ ]*)?([^\s]+)[ ]*(?:\n[ ]*)?((["\'])(.*)\4[ ]*|\((.*)\)[ ]*)?$', re.MULTILINE)
+
+ESCAPED_CHARS = set('\\`*_{}[]()>#+-.!')
+INLINE_RE = re.compile(r'''
+    (?P<escape>\\(?P<char>.))
+    |(?P<code>`+)
+    |(?P<image>!\[)
+    |(?P<link>\[)
+    |<(?P<autolink>(?:[Ff]|[Hh][Tt])[Tt][Pp][Ss]?://[^<>]*)>
+    |<(?P<automail>[^<> !]+@[^@<> ]+)>
+    |(?P<html><(?:/?[a-zA-Z][^\s"'<>@]*(?:\s+[^\s"'=<>]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>]+))?)*\s*/?|!--(?:(?!<!--|-->).)*--|[?](?:(?!<[?]|[?]>).)*[?])>)
+    |(?P<entity>&(?:\#[0-9]+|\#x[0-9a-fA-F]+|[a-zA-Z0-9]+);)
+    |(?P<linebreak>[ ]{2}\n)
+    |(?P<delim>\*+|_+)
+''', re.VERBOSE | re.DOTALL)
+INLINE_START_RE = re.compile(r'[\\`!\[<&*_]|[ ]{2}\n')
+IMG_SRC_RE = re.compile(r'''^<img\s[^>]*?\bsrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+LINK_TARGET_RE = re.compile(r'''\(\s*(<[^<>]*>|[^\s()]*(?:\([^\s()]*\)[^\s()]*)*)(?:\s+("[^"]*"|'[^']*'|\([^()]*\)))?\s*\)''')
+REFERENCE_ID_RE = re.compile(r'\s?\[([^\]]*)\]')
+SPACE_RE = re.compile(r'\s')
+
+
+class _Node:
+    __slots__ = ('tag', 'text', 'tail', 'children')
+
+    def __init__(self, tag, text=''):
+        self.tag = tag
+        self.text = text
+        self.tail = ''
+        self.children = []
+
+
+class _BlockParser:
+    """Python-Markdown 的块级解析（列表、引用、代码块、标题、分隔线、原始 HTML）的精简移植，只建出取文本所需的节点。"""
+    def __init__(self):
+        self.state = []
+        self.references = {}
+
+    def parse_chunk(self, parent, text):
+        self.parse_blocks(parent, text.split('\n\n'))
+
+    def parse_blocks(self, parent, blocks):
+        blocks = blocks[::-1] # 栈顶在末尾，避免 pop(0)
+        while blocks:
+            block = blocks.pop()
+            last = parent.children[-1] if parent.children else None
+            if not block or block.startswith('\n'):
+                if block[1:]:
+                    blocks.append(block[1:])
+            elif block.startswith(TAB) and self.state[-1:] != ['detabbed'] and (parent.tag == 'li' or (last is not None and last.tag in ('ul', 'ol'))):
+                self.list_indent(parent, block)
+            elif block.startswith(TAB):
+                lines = block.split('\n')
+                n = 0
+                while n < len(lines) and (lines[n].startswith(TAB) or not lines[n].strip()):
+                    n += 1
+                if last is None or last.tag != 'pre':
+                    parent.children.append(_Node('pre'))
+                if n < len(lines):
+                    blocks.append('\n'.join(lines[n:]))
+            elif (m := HASH_HEADER_RE.search(block)) is not None:
+                if m.start() > 0:
+                    self.parse_blocks(parent, [block[:m.start()]])
+                parent.children.append(_Node(f'h{len(m.group("level"))}', m.group('header').strip()))
+                after = block[m.end():]
+                if after:
+                    if self.state[-1:] == ['looselist']:
+                        after = '\n'.join(line[4:] if line.startswith(TAB) else line for line in after.split('\n'))
+                    blocks.append(after)
+            elif SETEXT_HEADER_RE.match(block):
+                lines = block.split('\n')
+                parent.children.append(_Node('h1' if lines[1].startswith('=') else 'h2', lines[0].strip()))
+                if len(lines) > 2:
+                    blocks.append('\n'.join(lines[2:]))
+            elif (m := HR_RE.search(block)) is not None:
+                prelines = block[:m.start()].rstrip('\n')
+                if prelines:
+                    self.parse_blocks(parent, [prelines])
+                parent.children.append(_Node('hr'))
+                postlines = block[m.end():].lstrip('\n')
+                if postlines:
+                    blocks.append(postlines)
+            elif OLIST_RE.match(block) or ULIST_RE.match(block):
+                self.list_block(parent, block, 'ol' if OLIST_RE.match(block) else 'ul')
+            elif (m := QUOTE_RE.search(block)) is not None:
+                self.parse_blocks(parent, [block[:m.start()]])
+                block = '\n'.join(self.quote_clean(line) for line in block[m.start():].split('\n'))
+                last = parent.children[-1] if parent.children else None
+                if last is not None and last.tag == 'blockquote':
+                    quote = last
+                else:
+                    quote = _Node('blockquote')
+                    parent.children.append(quote)
+                self.state.append('blockquote')
+                self.parse_chunk(quote, block)
+                self.state.pop()
+            elif (m := REFERENCE_RE.search(block)) is not None:
+                self.references[m.group(1).strip().lower()] = m.group(2).lstrip('<').rstrip('>')
+                if block[m.end():].strip():
+                    blocks.append(block[m.end():].lstrip('\n'))
+                if block[:m.start()].strip():
+                    blocks.append(block[:m.start()].rstrip('\n'))
+            elif block.strip():
+                if self.state[-1:] == ['list']:
+                    if last is not None:
+                        last.tail = f'{last.tail}\n{block}' if last.tail else '\n' + block
+                    else:
+                        parent.text = f'{parent.text}\n{block}' if parent.text else block.lstrip()
+                else:
+                    parent.children.append(_Node('p', block.lstrip()))
+
+    @staticmethod
+    def quote_clean(line):
+        m = QUOTE_RE.match(line)
+        if line.strip() == '>':
+            return ''
+        return m.group(2) if m else line
+
+    @staticmethod
+    def loosen_item(item):
+        # 松散列表中原本直接挂在 li 上的文字变成段落
+        if item.text:
+            item.children.insert(0, _Node('p', item.text))
+            item.text = ''
+        if item.children and item.children[-1].tail:
+            item.children.append(_Node('p', item.children[-1].tail.lstrip()))
+            item.children[-2].tail = ''
+
+    def list_block(self, parent, block, tag):
+        items = []
+        for line in block.split('\n'):
+            m = LIST_CHILD_RE.match(line)
+            if m:
+                items.append(m.group(3))
+            elif LIST_INDENT_RE.match(line) and not items[-1].startswith(TAB):
+                items.append(line)
+            else:
+                items[-1] = f'{items[-1]}\n{line}'
+
+        last = parent.children[-1] if parent.children else None
+        if last is not None and last.tag in ('ol', 'ul'):
+            lst = last
+            self.loosen_item(lst.children[-1])
+            item = _Node('li')
+            lst.children.append(item)
+            self.state.append('looselist')
+            self.parse_blocks(item, [items.pop(0)])
+            self.state.pop()
+        elif parent.tag in ('ol', 'ul'):
+            lst = parent
+        else:
+            lst = _Node(tag)
+            parent.children.append(lst)
+
+        self.state.append('list')
+        for text in items:
+            if text.startswith(TAB):
+                self.parse_blocks(lst.children[-1], [text])
+            else:
+                item = _Node('li')
+                lst.children.append(item)
+                self.parse_blocks(item, [text])
+        self.state.pop()
+
+    def list_indent(self, parent, block):
+        m = INDENT_RE.match(block)
+        indent_level = len(m.group(1)) // 4 if m else 0
+        level = 1 if self.state[-1:] == ['list'] else 0
+        sibling = parent
+        while indent_level > level:
+            child = sibling.children[-1] if sibling.children else None
+            if child is not None and child.tag in ('ul', 'ol', 'li'):
+                if child.tag in ('ul', 'ol'):
+                    level += 1
+                sibling = child
+            else:
+                break
+        block = '\n'.join(line[4 * level:] if line.startswith(TAB * level) else line for line in block.split('\n'))
+
+        self.state.append('detabbed')
+        if parent.tag == 'li':
+            if parent.children and parent.children[-1].tag in ('ul', 'ol'):
+                self.parse_blocks(parent.children[-1], [block])
+            else:
+                self.parse_blocks(parent, [block])
+        elif sibling.tag == 'li':
+            self.parse_blocks(sibling, [block])
+        elif sibling.children and sibling.children[-1].tag == 'li':
+            item = sibling.children[-1]
+            if item.text:
+                item.children.insert(0, _Node('p', item.text))
+                item.text = ''
+            self.parse_chunk(item, block)
+        else:
+            item = _Node('li')
+            sibling.children.append(item)
+            self.parse_blocks(item, [block])
+        self.state.pop()
+
+
+def extract_raw_html(text):
+    """Replace HTML blocks (a block-level tag at the start of a line, up to its closing tag) by a placeholder block."""
+    pieces = []
+    pos = 0
+    while True:
+        m = RAW_START_RE.search(text, pos)
+        while m is not None and m.group(1) != '!--' and m.group(1).lower() not in BLOCK_TAGS:
+            m = RAW_START_RE.search(text, m.end() + 1)
+        if m is None:
+            break
+        start = m.end()
+        end = len(text)
+        stack = []
+        for tag in TAG_RE.finditer(text, start):
+            if tag.group(0).startswith('<!--'):
+                if not stack:
+                    end = tag.end()
+                    break
+                continue
+            name = tag.group(2).lower()
+            if tag.group(1):
+                if name in stack:
+                    while stack.pop() != name:
+                        pass
+            elif not tag.group(3) and name != 'hr':
+                stack.append(name)
+            if not stack:
+                end = tag.end()
+                break
+        pieces.append(text[pos:m.start()])
+        pieces.append(f'\n{RAW}\n\n')
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
+def inline_text(text, references, images):
+    """Text of an inline markdown fragment as rendered by Python-Markdown, image sources are appended to `images`."""
+    out = []
+    delims = [] # 尚未配对的开始分隔符: (在 out 中的位置, 字符, 剩余长度)
+    pos = 0
+    n = len(text)
+    while pos < n:
+        # 先用单字符集定位候选位置，再在该处尝试完整的行内规则
+        start = INLINE_START_RE.search(text, pos)
+        if start is None:
+            out.append(text[pos:])
+            break
+        m = INLINE_RE.match(text, start.start())
+        if m is None:
+            out.append(text[pos:start.end()])
+            pos = start.end()
+            continue
+        out.append(text[pos:m.start()])
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == 'escape':
+            out.append(m.group('char') if m.group('char') in ESCAPED_CHARS else m.group(0))
+        elif kind == 'code':
+            ticks = len(m.group('code'))
+            if m.start() > 0 and text[m.start() - 1] == '\\':
+                out.append(m.group('code'))
+                continue
+            i = pos
+            longest, longest_end = 0, 0
+            found = None
+            while i < n:
+                j = i
+                while j < n and text[j] == '`':
+                    j += 1
+                if j == i:
+                    i += 1
+                    continue
+                if j - i == ticks:
+                    found = (pos, i, j)
+                    break
+                if j - i > longest:
+                    longest, longest_end = j - i, j
+                i = j
+            if found is None and longest:
+                found = (pos - (ticks - longest), longest_end - longest, longest_end)
+            if found is None:
+                out.append(m.group('code'))
+            else:
+                out.append(text[found[0]:found[1]].strip())
+                pos = found[2]
+        elif kind in ('image', 'link'):
+            if kind == 'link' and m.start() > 0 and text[m.start() - 1] == '!':
+                out.append('[')
+                continue
+            depth, i = 1, pos
+            while i < n and depth > 0:
+                if text[i] == '\\':
+                    i += 1
+                elif text[i] == '[':
+                    depth += 1
+                elif text[i] == ']':
+                    depth -= 1
+                i += 1
+            if depth > 0:
+                out.append(m.group(0))
+                continue
+            label = text[pos:i - 1]
+            target = LINK_TARGET_RE.match(text, i)
+            ref = REFERENCE_ID_RE.match(text, i)
+            if target is not None:
+                src = target.group(1)
+                end = target.end()
+            else:
+                ref_id = ref.group(1) if ref is not None and ref.group(1) else label
+                src = references.get(SPACE_RE.sub(' ', ref_id.strip()).lower() if ref_id else ref_id)
+                end = ref.end() if ref is not None else i
+                if src is None:
+                    out.append(m.group(0))
+                    continue
+            if kind == 'image':
+                images.append(src[1:-1] if src.startswith('<') and src.endswith('>') else src)
+            else:
+                out.append(inline_text(label, references, images))
+            pos = end
+        elif kind in ('autolink', 'automail'):
+            out.append(m.group(kind))
+        elif kind == 'html':
+            img = IMG_SRC_RE.match(m.group('html'))
+            if img is not None:
+                images.append(html.unescape(next(g for g in img.groups() if g is not None)))
+        elif kind == 'entity':
+            char = html.unescape(m.group('entity'))
+            out.append(char[:-1] if char == m.group('entity') else char) # BeautifulSoup 对未知实体去掉分号
+        elif kind == 'linebreak':
+            out.append('\n')
+        else:
+            # * 与 _ 分隔符按左右侧边规则配对，配对成功的分隔符不出现在文字中
+            run = m.group('delim')
+            before = text[m.start() - 1] if m.start() > 0 else ' '
+            after = text[pos] if pos < n else ' '
+            opener = not after.isspace() and (after.isalnum() or after == '\\' or before.isspace() or not before.isalnum())
+            closer = not before.isspace() and (before.isalnum() or after.isspace() or not after.isalnum())
+            if run[0] == '_':
+                opener, closer = opener and not before.isalnum(), closer and not after.isalnum()
+            length = len(run)
+            if closer:
+                while length > 0:
+                    idx = next((k for k in range(len(delims) - 1, -1, -1) if delims[k][1] == run[0]), None)
+                    if idx is None:
+                        break
+                    at, char, open_length = delims[idx]
+                    used = min(open_length, length)
+                    out[at] = char * (open_length - used)
+                    length -= used
+                    del delims[idx:]
+                    if open_length > used:
+                        delims.append((at, char, open_length - used))
+            out.append(run[0] * length)
+            if opener and length > 0:
+                delims.append((len(out) - 1, run[0], length))
+    return ''.join(out)
+
+
 def read_markdown(file_path, include_img=False):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        md_content = f.read()
+    if not md_content.strip():
+        return {}
+
+    md_content = md_content.replace('\x02', '').replace('\x03', '').replace('\r\n', '\n').replace('\r', '\n') + '\n\n'
+    md_content = re.sub(r'(?<=\n) +\n', '\n', md_content.expandtabs(4))
+    root = _Node('div')
+    parser = _BlockParser()
+    parser.parse_chunk(root, extract_raw_html(md_content))
+
+    content_dict = {}
+    current_header = 'text'  # 默认键，用于存放没有标题的内容
+    stack = root.children[::-1]
+    while stack:
+        node = stack.pop()
+        if node.tag in ('h1', 'h2', 'h3'):
+            header_text = inline_text(node.text, parser.references, [])
+            while header_text in content_dict:
+                header_text += ' '
+            content_dict[header_text] = []
+            current_header = header_text
+        elif node.tag == 'p' and node.text != RAW:
+            images = []
+            text = inline_text(node.text, parser.references, images)
+            paragraphs = content_dict.setdefault(current_header, [])
+            if include_img:
+                paragraphs.extend(images)
+            paragraphs.append(text)
+        stack.extend(node.children[::-1])
+    return content_dict
+
+
+def read_markdown_html(file_path, include_img=False):
+    # 原实现：markdown -> HTML -> BeautifulSoup，保留用于对比 read_markdown 的输出与速度
     with open(file_path, 'r', encoding='utf-8') as f:
         md_content = f.read()
 
@@ -10,10 +427,10 @@ def read_markdown(file_path, include_img=False):
 
     content_dict = {}
     current_header = 'text'  # 默认键，用于存放没有标题的内容
-    
+
     # 检查是否有任何标题
     has_headers = bool(soup.find(['h1', 'h2', 'h3']))
-    
+
     for element in soup.find_all(True):  # 遍历所有标签元素
         if element.name in ['h1', 'h2', 'h3']:
             has_headers = True
@@ -47,4 +464,4 @@ if __name__ == '__main__':
     file_path = 'data/agriculture/2025_0407_111544/1_md/00074.md'
     content_dict = read_markdown(file_path, include_img=True)
     for header, content in content_dict.items():
-        print(f"{header}: {content}")
\ No newline at end of file
+        print(f"{header}: {content}")
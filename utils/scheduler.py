@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import asyncio
+import heapq
+import itertools
+import threading
+
+
+PRIORITY_HIGH = 0 # e.g. checker refinement rounds, which hold an extraction open
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+def estimate_tokens(text):
+    # 粗略估计，约 4 个字符 1 个 token
+    return len(text) // 4 + 1 if text else 0
+
+
+def is_rate_limit_error(e):
+    return type(e).__name__ == 'RateLimitError' or getattr(e, 'status_code', None) == 429 or '429' in str(e) or 'Too Many Requests' in str(e)
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_minute):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, scale=1.0):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_time(self, amount, scale=1.0):
+        self.refill(scale)
+        amount = min(amount, self.capacity) # 超过容量的请求在桶满时放行
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.rate * scale)
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class _ModelState:
+    def __init__(self, rpm=None, tpm=None, max_concurrency=32):
+        self.request_bucket = TokenBucket(rpm, rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm, tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiting = []
+        self.backoff = 0.0
+        self.backoff_until = 0.0
+        self.rate_scale = 1.0
+        self.metrics = {'requests': 0, 'estimated_tokens': 0, 'rate_limited': 0, 'wait_seconds': 0.0, 'max_in_flight': 0}
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control for LLM requests.
+
+    Each model gets a requests-per-minute and a tokens-per-minute token bucket plus a cap on
+    concurrent requests. Waiting requests are admitted in priority order (PRIORITY_HIGH first,
+    FIFO within a class). A 429 response puts the model into exponential backoff and halves
+    its effective rate, which then recovers additively on every success; the request is
+    retried up to `max_rate_limit_retry` times before the error is raised to the caller.
+
+    Limits can be set with `set_limit` or through $MANALYZER_RATE_LIMITS, a JSON object such as
+    {"gpt-4.1": {"rpm": 500, "tpm": 200000, "max_concurrency": 32}}.
+    """
+    def __init__(self, limits=None, default_max_concurrency=256, max_rate_limit_retry=5, base_backoff=2.0, max_backoff=60.0):
+        self.limits = limits or {}
+        self.default_max_concurrency = default_max_concurrency
+        self.max_rate_limit_retry = max_rate_limit_retry
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._states = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+
+    def set_limit(self, model, rpm=None, tpm=None, max_concurrency=None):
+        with self._cond:
+            self.limits[model] = {'rpm': rpm, 'tpm': tpm, 'max_concurrency': max_concurrency}
+            self._states.pop(model, None)
+
+    def _state(self, model):
+        if model not in self._states:
+            limit = self.limits.get(model, {})
+            self._states[model] = _ModelState(limit.get('rpm'), limit.get('tpm'), limit.get('max_concurrency') or self.default_max_concurrency)
+        return self._states[model]
+
+    def _try_admit(self, state, entry, tokens):
+        """Admit `entry` if it is first in line and the model has capacity, else return how long to wait. Holds self._cond."""
+        now = time.monotonic()
+        if state.waiting[0] != entry or state.in_flight >= state.max_concurrency:
+            return 1.0
+        wait = max(state.backoff_until - now, 0.0)
+        if state.request_bucket is not None:
+            wait = max(wait, state.request_bucket.wait_time(1, state.rate_scale))
+        if state.token_bucket is not None:
+            wait = max(wait, state.token_bucket.wait_time(tokens, state.rate_scale))
+        if wait > 0:
+            return wait
+
+        heapq.heappop(state.waiting)
+        if state.request_bucket is not None:
+            state.request_bucket.consume(1)
+        if state.token_bucket is not None:
+            state.token_bucket.consume(tokens)
+        state.in_flight += 1
+        state.metrics['requests'] += 1
+        state.metrics['estimated_tokens'] += tokens
+        state.metrics['max_in_flight'] = max(state.metrics['max_in_flight'], state.in_flight)
+        self._cond.notify_all() # 下一个排队的请求可能已经可以放行
+        return 0.0
+
+    def _acquire(self, model, tokens, priority):
+        start = time.monotonic()
+        with self._cond:
+            state = self._state(model)
+            entry = (priority, next(self._seq))
+            heapq.heappush(state.waiting, entry)
+            while True:
+                wait = self._try_admit(state, entry, tokens)
+                if wait <= 0:
+                    break
+                self._cond.wait(timeout=min(wait, 1.0))
+            state.metrics['wait_seconds'] += time.monotonic() - start
+        return state
+
+    async def _aacquire(self, model, tokens, priority):
+        start = time.monotonic()
+        with self._cond:
+            state = self._state(model)
+            entry = (priority, next(self._seq))
+            heapq.heappush(state.waiting, entry)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(state, entry, tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(min(wait, 0.05))
+        except asyncio.CancelledError:
+            with self._cond:
+                if entry in state.waiting:
+                    state.waiting.remove(entry)
+                    heapq.heapify(state.waiting)
+                    self._cond.notify_all()
+            raise
+        with self._cond:
+            state.metrics['wait_seconds'] += time.monotonic() - start
+        return state
+
+    def _release(self, state, rate_limited=False, extra_tokens=0):
+        with self._cond:
+            state.in_flight -= 1
+            if state.token_bucket is not None and extra_tokens != 0:
+                state.token_bucket.consume(extra_tokens)
+            if rate_limited:
+                state.metrics['rate_limited'] += 1
+                state.backoff = min(max(state.backoff * 2, self.base_backoff), self.max_backoff)
+                state.backoff_until = time.monotonic() + state.backoff
+                state.rate_scale = max(state.rate_scale / 2, 0.05)
+            else:
+                state.backoff = 0.0
+                state.rate_scale = min(state.rate_scale + 0.05, 1.0)
+            self._cond.notify_all()
+
+    def call(self, model, func, tokens=0, priority=PRIORITY_NORMAL, count_output=None):
+        """Run func() once the model has capacity; count_output(result) gives the tokens actually produced."""
+        for try_idx in range(self.max_rate_limit_retry + 1):
+            state = self._acquire(model, tokens, priority)
+            try:
+                result = func()
+            except Exception as e:
+                limited = is_rate_limit_error(e)
+                self._release(state, rate_limited=limited)
+                if limited and try_idx < self.max_rate_limit_retry:
+                    continue
+                raise
+            self._release(state, extra_tokens=count_output(result) if count_output is not None else 0)
+            return result
+
+    async def acall(self, model, coro_func, tokens=0, priority=PRIORITY_NORMAL, count_output=None):
+        """asyncio version of `call`, coro_func() returns an awaitable."""
+        for try_idx in range(self.max_rate_limit_retry + 1):
+            state = await self._aacquire(model, tokens, priority)
+            try:
+                result = await coro_func()
+            except asyncio.CancelledError:
+                self._release(state)
+                raise
+            except Exception as e:
+                limited = is_rate_limit_error(e)
+                self._release(state, rate_limited=limited)
+                if limited and try_idx < self.max_rate_limit_retry:
+                    continue
+                raise
+            self._release(state, extra_tokens=count_output(result) if count_output is not None else 0)
+            return result
+
+    def metrics(self):
+        with self._cond:
+            return {model: dict(state.metrics, in_flight=state.in_flight, rate_scale=round(state.rate_scale, 2)) for model, state in self._states.items()}
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            limits = json.loads(os.environ.get('MANALYZER_RATE_LIMITS', '{}'))
+            _default_scheduler = LLMScheduler(limits)
+    return _default_scheduler
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ThreadPoolExecutor
+    scheduler = LLMScheduler({'m': {'rpm': 120, 'max_concurrency': 4}})
+    start = time.time()
+    order = []
+    def request(i, priority):
+        return scheduler.call('m', lambda: order.append(i) or time.sleep(0.05), tokens=10, priority=priority)
+    with ThreadPoolExecutor(16) as executor:
+        for i in range(130):
+            executor.submit(request, i, PRIORITY_HIGH if i >= 125 else PRIORITY_NORMAL)
+    print(f'{time.time() - start:.1f}s', order[-10:])
+    print(scheduler.metrics())
@@ -0,0 +1,89 @@
+import heapq
+import threading
+from utils.paper_ir import get_paper_ir
+
+
+def paper_order_key(paper_idx):
+    # 论文编号为数字时按数值比较，'10' 排在 '9' 之后
+    paper_idx = str(paper_idx)
+    return (0, int(paper_idx), '') if paper_idx.isdigit() else (1, 0, paper_idx)
+
+
+class _Later:
+    """Heap key where the later paper compares smaller, so it is evicted first among equal scores."""
+    __slots__ = ['key']
+
+    def __init__(self, paper_idx):
+        self.key = paper_order_key(paper_idx)
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def estimate_extraction_tokens(paper_info, table_tokens=3000, section_tokens=1500):
+    """Rough token cost of converting and extracting a paper, from its table/figure and section counts."""
+    ir = get_paper_ir(paper_info)
+    num_tables = sum(1 for content in ir['content_list'] if content['type'] in ['table', 'image'])
+    return num_tables * table_tokens + len(ir['sections']) * section_tokens
+
+
+class TopKSelector:
+    """
+    Bounded min-heap keeping the k best papers by score; k=-1 keeps all of them.
+
+    Scores can be pushed while the review is still running. Equal scores are broken by paper
+    number (smaller first), so exactly k papers are selected whatever the arrival order.
+    `select(token_budget)` walks the ranking and stops before the summed cost exceeds the budget.
+    """
+    def __init__(self, k=-1):
+        self.k = k
+        self.heap = []
+        self.paper_ids = set()
+        self.lock = threading.Lock()
+
+    def push(self, paper_idx, score, cost=0):
+        entry = (score, _Later(paper_idx), paper_idx, cost)
+        with self.lock:
+            if paper_idx in self.paper_ids: # 同一论文重复提交时以最新分数为准
+                self.heap = [x for x in self.heap if x[2] != paper_idx]
+                heapq.heapify(self.heap)
+                self.paper_ids.discard(paper_idx)
+            if self.k == -1 or len(self.heap) < self.k:
+                heapq.heappush(self.heap, entry)
+                self.paper_ids.add(paper_idx)
+            elif self.k > 0 and self.heap[0] < entry:
+                self.paper_ids.discard(heapq.heapreplace(self.heap, entry)[2])
+                self.paper_ids.add(paper_idx)
+
+    def ranked(self):
+        with self.lock:
+            return [(paper_idx, score, cost) for score, _, paper_idx, cost in sorted(self.heap, reverse=True)]
+
+    def select(self, token_budget=None):
+        selected = []
+        spent = 0
+        for paper_idx, score, cost in self.ranked():
+            if token_budget is not None and spent + cost > token_budget:
+                break
+            selected.append(paper_idx)
+            spent += cost
+        return selected
+
+
+if __name__ == '__main__':
+    import random
+    rng = random.Random(0)
+    scores = {str(i): rng.choice([0.1, 0.5, 0.9]) for i in range(30)} # 大量同分，检验确定性的排序
+    expected = sorted(scores, key=lambda x: (-scores[x], int(x)))[:7]
+    for seed in range(20):
+        order = list(scores)
+        random.Random(seed).shuffle(order)
+        selector = TopKSelector(7)
+        for paper_idx in order:
+            selector.push(paper_idx, scores[paper_idx], cost=1000)
+        assert selector.select() == expected
+        assert selector.select(token_budget=3500) == expected[:3]
+    print(expected)
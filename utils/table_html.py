@@ -0,0 +1,107 @@
+from html.parser import HTMLParser
+
+
+class _TableParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.cell = None
+        self.tables = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self.tables += 1
+        elif tag == 'tr':
+            self.rows.append([])
+        elif tag in ['td', 'th']:
+            attrs = dict(attrs)
+            self.cell = {'text': [], 'rowspan': _span(attrs.get('rowspan')), 'colspan': _span(attrs.get('colspan'))}
+        elif tag == 'br' and self.cell is not None:
+            self.cell['text'].append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in ['td', 'th'] and self.cell is not None:
+            if len(self.rows) == 0:
+                self.rows.append([])
+            self.rows[-1].append(self.cell)
+            self.cell = None
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell['text'].append(data)
+
+
+def _span(value):
+    try:
+        return max(1, min(int(value), 100))
+    except (TypeError, ValueError):
+        return 1
+
+
+def html_table_to_rows(html):
+    """Cells of an HTML table as a grid of strings, with rowspan/colspan cells repeated over their span."""
+    parser = _TableParser()
+    parser.feed(html)
+    grid = {}
+    for row_idx, row in enumerate(parser.rows):
+        col_idx = 0
+        for cell in row:
+            while (row_idx, col_idx) in grid:
+                col_idx += 1
+            text = ' '.join(''.join(cell['text']).split())
+            for r in range(cell['rowspan']):
+                for c in range(cell['colspan']):
+                    grid[(row_idx + r, col_idx + c)] = text
+            col_idx += cell['colspan']
+    if len(grid) == 0:
+        return [], parser.tables
+    num_rows = max(r for r, _ in grid) + 1
+    num_cols = max(c for _, c in grid) + 1
+    return [[grid.get((r, c)) for c in range(num_cols)] for r in range(num_rows)], parser.tables
+
+
+def rows_to_markdown(rows):
+    lines = []
+    for row_idx, row in enumerate(rows):
+        lines.append('| ' + ' | '.join((cell or '').replace('|', '\\|') for cell in row) + ' |')
+        if row_idx == 0:
+            lines.append('|' + '|'.join('---' for _ in row) + '|')
+    return '\n'.join(lines)
+
+
+def table_confidence(rows, num_tables=1, max_cell_len=200):
+    """
+    How much a grid parsed from the table body can be trusted, from 0 to 1: one table of at least
+    2x2 cells, no holes left by the spans, mostly filled cells, and no paragraph-sized cells
+    (merged text the layout analysis failed to split).
+    """
+    if num_tables != 1 or len(rows) < 2 or len(rows[0]) < 2:
+        return 0.0
+    cells = [cell for row in rows for cell in row]
+    if any(cell is None for cell in cells):
+        return 0.0
+    if any(len(cell) > max_cell_len for cell in cells):
+        return 0.0
+    filled = sum(1 for cell in cells if len(cell) > 0) / len(cells)
+    header_filled = sum(1 for cell in rows[0] if len(cell) > 0) / len(rows[0])
+    return min(filled / 0.8, 1.0) * (0.5 + 0.5 * header_filled)
+
+
+def html_table_to_markdown(html):
+    """Return (markdown table, confidence) for a MinerU `table_body`."""
+    if not html or '<t' not in html:
+        return None, 0.0
+    rows, num_tables = html_table_to_rows(html)
+    # 去掉全空的列，例如 colspan 估计错误留下的空列
+    keep = [c for c in range(len(rows[0]) if rows else 0) if any(row[c] for row in rows)]
+    rows = [[row[c] for c in keep] for row in rows]
+    return rows_to_markdown(rows), table_confidence(rows, num_tables)
+
+
+if __name__ == '__main__':
+    html = '<table><tr><td rowspan="2">River</td><td colspan="2">Content (µg/L)</td></tr><tr><td>Cu</td><td>Co</td></tr><tr><td>Tigris</td><td>40</td><td>10</td></tr></table>'
+    markdown, confidence = html_table_to_markdown(html)
+    print(markdown)
+    print(confidence)
+    assert html_table_to_markdown('<table><tr><td>only one cell</td></tr></table>')[1] == 0.0
+    assert '| Tigris | 40 | 10 |' in markdown
@@ -0,0 +1,235 @@
+import sys
+sys.path.append(".")
+import os
+import json
+import time
+import hashlib
+from datetime import datetime
+from agents.paper_collector import PaperCollector
+from agents.paper_parser import PaperParser
+from agents.paper_reviewer import PaperReviewer, select_paper
+from agents.table_processor import TableProcessor
+from agents.data_extrator_checker import DataExtratorWithChecker
+from agents.data_merger import DataMerger
+from agents.data_analyst import DataAnalyst
+from agents.reporter import Reporter
+from workflow.streaming import StreamingPipeline
+from utils.logger import create_logger
+from utils.llm_cache import hash_file
+from utils.scheduler import get_scheduler
+
+
+def fingerprint_path(path):
+    """sha256 of a file, or of every file under a directory (names and contents)."""
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                h.update(os.path.relpath(file_path, path).encode('utf-8'))
+                h.update(hash_file(file_path).encode('utf-8'))
+    elif os.path.exists(path):
+        h.update(hash_file(path).encode('utf-8'))
+    else:
+        h.update(b'missing')
+    return h.hexdigest()
+
+
+def fingerprint_obj(obj):
+    return hashlib.sha256(json.dumps(obj, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    inputs/outputs are paths relative to save_dir. For per-paper stages, `paper_input` is the
+    json file holding one record per paper and `paper_files` lists the record fields that point
+    to files the stage reads; `paper_output` gives the per-paper output file.
+    """
+    def __init__(self, name, inputs, outputs, run, params=None, paper_input=None, paper_files=(), paper_output=None):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.params = params or {}
+        self.paper_input = paper_input
+        self.paper_files = paper_files
+        self.paper_output = paper_output
+
+
+class PipelineRunner:
+    """
+    Stage-graph runner for the Manalyzer workflow.
+
+    Every finished stage records a completion marker together with the fingerprint of its
+    inputs and parameters in `<save_dir>/pipeline_state.json`. Running again on the same
+    save_dir skips stages whose fingerprint is unchanged and whose outputs exist; per-paper
+    stages (table conversion and data extraction) only recompute papers whose inputs changed.
+
+    With streaming=True, parsing, review, selection, conversion and extraction run as one
+    per-paper streaming stage (see workflow/streaming.py).
+
+    With incremental=True, rerunning on an existing save_dir collects the papers published
+    since the last collection, numbers them after the existing ones and appends their rows to
+    meta_analysis.csv; papers that were already converted and extracted are not processed again.
+    """
+    def __init__(self, save_dir=None, field='science', data_dir='data', streaming=False, incremental=False, prescreen_top_k=-1, **collector_kwargs):
+        self.paper_collector = PaperCollector(field=field, save_dir=data_dir, resume_dir=save_dir, incremental=incremental, **collector_kwargs)
+        self.save_dir = self.paper_collector.get_save_dir()
+        self.field = field
+        self.streaming = streaming
+        self.incremental = incremental
+        self.prescreen_top_k = prescreen_top_k
+        self.state_path = os.path.join(self.save_dir, 'pipeline_state.json')
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as file:
+                self.state = json.load(file)
+        else:
+            self.state = {}
+        self.logger = create_logger('Pipeline', os.path.join(self.save_dir, 'log'))
+
+    def get_save_dir(self):
+        return self.save_dir
+
+    def _path(self, name):
+        return os.path.join(self.save_dir, name)
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+    def stage_fingerprint(self, stage):
+        return fingerprint_obj({
+            'params': stage.params,
+            'inputs': {name: fingerprint_path(self._path(name)) for name in stage.inputs},
+        })
+
+    def paper_fingerprints(self, stage):
+        with open(self._path(stage.paper_input), 'r', encoding='utf-8') as file:
+            paper_info_dict = json.load(file)
+        fingerprints = {}
+        for paper_idx, paper_info in paper_info_dict.items():
+            files = {k: fingerprint_path(paper_info[k]) for k in stage.paper_files if k in paper_info}
+            fingerprints[paper_idx] = fingerprint_obj({'params': stage.params, 'files': files})
+        return fingerprints
+
+    def run_stage(self, stage):
+        fingerprint = self.stage_fingerprint(stage)
+        record = self.state.get(stage.name, {})
+        outputs_exist = all(os.path.exists(self._path(name)) for name in stage.outputs)
+
+        if stage.paper_input is None:
+            if record.get('fingerprint') == fingerprint and outputs_exist:
+                self.logger.info(f'[{stage.name}] up to date, skipped')
+                return
+            self.logger.info(f'[{stage.name}] running')
+            stage.run()
+            self.state[stage.name] = {'fingerprint': fingerprint, 'finished_at': datetime.now().isoformat()}
+        else:
+            paper_fingerprints = self.paper_fingerprints(stage)
+            # 每篇论文的输出文件存在且指纹未变即可跳过，汇总输出缺失（上次中断）时也一样
+            done = dict(record.get('papers', {}))
+            stale_ids = [
+                paper_idx for paper_idx, paper_fingerprint in paper_fingerprints.items()
+                if done.get(paper_idx) != paper_fingerprint or not os.path.exists(self._path(stage.paper_output.format(paper_idx)))
+            ]
+            # 上次运行中断前已完成的论文：开始时待处理、指纹未变，输出文件在开始之后写出
+            resumed_ids = [
+                paper_idx for paper_idx in stale_ids
+                if record.get('pending', {}).get(paper_idx) == paper_fingerprints[paper_idx]
+                and os.path.exists(self._path(stage.paper_output.format(paper_idx)))
+                and os.path.getmtime(self._path(stage.paper_output.format(paper_idx))) >= record.get('started_at', float('inf'))
+            ]
+            if len(resumed_ids) > 0:
+                self.logger.info(f'[{stage.name}] {len(resumed_ids)} papers finished by the interrupted run are kept')
+                done.update({paper_idx: paper_fingerprints[paper_idx] for paper_idx in resumed_ids})
+                stale_ids = [paper_idx for paper_idx in stale_ids if paper_idx not in resumed_ids]
+            if record.get('fingerprint') == fingerprint and outputs_exist and len(stale_ids) == 0:
+                self.logger.info(f'[{stage.name}] up to date, skipped')
+                if len(record.get('recomputed', [])) > 0: # 之后的阶段只需处理本次运行重新计算的论文
+                    record['recomputed'] = []
+                    self._save_state()
+                return
+            self.logger.info(f'[{stage.name}] running on {len(stale_ids)}/{len(paper_fingerprints)} stale papers')
+            # 开始前记下待处理的论文和开始时间，中断后重跑时据此识别已完成的论文
+            recomputed = list(record.get('recomputed', [])) + resumed_ids if len(resumed_ids) > 0 else []
+            self.state[stage.name] = {**record, 'papers': done, 'pending': {paper_idx: paper_fingerprints[paper_idx] for paper_idx in stale_ids}, 'started_at': time.time(), 'recomputed': recomputed}
+            self._save_state()
+            stage.run(paper_ids=stale_ids)
+            self.state[stage.name] = {'fingerprint': fingerprint, 'finished_at': datetime.now().isoformat(), 'papers': paper_fingerprints, 'recomputed': recomputed + stale_ids}
+
+        self._save_state()
+        self.logger.info(f'[{stage.name}] finished')
+
+    def build_stages(self, topic_of_interest, table_template, field, paper_list=None, doi_list=None, paper_search_num=2, paper_num=10, token_budget=None):
+        save_dir = self.save_dir
+        collect_params = {'topic_of_interest': topic_of_interest, 'paper_list': paper_list, 'doi_list': doi_list, 'paper_search_num': paper_search_num}
+        if self.incremental:
+            collect_params['date'] = datetime.now().strftime('%Y-%m-%d') # 增量模式下每天最多重新检索一次
+        stages = [
+            Stage('collect', [], ['0_paper_info.json'],
+                  lambda: self.paper_collector(topic_of_interest, paper_list=paper_list, doi_list=doi_list, paper_search_num=paper_search_num),
+                  params=collect_params),
+            Stage('parse', ['0_paper_info.json'], ['1_content_list_info.json'],
+                  lambda: PaperParser(save_dir=save_dir)()),
+            Stage('review', ['1_content_list_info.json'], ['2_paper_score.json'],
+                  lambda: PaperReviewer(save_dir=save_dir, field=field, prescreen_top_k=self.prescreen_top_k)(topic_of_interest, table_template),
+                  params={'topic_of_interest': topic_of_interest, 'field': field, 'prescreen_top_k': self.prescreen_top_k, 'table_template': table_template if self.prescreen_top_k != -1 else None}),
+            Stage('select', ['2_paper_score.json'], ['3_selected_paper.json'],
+                  lambda: select_paper(save_dir, paper_num, token_budget),
+                  params={'paper_num': paper_num, 'token_budget': token_budget}),
+            Stage('convert', ['3_selected_paper.json'], ['4_converted_paper.json'],
+                  lambda paper_ids: TableProcessor(save_dir=save_dir, field=field)(paper_ids=paper_ids),
+                  params={'field': field},
+                  paper_input='3_selected_paper.json', paper_files=('content_list_path',), paper_output=os.path.join('2_text', '{}.json')),
+            Stage('extract', ['4_converted_paper.json'], ['5_integrated_table_info.json'],
+                  lambda paper_ids: DataExtratorWithChecker(save_dir=save_dir, field=field)(topic_of_interest=topic_of_interest, table_template=table_template, paper_ids=paper_ids),
+                  params={'topic_of_interest': topic_of_interest, 'table_template': table_template, 'field': field},
+                  paper_input='4_converted_paper.json', paper_files=('md_path', 'converted_text_path'), paper_output=os.path.join('3_integrated_table', '{}.json')),
+            Stage('merge', ['5_integrated_table_info.json', '3_integrated_table'], ['meta_analysis.csv'],
+                  lambda: DataMerger(save_dir=save_dir)(table_template, incremental=self.incremental, paper_ids=self.state.get('extract', {}).get('recomputed')),
+                  params={'table_template': table_template}),
+            Stage('analyse', ['meta_analysis.csv'], ['4_visualization'],
+                  lambda: DataAnalyst(save_dir=save_dir, field=field)(),
+                  params={'field': field}),
+            Stage('report', ['meta_analysis.csv', '5_integrated_table_info.json', '4_visualization'], ['meta_analysis_report.md'],
+                  lambda: Reporter(save_dir=save_dir, field=field)(topic_of_interest),
+                  params={'topic_of_interest': topic_of_interest, 'field': field}),
+        ]
+        if self.streaming:
+            stream = Stage('stream', ['0_paper_info.json'], ['1_content_list_info.json', '2_paper_score.json', '3_selected_paper.json', '4_converted_paper.json', '5_integrated_table_info.json'],
+                           lambda: StreamingPipeline(save_dir=save_dir, field=field, prescreen_top_k=self.prescreen_top_k)(topic_of_interest, table_template, paper_num=paper_num, token_budget=token_budget),
+                           params={'topic_of_interest': topic_of_interest, 'table_template': table_template, 'field': field, 'paper_num': paper_num, 'token_budget': token_budget, 'prescreen_top_k': self.prescreen_top_k})
+            stages = [stages[0], stream] + [stage for stage in stages if stage.name in ['merge', 'analyse', 'report']]
+        return stages
+
+    def __call__(self, topic_of_interest, table_template, field=None, paper_list=None, doi_list=None, paper_search_num=2, paper_num=10, token_budget=None):
+        if field is None:
+            field = self.field
+        stages = self.build_stages(topic_of_interest, table_template, field, paper_list, doi_list, paper_search_num, paper_num, token_budget)
+        self.logger.info(f'Running pipeline in {self.save_dir}')
+        for stage in stages:
+            self.run_stage(stage)
+        self.logger.info(f'Pipeline finished, report in {self._path("meta_analysis_report.md")}')
+        for model, metrics in get_scheduler().metrics().items():
+            self.logger.info(f'LLM scheduler [{model}]: {metrics}')
+
+
+if __name__ == '__main__':
+    # python workflow/pipeline.py data/environment/2025_0402_170228 [--incremental]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    save_dir = args[0] if len(args) > 0 else None
+    incremental = '--incremental' in sys.argv
+    table_template = """
+| River        | Location | Heavy metals | Content (µg/L) |
+|--------------|----------|--------------|----------------|
+| Tigris River | Turkey   | Cu           | 40             |
+| Tigris River | Turkey   | Co           | 10             |
+| Tiete River  | Brazil   | Fe           | 915            |
+"""
+    pipeline = PipelineRunner(save_dir=save_dir, field='environment', incremental=incremental)
+    pipeline('River pollutants', table_template, paper_list=['EU-wide survey of polar organic persistent pollutants in European river waters'], paper_search_num=1)
@@ -0,0 +1,236 @@
+import sys
+sys.path.append(".")
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from structai import multi_thread
+from agents.paper_parser import PaperParser
+from agents.paper_reviewer import PaperReviewer, select_paper, final_score
+from utils.selection import TopKSelector, estimate_extraction_tokens
+from agents.table_processor import TableProcessor
+from agents.data_extrator_checker import DataExtratorWithChecker
+from utils.logger import create_logger
+
+
+_DONE = object()
+
+
+class StreamingPipeline:
+    """
+    Per-paper streaming execution of the parse -> review -> convert -> extract stages.
+
+    Each paper moves through PaperParser.parse_paper, PaperReviewer.independent_review,
+    TableProcessor.convert_paper and DataExtratorWithChecker.extract_paper on its own,
+    connected by bounded queues, so a slow paper no longer holds back the others. Comparative
+    review batches are dispatched as soon as `batch_size` papers have been reviewed; with
+    comparative_rounds > 1 the extra random rounds run once all papers are reviewed. A failed
+    batch is logged and its papers are left without a Relative Score (and dropped), as in
+    PaperReviewer. The only global barriers left are the last comparative round,
+    `select_paper` and what follows it.
+
+    Papers whose independent Topic Relevance is below `min_relevance` are not converted or
+    extracted speculatively; if `select_paper` still picks them they are processed after
+    the barrier. Writes the same 1_... to 5_... files as the stage-by-stage workflow.
+
+    With prescreen_top_k != -1, only the top papers by BM25 over their collected fields (title,
+    abstract) are streamed at all, so off-topic papers are neither parsed nor reviewed.
+    """
+    def __init__(self, save_dir, field='science', queue_size=8, parse_workers=4, review_workers=8, convert_workers=4, extract_workers=4, min_relevance=5, prescreen_top_k=-1, comparative_rounds=1):
+        self.save_dir = save_dir
+        self.queue_size = queue_size
+        self.parse_workers = parse_workers
+        self.review_workers = review_workers
+        self.convert_workers = convert_workers
+        self.extract_workers = extract_workers
+        self.min_relevance = min_relevance
+
+        self.paper_parser = PaperParser(save_dir=save_dir)
+        self.paper_reviewer = PaperReviewer(save_dir=save_dir, field=field, content_list_info_dict={}, prescreen_top_k=prescreen_top_k, comparative_rounds=comparative_rounds)
+        self.table_processor = TableProcessor(save_dir=save_dir, field=field, paper_info_dict={})
+        self.data_extrator_with_checker = DataExtratorWithChecker(save_dir=save_dir, field=field, paper_info_dict={})
+        self.logger = create_logger('StreamingPipeline', os.path.join(save_dir, 'log'))
+
+        self._lock = threading.Lock()
+        self.content_list_info_dict = {}
+        self.paper_score_dict = {}
+        self.converted_paper_dict = {}
+        self.integrated_paper_dict = {}
+        self._comparative_batch = []
+        self._comparative_futures = []
+        self._relative_scores = {}
+        self._paper_dicts = {}
+
+    def _path(self, name):
+        return os.path.join(self.save_dir, name)
+
+    def _run_workers(self, name, func, in_queue, out_queue, num_workers):
+        """Start `num_workers` threads mapping `func` over in_queue; out_queue receives _DONE once all of them finish."""
+        def worker():
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    in_queue.put(_DONE) # 让同一阶段的其他 worker 也退出
+                    return
+                try:
+                    result = func(*item)
+                except Exception as e:
+                    self.logger.error(f'[{name}] paper {item[0]} failed [{e}]')
+                    continue
+                if result is not None and out_queue is not None:
+                    out_queue.put(result)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(num_workers)]
+        for t in threads:
+            t.start()
+
+        def closer():
+            for t in threads:
+                t.join()
+            if out_queue is not None:
+                out_queue.put(_DONE)
+        closer_thread = threading.Thread(target=closer, daemon=True)
+        closer_thread.start()
+        return closer_thread
+
+    def _submit_comparative_batch(self, force=False):
+        with self._lock:
+            if len(self._comparative_batch) == 0 or (not force and len(self._comparative_batch) < self.paper_reviewer.batch_size):
+                return
+            batch = self._comparative_batch
+            self._comparative_batch = []
+        self._comparative_futures.append(self.comparative_executor.submit(self._review_batch, batch))
+
+    def _review_batch(self, batch):
+        try:
+            scores = self.paper_reviewer.comparative_review([paper_dict for _, paper_dict in batch], self.topic_of_interest)
+        except Exception as e:
+            self.logger.error(f'Comparative review of papers {[paper_idx for paper_idx, _ in batch]} failed [{e}]')
+            return
+        with self._lock:
+            for (paper_idx, _), score in zip(batch, scores):
+                self._relative_scores.setdefault(paper_idx, []).append(score)
+                self.paper_score_dict[paper_idx]['Relative Score'] = sum(self._relative_scores[paper_idx]) / len(self._relative_scores[paper_idx])
+                cost = estimate_extraction_tokens(self.content_list_info_dict[paper_idx]) if self.token_budget is not None else 0
+                self.selector.push(paper_idx, final_score(self.paper_score_dict[paper_idx]), cost) # 评审过程中持续更新 top-K
+
+    def _submit_extra_rounds(self):
+        # 第一轮按到达顺序分批，其余轮次需要全部论文评审完后随机分批
+        if self.paper_reviewer.comparative_rounds <= 1:
+            return
+        paper_ids = [paper_idx for paper_idx in self.paper_parser.paper_info_dict if paper_idx in self._paper_dicts]
+        for batch in self.paper_reviewer.comparative_batches(paper_ids, first_round=False):
+            self._comparative_futures.append(self.comparative_executor.submit(self._review_batch, [(paper_idx, self._paper_dicts[paper_idx]) for paper_idx in batch]))
+
+    def parse(self, paper_idx, paper_info):
+        paper_info = self.paper_parser.parse_paper(dict(paper_info))
+        with self._lock:
+            self.content_list_info_dict[paper_idx] = paper_info
+        return paper_idx, dict(paper_info)
+
+    def review(self, paper_idx, paper_info):
+        paper_dict = self.paper_reviewer.load_paper(paper_info)
+        score = self.paper_reviewer.independent_review(paper_dict, self.topic_of_interest)
+        with self._lock:
+            self.paper_score_dict[paper_idx] = score
+            self._comparative_batch.append((paper_idx, paper_dict))
+            if self.paper_reviewer.comparative_rounds > 1:
+                self._paper_dicts[paper_idx] = paper_dict
+        self._submit_comparative_batch()
+        if score.get('Topic Relevance', 0) < self.min_relevance:
+            self.logger.info(f'Paper {paper_idx} Topic Relevance {score.get("Topic Relevance")} < {self.min_relevance}, deferred until selection')
+            return None
+        return paper_idx, paper_info
+
+    def convert(self, paper_idx, paper_info):
+        paper_info = self.table_processor.convert_paper(paper_idx, paper_info)
+        with self._lock:
+            self.converted_paper_dict[paper_idx] = paper_info['converted_text_path']
+        return paper_idx, dict(paper_info)
+
+    def extract(self, paper_idx, paper_info):
+        paper_info = self.data_extrator_with_checker.extract_paper(paper_idx, paper_info, self.topic_of_interest, self.table_template)
+        with self._lock:
+            self.integrated_paper_dict[paper_idx] = paper_info['integrated_table_path']
+            if len(self.integrated_paper_dict) == 1:
+                self.logger.info(f'First paper extracted after {time.time() - self.start_time:.1f}s')
+        return None
+
+    def __call__(self, topic_of_interest, table_template, paper_num=10, token_budget=None):
+        self.topic_of_interest = topic_of_interest
+        self.table_template = table_template
+        self.token_budget = token_budget
+        self.selector = TopKSelector(paper_num)
+        self.start_time = time.time()
+        self.comparative_executor = ThreadPoolExecutor(max_workers=self.paper_reviewer.comparative_workers)
+
+        parse_queue = queue.Queue()
+        review_queue = queue.Queue(maxsize=self.queue_size)
+        convert_queue = queue.Queue(maxsize=self.queue_size)
+        extract_queue = queue.Queue(maxsize=self.queue_size)
+
+        paper_info_dict = self.paper_reviewer.prescreener(self.paper_parser.paper_info_dict, topic_of_interest, table_template)
+        self.logger.info(f'Start streaming {len(paper_info_dict)} papers')
+        self._run_workers('parse', self.parse, parse_queue, review_queue, self.parse_workers)
+        self._run_workers('review', self.review, review_queue, convert_queue, self.review_workers)
+        self._run_workers('convert', self.convert, convert_queue, extract_queue, self.convert_workers)
+        extract_closer = self._run_workers('extract', self.extract, extract_queue, None, self.extract_workers)
+        for paper_idx, paper_info in paper_info_dict.items():
+            parse_queue.put((paper_idx, paper_info))
+        parse_queue.put(_DONE)
+
+        extract_closer.join()
+        self._submit_comparative_batch(force=True)
+        self._submit_extra_rounds()
+        for future in self._comparative_futures:
+            future.result()
+        self.comparative_executor.shutdown()
+        self.logger.info(f'Streaming finished in {time.time() - self.start_time:.1f}s, {len(self.integrated_paper_dict)} papers extracted')
+
+        # barrier: scores of all papers are known
+        content_list_info_dict = {k: self.content_list_info_dict[k] for k in self.paper_parser.paper_info_dict if k in self.content_list_info_dict}
+        with open(self._path('1_content_list_info.json'), 'w', encoding='utf-8') as f:
+            json.dump(content_list_info_dict, f, ensure_ascii=False, indent=4)
+
+        paper_score_dict = {}
+        for paper_idx in content_list_info_dict:
+            if paper_idx not in self.paper_score_dict or 'Relative Score' not in self.paper_score_dict[paper_idx]:
+                continue
+            paper_score = self.paper_score_dict[paper_idx]
+            paper_score['Final Score'] = final_score(paper_score)
+            paper_score.update(content_list_info_dict[paper_idx])
+            paper_score_dict[paper_idx] = paper_score
+        with open(self._path('2_paper_score.json'), 'w', encoding='utf-8') as f:
+            json.dump(paper_score_dict, f, ensure_ascii=False, indent=4)
+        self.paper_reviewer.logger.info(f'Reviewed {len(paper_score_dict)} papers')
+
+        selected_paper = select_paper(self.save_dir, paper_num, token_budget, selector=self.selector)
+
+        # selected papers that were deferred (or failed) in the stream are processed now
+        catch_up_ids = [paper_idx for paper_idx in selected_paper if paper_idx not in self.integrated_paper_dict]
+        if len(catch_up_ids) > 0:
+            self.logger.info(f'{len(catch_up_ids)} selected papers were not extracted during streaming, processing them now')
+            mp_inp_list = [{'paper_idx': paper_idx, 'paper_info': dict(selected_paper[paper_idx])} for paper_idx in catch_up_ids if paper_idx not in self.converted_paper_dict]
+            multi_thread(mp_inp_list, self.convert)
+            mp_inp_list = [{'paper_idx': paper_idx, 'paper_info': {**selected_paper[paper_idx], 'converted_text_path': self.converted_paper_dict[paper_idx]}} for paper_idx in catch_up_ids if paper_idx in self.converted_paper_dict]
+            multi_thread(mp_inp_list, self.extract)
+
+        converted_paper_dict = {}
+        integrated_paper_dict = {}
+        for paper_idx, paper_info in selected_paper.items():
+            if paper_idx not in self.converted_paper_dict:
+                continue
+            converted_paper_dict[paper_idx] = {**paper_info, 'converted_text_path': self.converted_paper_dict[paper_idx]}
+            if paper_idx in self.integrated_paper_dict:
+                integrated_paper_dict[paper_idx] = {**converted_paper_dict[paper_idx], 'integrated_table_path': self.integrated_paper_dict[paper_idx]}
+        with open(self._path('4_converted_paper.json'), 'w', encoding='utf-8') as f:
+            json.dump(converted_paper_dict, f, ensure_ascii=False, indent=4)
+        with open(self._path('5_integrated_table_info.json'), 'w', encoding='utf-8') as f:
+            json.dump(integrated_paper_dict, f, ensure_ascii=False, indent=4)
+        self.logger.info(f'{len(integrated_paper_dict)} selected papers extracted, saved in {self._path("5_integrated_table_info.json")}')
+        self.data_extrator_with_checker.log_extract_stats()
+        for agent in [self.paper_reviewer, self.table_processor, self.data_extrator_with_checker]:
+            agent.log_cache_stats()
+        self.paper_reviewer.log_scheduler_stats()